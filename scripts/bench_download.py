@@ -0,0 +1,127 @@
+"""
+Loopback benchmark for download_direct.
+
+Serves a file of random bytes from a local HTTP server (sendfile, so the
+client side is the bottleneck) and times download_direct on it, with and
+without MD5 verification. Numbers are only comparable on the same machine.
+
+    python scripts/bench_download.py --size 500 --runs 5
+    python scripts/bench_download.py --backend asyncio
+
+--src benchmarks another checkout, e.g. the commit before a change:
+
+    git worktree add /tmp/before <commit>~1
+    python scripts/bench_download.py --src /tmp/before/src
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parent.parent
+
+
+class FileHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def copyfile(self, source, outputfile):
+        outputfile.flush()
+        offset = 0
+        size = os.fstat(source.fileno()).st_size
+        while offset < size:
+            sent = os.sendfile(self.connection.fileno(), source.fileno(), offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+
+
+def make_file(path, size):
+    """Write size bytes of random data to path and return their MD5"""
+    hasher = hashlib.md5()
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        for _ in range(size // len(block)):
+            f.write(block)
+            hasher.update(block)
+        rest = block[:size % len(block)]
+        f.write(rest)
+        hasher.update(rest)
+    return hasher.hexdigest()
+
+
+def run_once(downloader_class, root, url, size, md5):
+    """One download into a clean directory; returns MB/s"""
+    out = root / 'out'
+    shutil.rmtree(out, ignore_errors=True)
+    d = downloader_class(
+        output_dir=out,
+        progress_callback=lambda progress: True,
+        status_callback=lambda message: None,
+    )
+    start = time.perf_counter()
+    path = d.download_direct(url, title='bench.pdf', md5=md5)
+    elapsed = time.perf_counter() - start
+    if path is None or Path(path).stat().st_size != size:
+        raise SystemExit("Download failed")
+    return size / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help="file size in MB (default 256)")
+    parser.add_argument('--runs', type=int, default=5, help="downloads per case (default 5)")
+    parser.add_argument('--backend', choices=['threads', 'asyncio'], default='threads')
+    parser.add_argument('--src', default=str(REPO / 'src'), help="source tree to benchmark (default this checkout)")
+    args = parser.parse_args()
+
+    root = Path(tempfile.mkdtemp(prefix='stacks-bench-'))
+    # Keep the downloader's cookie cache and logs out of the real config
+    os.environ['STACKS_PROJECT_ROOT'] = str(root)
+    shutil.copy(REPO / 'VERSION', root / 'VERSION')
+
+    sys.path.insert(0, args.src)
+    from stacks.downloader.downloader import AnnaDownloader
+    if args.backend == 'asyncio':
+        from stacks.downloader import aio
+        if not aio.available():
+            raise SystemExit("The asyncio backend needs aiohttp")
+        downloader_class = aio.AsyncAnnaDownloader
+    else:
+        downloader_class = AnnaDownloader
+
+    served = root / 'served'
+    served.mkdir()
+    size = args.size * 1024 * 1024
+    md5 = make_file(served / 'bench.bin', size)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), partial(FileHandler, directory=str(served)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/bench.bin"
+
+    try:
+        print(f"{args.size} MB over loopback, {args.backend} backend, {args.runs} runs, {args.src}")
+        for label, checksum in (('no md5', None), ('md5', md5)):
+            speeds = sorted(run_once(downloader_class, root, url, size, checksum) for _ in range(args.runs))
+            print(f"{label:7s} median {statistics.median(speeds):7.0f} MB/s  (min {speeds[0]:.0f}, max {speeds[-1]:.0f})")
+    finally:
+        if args.backend == 'asyncio':
+            # The shared session normally lives as long as the process
+            loop = aio.EventLoopThread.get()
+            loop.run(loop.session.close())
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,13 @@
 import logging
-import time
 from pathlib import Path
 from flask import (
     jsonify,
     request,
     current_app,
 )
-from stacks.constants import FAST_DOWNLOAD_API_URL, KNOWN_MD5, PROJECT_ROOT
+from stacks.constants import FAST_DOWNLOAD_API_URL, KNOWN_MD5
 from . import api_bp
 from stacks.utils.logutils import setup_logging
-from stacks.utils.migrationutils import migrate_incomplete_folder
 from stacks.security.auth import (
     require_auth,
     require_auth_with_permissions,
@@ -103,14 +101,7 @@ def api_config_test_key():
                 info = data.get('account_fast_download_info', {})
                 
                 # Update the worker's cached info with timestamp
-                worker = current_app.stacks_worker
-                if worker.downloader.fast_download_key == test_key:
-                    worker.downloader.fast_download_info.update({
-                        'available': True,
-                        'downloads_left': info.get('downloads_left'),
-                        'downloads_per_day': info.get('downloads_per_day'),
-                        'last_refresh': time.time()
-                    })
+                current_app.stacks_worker.update_fast_download_info(test_key, info)
                 
                 return jsonify({
                     'success': True,
@@ -185,54 +176,36 @@ def api_config_update():
             new_incomplete_path = config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
 
         # Handle incomplete folder migration if path changed
-        migration_occurred = False
+        migration_started = False
         if new_incomplete_path and new_incomplete_path != old_incomplete_path:
             logger.info(f"Incomplete folder path changed from {old_incomplete_path} to {new_incomplete_path}")
 
-            # Stop active downloads and wait for them to finish
-            if worker.queue.current_download:
-                logger.info("Cancelling active download for migration")
-                worker.pause()  # Pause queue to prevent new downloads
-                worker.cancel_and_requeue_current()  # Cancel current download
-
-                # Wait for download to actually stop
-                if not worker.wait_for_current_download_to_stop(timeout=10):
-                    logger.warning("Current download did not stop within timeout")
+            if worker.migrating():
+                migration = worker.get_migration_status()
+                if migration['to'] != new_incomplete_path:
+                    # Drop the changes applied above
+                    config.load()
+                    config.data = config.validate(config.data, config.schema)
                     return jsonify({
                         "success": False,
-                        "error": "Could not stop current download for migration"
-                    }), 500
-
-            # Perform migration
-            old_path = PROJECT_ROOT / old_incomplete_path.lstrip('/')
-            new_path = PROJECT_ROOT / new_incomplete_path.lstrip('/')
-
-            logger.info(f"Starting migration from {old_path} to {new_path}")
-            success, message, stats = migrate_incomplete_folder(old_path, new_path)
-
-            if not success:
-                logger.error(f"Migration failed: {message}")
-                logger.error(f"Migration stats: {stats}")
-                # Don't save config if migration failed
-                return jsonify({
-                    "success": False,
-                    "error": "Failed to change incomplete folder, see the logfile for details"
-                }), 500
+                        "error": "The incomplete folder is already being moved, try again when it is done"
+                    }), 409
+            else:
+                migration_started = True
 
-            logger.info(f"Migration completed: {message}")
-            logger.info(f"Migration stats: {stats}")
-            migration_occurred = True
+            # The worker switches to the new folder once the .part files are there
+            config.set('downloads', 'incomplete_folder_path', value=old_incomplete_path)
 
         # Save config
         config.save()
 
-        # Recreate downloader with new config (this will use the new path)
-        worker.update_config()
+        # Recreate downloader with new config, in whichever process runs the engine
+        current_app.stacks_engine.apply_config()
         setup_logging(config)
 
-        # Resume worker if we paused it
-        if migration_occurred and worker.paused:
-            worker.resume()
+        # Move .part files in the background (downloads stay paused until it is done)
+        if migration_started:
+            worker.start_migration(old_incomplete_path, new_incomplete_path)
 
         import copy
         cfg = copy.deepcopy(config.get_all())
@@ -242,12 +215,13 @@ def api_config_update():
             cfg["login"]["password"] = "***MASKED***"
 
         response_message = "Configuration updated"
-        if migration_occurred:
-            response_message = f"Configuration updated. {message}"
+        if migration_started:
+            response_message = "Configuration updated. Moving incomplete downloads to the new folder in the background"
 
         return jsonify({
             "success": True,
             "message": response_message,
+            "migration": migration_started,
             "config": cfg
         })
 
@@ -259,6 +233,17 @@ def api_config_update():
         }), 500
 
     
+@api_bp.route('/api/config/migration', methods=['GET'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_config_migration():
+    """Progress of the current or last incomplete folder migration"""
+    worker = current_app.stacks_worker
+    return jsonify({
+        'success': True,
+        'migration': worker.get_migration_status()
+    })
+
+
 @api_bp.route('/api/config', methods=['GET'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_config_get():
@@ -13,6 +13,48 @@ from stacks.security.auth import (
 
 logger = logging.getLogger("api")
 
+HISTORY_PAGE_DEFAULT = 50
+HISTORY_PAGE_MAX = 500
+
+@api_bp.route('/api/history', methods=['GET'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_history():
+    """Page through history, newest first"""
+    args = request.args
+
+    try:
+        cursor = int(args['cursor']) if args.get('cursor') else None
+        limit = int(args.get('limit', HISTORY_PAGE_DEFAULT))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'cursor and limit must be integers'}), 400
+    limit = max(1, min(limit, HISTORY_PAGE_MAX))
+
+    status = args.get('status')
+    if status not in (None, 'success', 'failed'):
+        return jsonify({'success': False, 'error': "status must be 'success' or 'failed'"}), 400
+
+    method = args.get('method')
+    if method not in (None, 'fast', 'mirror'):
+        return jsonify({'success': False, 'error': "method must be 'fast' or 'mirror'"}), 400
+
+    q = current_app.stacks_queue
+    items, next_cursor = q.query_history(
+        cursor=cursor,
+        limit=limit,
+        success=None if status is None else status == 'success',
+        method=method,
+        subfolder=args.get('subfolder'),
+        since=args.get('since'),
+        until=args.get('until')
+    )
+
+    return jsonify({
+        'success': True,
+        'items': items,
+        'next_cursor': next_cursor
+    })
+
+
 @api_bp.route('/api/history/clear', methods=['POST'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_history_clear():
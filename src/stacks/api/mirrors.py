@@ -0,0 +1,35 @@
+import logging
+
+from flask import (
+    current_app,
+    jsonify,
+)
+
+from . import api_bp
+from stacks.security.auth import (
+    require_auth_with_permissions,
+)
+
+logger = logging.getLogger("api")
+
+@api_bp.route('/api/mirrors', methods=['GET'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_mirrors():
+    """Mirror scoreboard used to order download links"""
+    worker = current_app.stacks_worker
+    return jsonify({
+        'success': True,
+        'mirrors': worker.get_mirror_stats()
+    })
+
+
+@api_bp.route('/api/mirrors/reset', methods=['POST'])
+@require_auth_with_permissions(allow_downloader=False)
+def api_mirrors_reset():
+    """Forget all mirror outcomes"""
+    worker = current_app.stacks_worker
+    worker.reset_mirror_stats()
+    return jsonify({
+        'success': True,
+        'message': 'Mirror scoreboard reset'
+    })
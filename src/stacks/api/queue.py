@@ -7,6 +7,12 @@ from flask import (
 )
 
 from . import api_bp
+from stacks.constants import (
+    QUEUE_BATCH_MAX_ITEMS,
+    QUEUE_PRIORITIES,
+    QUEUE_DEFAULT_PRIORITY,
+    QUEUE_BATCH_DEFAULT_PRIORITY,
+)
 from stacks.utils.md5utils import extract_md5
 from stacks.security.auth import (
     require_auth,
@@ -15,6 +21,21 @@ from stacks.security.auth import (
 
 logger = logging.getLogger("api")
 
+def _validate_subfolder(subfolder):
+    """Return subfolder if it is in the allowed list, otherwise None"""
+    if not subfolder:
+        return None
+
+    config = current_app.stacks_config
+    allowed_subdirs = config.get('downloads', 'subdirectories', default=None)
+
+    # If subfolder is provided but not in allowed list, ignore it (revert to default)
+    if allowed_subdirs and isinstance(allowed_subdirs, list) and subfolder in allowed_subdirs:
+        return subfolder
+
+    logger.warning(f"Subfolder '{subfolder}' not in allowed list, reverting to default")
+    return None
+
 @api_bp.route('/api/queue/remove', methods=['POST'])
 @require_auth_with_permissions(allow_downloader=False)
 def api_queue_remove():
@@ -52,10 +73,14 @@ def api_queue_add():
     data = request.json
     md5 = data.get('md5')
     subfolder = data.get('subfolder')
+    priority = data.get('priority') or QUEUE_DEFAULT_PRIORITY
 
     if not md5:
         return jsonify({'success': False, 'error': 'MD5 required'}), 400
 
+    if priority not in QUEUE_PRIORITIES:
+        return jsonify({'success': False, 'error': f'Priority must be one of: {", ".join(QUEUE_PRIORITIES)}'}), 400
+
     # Validate MD5
     extracted_md5 = extract_md5(md5)
 
@@ -63,30 +88,82 @@ def api_queue_add():
         return jsonify({'success': False, 'error': 'Invalid MD5 format'}), 400
 
     # Validate subfolder if provided
-    validated_subfolder = None
-    if subfolder:
-        config = current_app.stacks_config
-        allowed_subdirs = config.get('downloads', 'subdirectories', default=None)
-
-        # If subfolder is provided but not in allowed list, ignore it (revert to default)
-        if allowed_subdirs and isinstance(allowed_subdirs, list) and subfolder in allowed_subdirs:
-            validated_subfolder = subfolder
-        elif subfolder:
-            logger.warning(f"Subfolder '{subfolder}' not in allowed list, reverting to default")
+    validated_subfolder = _validate_subfolder(subfolder)
 
     # Add to queue
     q = current_app.stacks_queue
     success, message = q.add(
         extracted_md5,
         source=data.get('source'),
-        subfolder=validated_subfolder
+        subfolder=validated_subfolder,
+        priority=priority
     )
 
     return jsonify({
         'success': success,
         'message': message,
         'md5': extracted_md5,
-        'subfolder': validated_subfolder
+        'subfolder': validated_subfolder,
+        'priority': priority
+    })
+
+@api_bp.route('/api/queue/add_batch', methods=['POST'])
+@require_auth_with_permissions(allow_downloader=True)
+def api_queue_add_batch():
+    """Add many items to queue with a single lock and journal write"""
+    data = request.json or {}
+    items = data.get('items')
+
+    if not items or not isinstance(items, list):
+        return jsonify({'success': False, 'error': 'Items list required'}), 400
+
+    if len(items) > QUEUE_BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'At most {QUEUE_BATCH_MAX_ITEMS} items per batch'}), 400
+
+    default_subfolder = data.get('subfolder')
+    default_priority = data.get('priority') or QUEUE_BATCH_DEFAULT_PRIORITY
+    results = []
+    entries = []
+    pending = []
+
+    # Items are either plain MD5/URL strings or {"md5": ..., "subfolder": ...}
+    for raw in items:
+        if isinstance(raw, dict):
+            value = raw.get('md5')
+            subfolder = raw.get('subfolder', default_subfolder)
+            priority = raw.get('priority') or default_priority
+        else:
+            value = raw
+            subfolder = default_subfolder
+            priority = default_priority
+
+        result = {'input': value, 'md5': None, 'subfolder': None, 'priority': None}
+        results.append(result)
+
+        extracted_md5 = extract_md5(value) if isinstance(value, str) else None
+        if not extracted_md5:
+            result.update({'success': False, 'message': 'Invalid MD5 format'})
+            continue
+
+        if priority not in QUEUE_PRIORITIES:
+            result.update({'success': False, 'message': 'Invalid priority'})
+            continue
+
+        validated_subfolder = _validate_subfolder(subfolder)
+        result.update({'md5': extracted_md5, 'subfolder': validated_subfolder, 'priority': priority})
+        entries.append((extracted_md5, validated_subfolder, priority))
+        pending.append(result)
+
+    q = current_app.stacks_queue
+    for result, (success, message) in zip(pending, q.add_many(entries, source=data.get('source'))):
+        result.update({'success': success, 'message': message})
+
+    added = sum(1 for result in results if result['success'])
+    return jsonify({
+        'success': True,
+        'added': added,
+        'skipped': len(results) - added,
+        'results': results
     })
 
 @api_bp.route('/api/queue/pause', methods=['POST'])
@@ -97,6 +174,12 @@ def api_queue_pause():
 
     # Toggle pause state
     if worker.paused:
+        if worker.migrating():
+            return jsonify({
+                'success': False,
+                'paused': True,
+                'error': 'Downloads stay paused until the incomplete folder has been moved'
+            }), 409
         worker.resume()
         return jsonify({
             'success': True,
@@ -114,10 +197,11 @@ def api_queue_pause():
 @api_bp.route('/api/queue/current/cancel', methods=['POST'])
 @require_auth
 def api_current_cancel():
-    """Cancel and requeue current download"""
+    """Cancel and requeue the active download of md5, or all of them"""
     worker = current_app.stacks_worker
+    md5 = (request.get_json(silent=True) or {}).get('md5')
 
-    if worker.cancel_and_requeue_current():
+    if worker.cancel_and_requeue_current(md5):
         return jsonify({
             'success': True,
             'message': 'Download paused and added back to queue'
@@ -131,10 +215,11 @@ def api_current_cancel():
 @api_bp.route('/api/queue/current/remove', methods=['POST'])
 @require_auth
 def api_current_remove():
-    """Cancel and remove current download"""
+    """Cancel and remove the active download of md5, or all of them"""
     worker = current_app.stacks_worker
+    md5 = (request.get_json(silent=True) or {}).get('md5')
 
-    if worker.cancel_and_remove_current():
+    if worker.cancel_and_remove_current(md5):
         return jsonify({
             'success': True,
             'message': 'Stopping and removing current download'
@@ -1,6 +1,9 @@
+import json
+import time
+import zlib
 import logging
-from flask import jsonify, current_app
-from stacks.utils.logutils import LOG_BUFFER
+from flask import Response, jsonify, current_app, request
+from stacks.constants import EVENTS_KEEPALIVE
 
 from . import api_bp
 from stacks.security.auth import require_auth_with_permissions
@@ -27,21 +30,95 @@ def api_version():
 @api_bp.get("/api/logs")
 @require_auth_with_permissions(allow_downloader=False)
 def get_logfile():
-    """Return recent console logs"""
-    return jsonify({"lines": list(LOG_BUFFER)})
+    """Return recent console logs, or only those after a sequence number"""
+    after = request.args.get("after", type=int)
+    epoch = request.args.get("epoch") or None
+    logger_name = request.args.get("logger") or None
+
+    level = request.args.get("level")
+    if level:
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            return jsonify({"success": False, "error": "Unknown log level"}), 400
+    else:
+        level = None
+
+    # Downloads log in the engine process, which may not be this one
+    lines, seq, reset, epoch = current_app.stacks_engine.read_logs(after=after, level=level, logger=logger_name, epoch=epoch)
+    return jsonify({"lines": lines, "seq": seq, "reset": reset, "epoch": epoch})
+
+def _status_payload(q, w, since=None):
+    """Queue status plus worker state, as served by /api/status and /api/events"""
+    status = q.get_status(since=since)
+    status.update(w.get_status())
+    return status
 
 @api_bp.get("/api/status")
 @require_auth_with_permissions(allow_downloader=False)
 def api_status():
-    """Get current status"""
+    """Get current status, or only what changed since a version"""
+
+    q = current_app.stacks_queue
+    w = current_app.stacks_worker
+
+    since = request.args.get("since", type=int)
+    if since is not None:
+        return jsonify(_status_payload(q, w, since=since))
 
+    # Full status: splice the worker state into the queue's pre-serialized
+    # snapshot, so this never waits on the queue lock
+    tag, body = q.status_snapshot
+    extra = json.dumps(w.get_status(), separators=(",", ":")).encode()
+    etag = f"{tag}-{zlib.crc32(extra):08x}"
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(body[:-1] + b"," + extra[1:], mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+@api_bp.get("/api/events")
+@require_auth_with_permissions(allow_downloader=False)
+def api_events():
+    """Stream status changes as Server-Sent Events
+
+    The first event is the full status (or the changes after ?since=),
+    every later one the changes since the previous event. Progress ticks
+    are coalesced to one event per queue.progress_interval milliseconds.
+    """
     q = current_app.stacks_queue
     w = current_app.stacks_worker
+    cfg = current_app.stacks_config
+    since = request.args.get("since", type=int)
 
-    status = q.get_status()
+    def stream():
+        nonlocal since
+        ticks = None
+        last_sent = 0.0
 
-    w.refresh_fast_download_info_if_stale()
-    status["fast_download"] = w.get_fast_download_info()
-    status["paused"] = w.paused
+        while True:
+            if ticks is not None:
+                new_ticks = q.wait_for_update(ticks, timeout=EVENTS_KEEPALIVE)
+                if new_ticks == ticks:
+                    yield ": keepalive\n\n"
+                    continue
 
-    return jsonify(status)
+                # Let further ticks pile up until the interval has passed
+                interval = cfg.get("queue", "progress_interval", default=500) / 1000
+                remaining = last_sent + interval - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
+
+            # Read ticks before the status so a change in between is sent next time
+            ticks = q.ticks
+            status = _status_payload(q, w, since=since)
+            since = status["version"]
+            last_sent = time.monotonic()
+            yield f"event: status\ndata: {json.dumps(status, separators=(',', ':'))}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
@@ -4,6 +4,7 @@ Stacks配置管理模块
 使用YAML格式的配置文件，支持线程安全的配置操作。
 """
 
+import os
 import threading
 import logging
 import yaml
@@ -35,6 +36,7 @@ class Config:
         self.config_path = config_path      # 配置文件路径
         self.schema_path = schema_path      # 配置模式文件路径
         self.lock = threading.Lock()        # 线程锁，确保线程安全
+        self.mtime = None                   # 最后一次读写时文件的修改时间，用于发现其他进程的修改
 
         # 加载配置和模式
         self.load_schema()  # 加载配置模式（验证规则）
@@ -61,6 +63,7 @@ class Config:
                 with open(self.config_path, "r") as f:
                     # 使用YAML安全加载器，防止执行任意代码
                     self.data = yaml.safe_load(f) or {}
+                    self.mtime = os.fstat(f.fileno()).st_mtime_ns
                     logger.debug("配置已加载。")
             except FileNotFoundError:
                 # 配置文件不存在，创建空配置供后续填充
@@ -87,6 +90,30 @@ class Config:
                 # 保存配置，禁用流式样式以保持可读性，不排序键以保持顺序
                 yaml.dump(self.data, f, default_flow_style=False, sort_keys=False)
                 logger.debug("配置文件已保存。")
+            self.mtime = os.stat(self.config_path).st_mtime_ns
+
+    def refresh(self):
+        """
+        如果配置文件被其他进程修改过，重新加载并验证
+
+        Gunicorn 有多个工作进程，每个进程都有自己的配置对象。
+        某个进程通过网页保存设置后，其他进程在下一次请求时靠这个函数跟上。
+        只比较文件修改时间，没有变化时几乎没有开销。
+
+        Returns:
+            bool: 是否重新加载了配置
+        """
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.mtime:
+            return False
+
+        self.load()
+        self.data = self.validate(self.data, self.schema)
+        logger.debug("配置文件已被其他进程修改，已重新加载。")
+        return True
 
     def validate(self, data, schema):
         """
@@ -6,6 +6,9 @@ from stacks.constants import (
     DEFAULT_PASSWORD,
     LOG_LEVELS,
     INCLUDE_HASH_OPTIONS,
+    QUEUE_STORAGE_OPTIONS,
+    DOWNLOAD_BACKEND_OPTIONS,
+    RATE_LIMIT_FIELDS,
     RE_SECRET_KEY,
     RE_IPV4,
     RE_IPV6,
@@ -89,6 +92,40 @@ def _validate_path(value, path_type="incomplete_folder", incomplete_folder_path=
 
     return normalized_path
 
+def _validate_rate_limits(value):
+    """
+    验证并规范化按域名限速策略
+
+    Args:
+        value: 用户配置的字典，格式如 {"annas-archive.org": {"interval": 2, "burst": 1}}
+
+    Returns:
+        dict: 规范化后的策略，域名转为小写，缺少的字段补上默认值
+
+    处理逻辑：
+        - 域名必须是非空字符串，策略必须是字典，否则跳过并记录警告
+        - interval 可以是小数，burst 和 concurrency 必须是整数
+        - 超出 RATE_LIMIT_FIELDS 范围的字段会让整条策略被跳过
+    """
+    policies = {}
+    for domain, policy in value.items():
+        if not isinstance(domain, str) or not domain.strip() or not isinstance(policy, dict):
+            logger.warning(f"Skipping invalid rate limit for '{domain}'")
+            continue
+
+        normalized_policy = {}
+        for field, (min_value, max_value, default) in RATE_LIMIT_FIELDS.items():
+            field_value = policy.get(field, default)
+            numeric = (int, float) if field == "interval" else (int,)
+            if isinstance(field_value, bool) or not isinstance(field_value, numeric) or not min_value <= field_value <= max_value:
+                logger.warning(f"Skipping rate limit for '{domain}': {field} must be between {min_value} and {max_value}")
+                break
+            normalized_policy[field] = field_value
+        else:
+            policies[domain.strip().lower()] = normalized_policy
+
+    return policies
+
 def _validate(config: dict, schema: dict) -> dict:
     """
     主验证函数，根据配置模式验证用户配置
@@ -199,9 +236,12 @@ def _validate_value(value, rules, key, section=None, normalized=None):
         - URL: URL 地址，使用正则表达式验证格式
         - LOGGING: 日志级别，必须是预定义的日志级别之一
         - INCLUDE_HASH: 包含哈希选项，必须是预定义的选项之一
+        - QUEUE_STORAGE: 队列存储后端，必须是预定义的选项之一
+        - DOWNLOAD_BACKEND: 下载后端，必须是预定义的选项之一
         - BCRYPTHASH: bcrypt 哈希密码，验证格式并检查是否需要重置
         - PATH: 路径，调用 _validate_path 验证
         - PATH_LIST: 路径列表，验证列表中的每个路径
+        - RATE_LIMITS: 按域名限速策略，调用 _validate_rate_limits 验证
     
     验证流程：
         1. 遍历允许的类型列表
@@ -254,6 +294,14 @@ def _validate_value(value, rules, key, section=None, normalized=None):
                 if isinstance(value, str):
                     if value.lower() in INCLUDE_HASH_OPTIONS:
                         return value.lower()
+            case "QUEUE_STORAGE":
+                if isinstance(value, str):
+                    if value.lower() in QUEUE_STORAGE_OPTIONS:
+                        return value.lower()
+            case "DOWNLOAD_BACKEND":
+                if isinstance(value, str):
+                    if value.lower() in DOWNLOAD_BACKEND_OPTIONS:
+                        return value.lower()
             case "BCRYPTHASH":
                 if is_valid_bcrypt_hash(value) and not os.environ.get('RESET_ADMIN','').lower() == 'true':
                     return value
@@ -285,6 +333,9 @@ def _validate_value(value, rules, key, section=None, normalized=None):
                     return validated_subdirs
                 elif value is None:
                     return None
+            case "RATE_LIMITS":
+                if isinstance(value, dict):
+                    return _validate_rate_limits(value)
 
     return _apply_default(default, key, value)
 
@@ -131,6 +131,111 @@ QUEUE_FILE = CONFIG_PATH / "queue.json"
 - 就像图书馆的"借阅登记表"，记录谁要借什么书
 """
 
+# QUEUE_JOURNAL_FILE - 下载队列变更日志（只追加写入）
+QUEUE_JOURNAL_FILE = CONFIG_PATH / "queue.journal"
+"""
+【解释】
+- 每次队列变更（添加、删除、完成等）只在这里追加一行JSON
+- 后台定期把日志合并（压缩）进 queue.json，然后清空日志
+- 程序崩溃后启动时会先读 queue.json，再重放这里的变更
+- 就像图书馆的"流水账"，月底再誊写到正式登记表
+"""
+
+# QUEUE_DB_FILE - SQLite队列数据库（queue.storage 设为 sqlite 时使用）
+QUEUE_DB_FILE = CONFIG_PATH / "queue.db"
+"""
+【解释】
+- 队列和历史记录存放在SQLite表里，历史记录按md5、完成时间、成功与否建立索引
+- 启动时只读队列；历史记录留在表里，查重、翻页、筛选都直接用索引查询
+- 每次变更只是一条SQL语句，不需要重写整个文件
+- 第一次启用时会自动把 queue.json（和日志）导入进来
+- 路径示例：d:/workspace/stacks/config/queue.db
+"""
+
+# ENGINE_LOCK_FILE - 下载引擎的选举锁文件
+ENGINE_LOCK_FILE = CONFIG_PATH / "engine.lock"
+"""
+【解释】
+- Gunicorn 有多个工作进程，但下载队列和下载线程只能有一份
+- 哪个进程先锁住这个文件（flock），哪个进程就负责运行下载引擎
+- 其他进程在后台一直等这把锁，引擎进程退出时其中一个自动接手
+- 文件里记录当前引擎进程的PID，方便排查
+"""
+
+# ENGINE_SOCKET - 下载引擎的本地通信套接字（Unix socket）
+ENGINE_SOCKET = CONFIG_PATH / "engine.sock"
+"""
+【解释】
+- 不负责下载的Web进程通过这个套接字读写队列、暂停/恢复下载等
+- 连接需要用 api.session_secret 做认证，其他程序无法冒充
+- 就像前台（Web进程）通过对讲机和仓库（引擎进程）沟通
+"""
+
+# ENGINE_CONNECT_TIMEOUT - Web进程连不上引擎时最多等多久（秒）
+ENGINE_CONNECT_TIMEOUT = 15
+"""
+【解释】
+- 启动时引擎还在加载队列、测试FlareSolverr，可能要几秒
+- 引擎进程退出后，新引擎接手也需要一点时间
+- 超过这个时间还连不上，请求返回错误
+"""
+
+# ENGINE_POOL_SIZE - 每个Web进程最多保留几条空闲的引擎连接
+ENGINE_POOL_SIZE = 8
+
+# QUEUE_JOURNAL_COMPACT_ENTRIES - 日志达到多少条时立即触发压缩
+QUEUE_JOURNAL_COMPACT_ENTRIES = 5000
+"""
+【解释】
+- 正常情况下按 queue.compact_interval 定时压缩
+- 短时间内大量变更（如批量导入）时，达到这个条数就提前压缩
+- 防止日志文件无限增长，拖慢启动时的重放
+"""
+
+# QUEUE_BATCH_MAX_ITEMS - 批量添加接口单次最多接受的条目数
+QUEUE_BATCH_MAX_ITEMS = 10000
+"""
+【解释】
+- /api/queue/add_batch 一次最多提交10000个md5/链接
+- 超过上限的请求直接拒绝，防止一次请求占用队列锁太久
+"""
+
+# QUEUE_CHANGE_LOG_SIZE - 内存里保留多少条队列变更，供 /api/status?since= 增量返回
+QUEUE_CHANGE_LOG_SIZE = 1000
+"""
+【解释】
+- 每次队列或历史变更都会让版本号+1，并记一条变更
+- 网页带上自己手里的版本号来问"之后变了什么"，只返回这些变更
+- 版本太旧（变更已经被挤出去了）就返回完整状态
+"""
+
+# EVENTS_KEEPALIVE - /api/events 没有变化时多久发一次心跳（秒）
+EVENTS_KEEPALIVE = 15
+"""
+【解释】
+- 推送流长时间没有数据时，发一行注释保持连接
+- 防止代理服务器把"安静"的连接当成死连接断掉
+- 顺便发现已经关掉的浏览器标签，及时释放线程
+"""
+
+# MIRROR_SCOREBOARD_FILE - 镜像成绩表（每个镜像的成功率、速度等）
+MIRROR_SCOREBOARD_FILE = CONFIG_PATH / "mirrors.json"
+"""
+【解释】
+- 每次用镜像下载都记一笔：拿到下载链接花了多久、传输速度、失败原因、是否需要FlareSolverr
+- 重启后接着用，下载时按成绩给镜像排序
+- 删掉这个文件（或调用 /api/mirrors/reset）就从头开始统计
+"""
+
+# MIGRATION_STATE_FILE - 正在进行的"未完成文件夹"搬迁任务
+MIGRATION_STATE_FILE = CONFIG_PATH / "migration.json"
+"""
+【解释】
+- 修改 incomplete_folder_path 后，.part 文件在后台搬到新文件夹，期间下载暂停
+- 这个文件记着从哪搬到哪；搬完才把新路径写进 config.yaml，然后删掉这个文件
+- 搬到一半重启（或进程崩溃），启动时看到这个文件就接着搬，已经搬走的文件不会重复处理
+"""
+
 # CONFIG_FILE - 主配置文件（存放用户设置）
 CONFIG_FILE = CONFIG_PATH / "config.yaml"
 """
@@ -241,6 +346,175 @@ LOG_VIEW_LENGTH = 1000
 - 就像图书馆的"展示柜"，只展示最近1000条记录
 """
 
+# ================================
+# 🗄️ 队列存储后端选项
+# ================================
+# 定义下载队列保存在哪里
+QUEUE_STORAGE_OPTIONS = ["json", "sqlite"]
+"""
+【解释】
+- json = queue.json 快照 + 只追加的变更日志（默认）
+- sqlite = queue.db 数据库，适合很大的历史记录
+- 修改后需要重启才会生效
+"""
+
+# ================================
+# ⚙️ 下载后端选项
+# ================================
+# downloads.backend：文件传输用哪种方式
+DOWNLOAD_BACKEND_OPTIONS = ["threads", "asyncio"]
+"""
+【解释】
+- threads = 每个下载槽用 requests 在自己的线程里传输（默认）
+- asyncio = 文件传输改用 aiohttp，网络读取都在同一个事件循环里，写盘和回调交给线程池
+- asyncio 只换了传输方式：每个传输仍占着自己下载槽的线程，并发数还是 concurrent_downloads
+- asyncio 需要 aiohttp（pip install -r requirements-asyncio.txt，Docker 构建时 --build-arg REQUIREMENTS=requirements-asyncio.txt），没有安装时自动退回 threads
+- 网页抓取、FlareSolverr、镜像选择两种方式完全一样
+"""
+
+# ================================
+# 🧩 分段下载
+# ================================
+# downloads.segments > 1 时，支持 Range 的镜像会被切成几段同时下载
+# SEGMENT_MIN_SIZE - 每段最少多少字节，更小的文件不值得开多个连接
+SEGMENT_MIN_SIZE = 1024 * 1024
+# SEGMENT_MANIFEST_SUFFIX - 记录每段进度的清单文件，放在 .part 旁边
+SEGMENT_MANIFEST_SUFFIX = ".segments"
+# SEGMENT_MANIFEST_INTERVAL - 下载过程中多久保存一次清单（秒）
+SEGMENT_MANIFEST_INTERVAL = 2
+"""
+【解释】
+- 很多镜像按连接限速，多开几个连接总速度就上去了
+- .part 文件一开始就设成完整大小，每段写到自己的位置
+- 某个连接先干完了，就把剩得最多的那段劈一半接过来，慢连接不会拖住结尾
+- 中断后根据清单每段各自接着下；清单不存在就还是原来的单连接续传
+- 清单里也记着文件的 ETag/Last-Modified，每段请求都带 If-Range：服务器上的文件变了就从头下载
+"""
+
+# ================================
+# 📌 断点续传
+# ================================
+# PARTIAL_META_SUFFIX - .part 旁边的小文件，记录它是从哪个地址下的
+PARTIAL_META_SUFFIX = ".meta"
+"""
+【解释】
+- 未完成的文件按 MD5 命名（<md5>.part），不管书名、命名设置、书库里有没有同名文件，重新排队后都能接着下
+- 旁边的 <md5>.part.meta 记下 URL、ETag / Last-Modified、已下载字节数和文件总大小
+- 同一个地址续传时带上 If-Range：服务器上的文件变了就会整个重发，不会把新旧两份拼在一起
+- 换了镜像时这些标识没法比较，只核对文件总大小；最后还有 MD5 校验兜底
+- 旧版本按书名命名的 .part 文件会在第一次续传时改成新名字
+"""
+
+# ================================
+# 🚚 未完成文件夹搬迁
+# ================================
+# MIGRATION_WORKERS - 跨文件系统搬迁时同时复制几个文件
+MIGRATION_WORKERS = 4
+"""
+【解释】
+- 同一个文件系统内只是改名，一瞬间完成，一个一个来就行
+- 跨文件系统要真正复制数据，几个文件一起复制能把磁盘（尤其是网络存储）用满
+- 每个文件先复制到新文件夹里的隐藏临时文件，同步到磁盘后改成正式名字，最后才删旧文件
+"""
+
+# ================================
+# 🏁 镜像竞速
+# ================================
+# downloads.mirror_race > 1 时，同时打开几个镜像页面，用最先给出可用链接的那个
+# RACE_PROBE_BYTES - 拿到下载链接后先试读多少字节来测速
+RACE_PROBE_BYTES = 256 * 1024
+# RACE_PROBE_TIMEOUT - 试读最多花多少秒
+RACE_PROBE_TIMEOUT = 10
+# RACE_GRACE - 第一个镜像合格后，再等其他镜像多少秒比一比速度
+RACE_GRACE = 1.0
+"""
+【解释】
+- 以前一个镜像一个镜像地试，死掉的镜像要等30秒超时（可能还要过一次FlareSolverr）
+- 竞速时几个镜像同时解析，返回网页（text/html）或报错的镜像直接淘汰
+- 合格的镜像里取试读速度最快的，其他镜像不等了，没轮到的留给下一轮
+"""
+
+# ================================
+# 🏆 镜像排序
+# ================================
+# MIRROR_TYPICAL_SIZE - 估算"下载一本书要多久"时假设的文件大小（字节）
+MIRROR_TYPICAL_SIZE = 10 * 1024 * 1024
+# MIRROR_SCORE_DECAY - 每记一笔，这个镜像以前的成功/失败次数乘以这个系数
+MIRROR_SCORE_DECAY = 0.95
+# MIRROR_EWMA_WEIGHT - 新测到的耗时、速度在平均值里占的比重
+MIRROR_EWMA_WEIGHT = 0.3
+"""
+【解释】
+- 镜像得分 = 成功率 × 下载一个 MIRROR_TYPICAL_SIZE 大小文件的平均速度（含拿链接的时间）
+- 成功率每次排序都从 Beta 分布里随机抽一个值，记录少的镜像偶尔也会排到前面，这样才能发现它变快了
+- 没有速度记录的镜像按已知最快的速度估算，新镜像会先被试一试
+- 衰减让几天前的成绩慢慢不算数，镜像恢复后能重新排回前面
+"""
+
+# ================================
+# 🔌 镜像熔断
+# ================================
+# BREAKER_THRESHOLD - 同一个镜像连续失败几次后暂停使用
+BREAKER_THRESHOLD = 3
+# BREAKER_COOLDOWN - 暂停多少秒后再放一个下载去试探
+BREAKER_COOLDOWN = 300
+# BREAKER_MAX_COOLDOWN - 试探一直失败时，暂停时间每次翻倍，最多到这么多秒
+BREAKER_MAX_COOLDOWN = 3600
+# NEGATIVE_CACHE_TTL - 记住"这个镜像没有这本书"（404 或页面上没有下载链接）多少秒
+NEGATIVE_CACHE_TTL = 6 * 3600
+# NEGATIVE_CACHE_SIZE - 最多记多少条，满了先忘掉最早的
+NEGATIVE_CACHE_SIZE = 10000
+"""
+【解释】
+- 镜像挂了的时候，队列里每一本书都还要去等它30秒超时（可能还要过一次FlareSolverr）才换下一个
+- 熔断：连续失败 BREAKER_THRESHOLD 次就跳过这个镜像，冷却结束后只放一个下载去试探（半开）
+  试探成功就恢复正常，失败就再冷却更久
+- 找不到文件不算镜像坏了，不计入熔断，只记在"没有这本书"的缓存里，重试时直接跳过这个镜像
+- 这些状态只放在内存里，重启后重新开始
+"""
+
+# ================================
+# 🚦 队列优先级
+# ================================
+# 每个优先级一条独立的队列（车道），高优先级的车道先出队
+QUEUE_PRIORITIES = ["high", "normal", "low"]
+"""
+【解释】
+- high = 插队，最先下载
+- normal = 普通（/api/queue/add 默认）
+- low = 最后下载（/api/queue/add_batch 默认，批量导入不会挡住单本请求）
+- 同一条车道内仍然先进先出
+"""
+
+QUEUE_DEFAULT_PRIORITY = "normal"
+QUEUE_BATCH_DEFAULT_PRIORITY = "low"
+
+# ================================
+# ⏱️ 按域名限速
+# ================================
+# downloads.rate_limits 里每个域名的策略字段及取值范围 (最小值, 最大值, 默认值)
+RATE_LIMIT_FIELDS = {
+    "interval": (0, 3600, 0),
+    "burst": (1, 100, 1),
+    "concurrency": (0, 8, 0),
+}
+"""
+【解释】
+- interval = 每隔多少秒补充一个令牌（0 = 不限速率）
+- burst = 最多攒多少个令牌，空闲一段时间后可以连续发出这么多请求
+- concurrency = 同一个域名最多同时进行几个请求（0 = 不限）
+- 策略对域名及其子域名生效，"*" 对所有没有单独策略的域名生效
+- 没有策略的域名完全不限速，比如快速下载接口和正常的外部镜像
+"""
+
+# RATE_LIMIT_DEFAULT_DOMAIN - 没有配置 rate_limits 时，downloads.delay 只用来限制这个域名
+RATE_LIMIT_DEFAULT_DOMAIN = "annas-archive.org"
+"""
+【解释】
+- 以前每下载完一本都要全局等待 delay 秒，不管用的是哪个镜像
+- 现在只有访问 Anna's Archive（详情页、slow_download）时才按 delay 间隔排队
+"""
+
 # ================================
 # 🔐 文件名哈希包含选项
 # ================================
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import requests
+from stacks.downloader.downloader import AnnaDownloader
+from stacks.downloader.direct import download_direct
+from stacks.downloader.utils import ProgressTracker
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Bytes read from the socket per chunk
+CHUNK_SIZE = 64 * 1024
+# Bytes collected on the loop before a thread writes, hashes and reports them
+WRITE_BATCH = 1024 * 1024
+
+
+class EventLoopThread:
+    """
+    One asyncio event loop in a daemon thread, shared by all transfers.
+
+    Created on first use; the aiohttp session lives as long as the loop so
+    its connection pool is reused across downloads. The loop only does
+    network I/O: disk writes, hashing and callbacks run in its default
+    thread pool.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.thread = threading.Thread(target=self.loop.run_forever, name='download-loop', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coro):
+        """Run coro on the loop and block the calling thread for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def http(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None, connect=30, sock_read=30)
+            )
+        return self.session
+
+
+def available():
+    """True if the asyncio backend can be used (aiohttp is installed)"""
+    return aiohttp is not None
+
+
+def _write_batch(f, chunks, streamed, progress, downloaded, total_size):
+    """Write and hash chunks off the loop, then report progress; False means cancel"""
+    for chunk in chunks:
+        f.write(chunk)
+        if streamed:
+            streamed.update(chunk)
+    return progress.update(downloaded, total_size)
+
+
+def _request_headers(d, url, extra=None):
+    """Headers (user agent, cookies) the requests session would send to url"""
+    prepared = d.session.prepare_request(requests.Request('GET', url, headers=extra or {}))
+    return dict(prepared.headers)
+
+
+class AiohttpResponse:
+    """The parts of a requests response download_direct looks at, over an aiohttp response"""
+
+    def __init__(self, thread, response):
+        self.thread = thread
+        self.response = response
+        self.status_code = response.status
+        self.headers = response.headers
+
+    def close(self):
+        # The connection goes back to the pool on the loop
+        self.thread.loop.call_soon_threadsafe(self.response.release)
+
+
+class AiohttpTransport:
+    """
+    download_direct transport that streams bodies with aiohttp on the shared loop.
+
+    The slot thread keeps the resume, If-Range and retry logic of
+    download_direct and waits on the loop only for network reads. Chunks
+    are collected on the loop and handed to a thread in batches of
+    WRITE_BATCH bytes, so no file I/O, hashing or progress callback (which
+    takes the queue lock) blocks other transfers; aiohttp keeps reading
+    into its buffer while a batch is written.
+    """
+
+    def __init__(self, d):
+        self.d = d
+        self.thread = EventLoopThread.get()
+
+    def get(self, url, headers):
+        return AiohttpResponse(self.thread, self.thread.run(self._get(url, headers)))
+
+    async def _get(self, url, headers):
+        session = await self.thread.http()
+        try:
+            return await session.get(url, headers=_request_headers(self.d, url, headers))
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise requests.exceptions.ConnectionError(e)
+
+    def write_body(self, response, f, downloaded, total_size, streamed=None):
+        return self.thread.run(self._write_body(response.response, f, downloaded, total_size, streamed))
+
+    async def _write_body(self, response, f, downloaded, total_size, streamed):
+        progress = ProgressTracker(self.d, downloaded)
+        batch = []
+        batch_size = 0
+        error = None
+        try:
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                batch.append(chunk)
+                batch_size += len(chunk)
+                if batch_size < WRITE_BATCH:
+                    continue
+                downloaded += batch_size
+                if not await asyncio.to_thread(_write_batch, f, batch, streamed, progress, downloaded, total_size):
+                    return None
+                batch = []
+                batch_size = 0
+        except aiohttp.ClientPayloadError as e:
+            error = requests.exceptions.ChunkedEncodingError(e)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            error = requests.exceptions.ConnectionError(e)
+
+        # What arrived before an error is written too, for the resume
+        proceed = True
+        if batch:
+            downloaded += batch_size
+            proceed = await asyncio.to_thread(_write_batch, f, batch, streamed, progress, downloaded, total_size)
+        if error:
+            raise error
+        return downloaded if proceed else None
+
+
+class AsyncAnnaDownloader(AnnaDownloader):
+    """
+    AnnaDownloader whose file transfers run on a shared asyncio event loop.
+
+    This only changes the transport (see AiohttpTransport). Each transfer
+    still occupies its download slot's thread, which waits on the loop for
+    network reads, so concurrency is bounded by
+    downloads.concurrent_downloads exactly as with threads.
+    Page fetches, FlareSolverr, mirror selection and segmented downloads
+    stay on the requests session (cookies are shared with the transfers).
+    Progress and cancel callbacks are the same as for the threaded backend.
+    """
+
+    def download_direct(self, download_url, title=None, total_size=None, supports_resume=True, resume_attempts=3, md5=None, subfolder=None):
+        return download_direct(self, download_url, title, total_size, supports_resume, resume_attempts, md5, subfolder,
+                               transport=AiohttpTransport(self))
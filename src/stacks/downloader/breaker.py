@@ -0,0 +1,110 @@
+import threading
+import time
+from stacks.constants import (
+    BREAKER_THRESHOLD,
+    BREAKER_COOLDOWN,
+    BREAKER_MAX_COOLDOWN,
+    NEGATIVE_CACHE_TTL,
+    NEGATIVE_CACHE_SIZE,
+)
+
+
+class CircuitBreaker:
+    """
+    Skip mirrors that keep failing.
+
+    After BREAKER_THRESHOLD failures in a row a mirror is open: allow()
+    refuses it for BREAKER_COOLDOWN seconds. Once the cooldown is over
+    the mirror is half-open and allow() lets exactly one attempt through
+    as a probe. A success closes the mirror again; a failure reopens it
+    with twice the cooldown, up to BREAKER_MAX_COOLDOWN. A probe that
+    never reports back (cancelled download) is retried after another
+    cooldown. Mirrors are keyed like the scoreboard and the breaker is
+    shared by all download slots.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.circuits = {}
+
+    def allow(self, key):
+        """True if key may be tried now (claims the probe of a half-open mirror)"""
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit['retry_at'] is None:
+                return True
+            now = time.time()
+            if now < circuit['retry_at']:
+                return False
+            # Half-open: let this attempt through, hold back the others until it reports
+            circuit['retry_at'] = now + circuit['cooldown']
+            circuit['probing'] = True
+            return True
+
+    def success(self, key):
+        with self.lock:
+            self.circuits.pop(key, None)
+
+    def failure(self, key):
+        """Count a failure; returns True if the mirror was opened (again)"""
+        with self.lock:
+            circuit = self.circuits.setdefault(key, {'failures': 0, 'cooldown': 0, 'retry_at': None, 'probing': False})
+            circuit['failures'] += 1
+            if circuit['probing']:
+                circuit['probing'] = False
+                circuit['cooldown'] = min(circuit['cooldown'] * 2, BREAKER_MAX_COOLDOWN)
+            elif circuit['retry_at'] is None and circuit['failures'] >= BREAKER_THRESHOLD:
+                circuit['cooldown'] = BREAKER_COOLDOWN
+            else:
+                # Still closed, or an attempt that started before the mirror was opened
+                return False
+            circuit['retry_at'] = time.time() + circuit['cooldown']
+            return True
+
+    def state(self, key):
+        """'closed', 'open' or 'half_open', and when the mirror may be tried again"""
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit['retry_at'] is None:
+                return 'closed', None
+            if time.time() < circuit['retry_at']:
+                return 'open', circuit['retry_at']
+            return 'half_open', circuit['retry_at']
+
+    def reset(self):
+        with self.lock:
+            self.circuits = {}
+
+
+class NegativeCache:
+    """
+    (md5, mirror) pairs that had no copy of the file, remembered for
+    NEGATIVE_CACHE_TTL seconds so queued retries do not ask again. Holds
+    at most NEGATIVE_CACHE_SIZE entries, dropping the oldest first.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (md5, key) -> expiry, in insertion order
+        self.entries = {}
+
+    def add(self, md5, key):
+        with self.lock:
+            self.entries.pop((md5, key), None)
+            self.entries[(md5, key)] = time.time() + NEGATIVE_CACHE_TTL
+            while len(self.entries) > NEGATIVE_CACHE_SIZE:
+                del self.entries[next(iter(self.entries))]
+
+    def __contains__(self, item):
+        with self.lock:
+            expires = self.entries.get(item)
+            if expires is None:
+                return False
+            if time.time() >= expires:
+                del self.entries[item]
+                return False
+            return True
+
+    def reset(self):
+        with self.lock:
+            self.entries = {}
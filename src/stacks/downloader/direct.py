@@ -1,20 +1,195 @@
 import re
 import time
 import requests
-import shutil
+import urllib3
 import hashlib
 from pathlib import Path
 from urllib.parse import urlparse, unquote
+from stacks.constants import LEGAL_FILES
+from stacks.downloader.utils import ProgressTracker, preallocate, move_file, next_read_size, READ_MIN, READ_MAX
+from stacks.downloader.segmented import download_segmented, manifest_path
+from stacks.downloader.partial import partial_path, load_meta, save_meta, remove_meta, if_range, changed_size
+
+# Bytes read per call when hashing a file from disk
+HASH_READ_SIZE = 1024 * 1024
 
 def calculate_md5(filepath):
     """Calculate MD5 hash of a file."""
     hash_md5 = hashlib.md5()
     with open(filepath, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
+        for chunk in iter(lambda: f.read(HASH_READ_SIZE), b""):
             hash_md5.update(chunk)
     return hash_md5.hexdigest()
 
-def download_direct(d, download_url, title=None, total_size=None, supports_resume=True, resume_attempts=3, md5=None, subfolder=None):
+class StreamingMD5:
+    """MD5 of a .part file, updated with each chunk as it is written.
+
+    sync() is called before appending: it hashes whatever part of the file
+    is not covered yet (the partial file on resume) or starts over if the
+    file was restarted, so the checksum is ready when the last byte lands.
+    """
+
+    def __init__(self):
+        self.hasher = hashlib.md5()
+        self.size = 0
+
+    def sync(self, filepath, size):
+        """Make this the MD5 of the first size bytes of filepath"""
+        if size < self.size:
+            self.hasher = hashlib.md5()
+            self.size = 0
+        if size == self.size:
+            return
+        with open(filepath, 'rb') as f:
+            f.seek(self.size)
+            while self.size < size:
+                chunk = f.read(min(HASH_READ_SIZE, size - self.size))
+                if not chunk:
+                    raise OSError(f"{filepath} is shorter than {size} bytes")
+                self.update(chunk)
+
+    def update(self, chunk):
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()
+
+def target_paths(d, download_url, title=None, subfolder=None, md5=None):
+    """Final path (made unique) and .part path (named after md5 if given) for a download"""
+    # Determine filename
+    if not title:
+        d.logger.warning("No title provided, extracting from URL")
+        parsed_url = urlparse(download_url)
+        filename = unquote(Path(parsed_url.path).name)
+        if not filename:
+            filename = 'download.epub'  # Default fallback
+    else:
+        # Clean filename (remove invalid characters)
+        filename = re.sub(r'[<>:"/\\|?*]', '_', title)
+
+    # Validate extension - warn if suspicious but don't modify
+    file_ext = Path(filename).suffix.lower()
+
+    if not file_ext:
+        d.logger.warning(f"Filename has no extension: {filename}, adding .epub")
+        filename = filename + '.epub'
+    elif file_ext not in LEGAL_FILES:
+        d.logger.warning(f"Unusual file extension: {file_ext} (not in known legal files list)")
+
+    # Get unique path (with subfolder if specified)
+    if subfolder:
+        # Create subfolder if it doesn't exist
+        output_dir = d.output_dir / subfolder.lstrip('/')
+        output_dir.mkdir(parents=True, exist_ok=True)
+        base_final_path = output_dir / filename
+    else:
+        base_final_path = d.output_dir / filename
+    final_path = d.get_unique_filename(base_final_path)
+    return final_path, partial_path(d, md5, final_path)
+
+def write_body(d, response, f, downloaded, total_size, streamed=None):
+    """Write a streamed response body to f.
+
+    Reads into one reusable buffer with adaptive read sizes and checks
+    progress once per read instead of per chunk. Returns the new byte
+    count, or None if the progress callback asked to cancel.
+    """
+    progress = ProgressTracker(d, downloaded)
+
+    # Compressed bodies (servers that ignore Accept-Encoding) have to go through requests to be decoded
+    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+        for chunk in response.iter_content(chunk_size=READ_MAX):
+            f.write(chunk)
+            if streamed:
+                streamed.update(chunk)
+            downloaded += len(chunk)
+            if not progress.update(downloaded, total_size):
+                return None
+        return downloaded
+
+    view = memoryview(bytearray(READ_MAX))
+    size = READ_MIN
+    while True:
+        start = time.monotonic()
+        try:
+            count = response.raw.readinto(view[:size])
+        except urllib3.exceptions.ProtocolError as e:
+            raise requests.exceptions.ChunkedEncodingError(e)
+        except urllib3.exceptions.ReadTimeoutError as e:
+            raise requests.exceptions.ConnectionError(e)
+        if not count:
+            return downloaded
+
+        chunk = view[:count]
+        f.write(chunk)
+        if streamed:
+            streamed.update(chunk)
+        downloaded += count
+        if not progress.update(downloaded, total_size):
+            return None
+
+        size = next_read_size(size, count, time.monotonic() - start)
+
+class RequestsTransport:
+    """How download_direct fetches a body: the downloader's requests session and write_body.
+
+    Another transport needs get(url, headers) returning a response with
+    status_code, headers and close(), and write_body with the signature
+    and result of write_body above, raising requests exceptions.
+    """
+
+    def __init__(self, d):
+        self.d = d
+
+    def get(self, url, headers):
+        return self.d.session.get(url, headers=headers, stream=True, timeout=30)
+
+    def write_body(self, response, f, downloaded, total_size, streamed=None):
+        return write_body(self.d, response, f, downloaded, total_size, streamed)
+
+def finish_download(d, temp_path, final_path, md5=None, streamed=None):
+    """Verify the MD5 of a complete .part file and move it into place.
+
+    streamed is a StreamingMD5 fed while the file was written; without one
+    (or if it does not cover the whole file) the file is read back.
+    Returns the final path, or None if the checksum did not match.
+    """
+    # Verify MD5 hash if provided
+    if md5:
+        if streamed is not None and streamed.size == temp_path.stat().st_size:
+            file_md5 = streamed.hexdigest()
+        else:
+            if hasattr(d, 'status_callback'):
+                d.status_callback("Verifying MD5 checksum...")
+            d.logger.info("Verifying MD5 checksum...")
+            file_md5 = calculate_md5(temp_path)
+        if file_md5.lower() != md5.lower():
+            d.logger.error(f"MD5 mismatch: expected {md5}, got {file_md5}")
+            if hasattr(d, 'status_callback'):
+                d.status_callback("MD5 verification failed - file corrupted")
+            # Reset progress to 0%
+            if d.progress_callback:
+                d.progress_callback({
+                    'total_size': 0,
+                    'downloaded': 0,
+                    'percent': 0
+                })
+            temp_path.unlink()
+            remove_meta(temp_path)
+            return None
+        d.logger.info("MD5 checksum verified")
+
+    # Move to final location (another file may have taken the name during the download)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    final_path = d.get_unique_filename(final_path)
+    move_file(temp_path, final_path)
+    remove_meta(temp_path)
+
+    d.logger.info(f"Downloaded: {final_path.name}")
+    return final_path
+
+def download_direct(d, download_url, title=None, total_size=None, supports_resume=True, resume_attempts=3, md5=None, subfolder=None, transport=None):
     """Download a file directly from a URL with resume support.
 
     Args:
@@ -26,61 +201,75 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
         resume_attempts: Number of resume attempts
         md5: Expected MD5 hash for verification (optional)
         subfolder: Subfolder path to save file to (optional)
+        transport: Fetches the body (optional, RequestsTransport by default)
+
+    Sets d.received to the bytes fetched by this call.
     """
+    d.received = 0
+    transport = transport or RequestsTransport(d)
     try:
-        # Determine filename
-        if not title:
-            d.logger.warning("No title provided, extracting from URL")
-            parsed_url = urlparse(download_url)
-            filename = unquote(Path(parsed_url.path).name)
-            if not filename:
-                filename = 'download.epub'  # Default fallback
-        else:
-            # Clean filename (remove invalid characters)
-            filename = re.sub(r'[<>:"/\\|?*]', '_', title)
-
-        # Validate extension - warn if suspicious but don't modify
-        from stacks.constants import LEGAL_FILES
-        file_ext = Path(filename).suffix.lower()
-
-        if not file_ext:
-            d.logger.warning(f"Filename has no extension: {filename}, adding .epub")
-            filename = filename + '.epub'
-        elif file_ext not in LEGAL_FILES:
-            d.logger.warning(f"Unusual file extension: {file_ext} (not in known legal files list)")
-        
-        # Get unique path (with subfolder if specified)
-        if subfolder:
-            # Create subfolder if it doesn't exist
-            output_dir = d.output_dir / subfolder.lstrip('/')
-            output_dir.mkdir(parents=True, exist_ok=True)
-            base_final_path = output_dir / filename
-        else:
-            base_final_path = d.output_dir / filename
-        final_path = d.get_unique_filename(base_final_path)
-        temp_path = d.incomplete_dir / f"{final_path.name}.part"
-        
+        final_path, temp_path = target_paths(d, download_url, title, subfolder, md5)
+
+        # Several connections over byte ranges; a manifest left by an earlier
+        # segmented attempt is always continued that way
+        if supports_resume and (d.segments > 1 or manifest_path(temp_path).exists()):
+            complete = download_segmented(d, download_url, temp_path, resume_attempts)
+            if complete is not None:
+                return finish_download(d, temp_path, final_path, md5) if complete else None
+            d.logger.info("Server does not support range requests, using a single connection")
+
         # Check for partial download
         downloaded = 0
+        meta = {}
         if temp_path.exists() and supports_resume:
             downloaded = temp_path.stat().st_size
+            meta = load_meta(temp_path)
             d.logger.info(f"Found partial file: {downloaded}/{total_size if total_size else '?'} bytes")
-        
+            # Interrupted between the last byte and the move into place
+            if downloaded == meta.get('total_size'):
+                return finish_download(d, temp_path, final_path, md5)
+
+        # Checksum computed as the file is written
+        streamed = StreamingMD5() if md5 else None
+
         # Download with resume
         for attempt in range(resume_attempts):
             try:
-                headers = {}
+                # Continue from what an interrupted attempt got on disk
+                if attempt and supports_resume and temp_path.exists():
+                    downloaded = temp_path.stat().st_size
+
+                # No compression: the body is written as it comes and Range offsets must match the bytes on disk
+                headers = {'Accept-Encoding': 'identity'}
                 if downloaded > 0 and supports_resume:
                     headers['Range'] = f'bytes={downloaded}-'
+                    # The server sends the whole file instead if it changed since
+                    validator = if_range(meta, download_url)
+                    if validator:
+                        headers['If-Range'] = validator
                     d.logger.info(f"Resuming from byte {downloaded}")
 
-                response = d.session.get(download_url, headers=headers, stream=True, timeout=30)
+                response = transport.get(download_url, headers)
 
                 if downloaded > 0 and response.status_code not in [200, 206]:
                     d.logger.warning(f"Resume not supported (status {response.status_code}), starting fresh")
+                    response.close()
                     downloaded = 0
                     temp_path.unlink(missing_ok=True)
-                    response = d.session.get(download_url, stream=True, timeout=30)
+                    response = transport.get(download_url, {'Accept-Encoding': 'identity'})
+
+                # Without validators (another mirror) the file size is all there is to compare
+                if downloaded > 0 and response.status_code == 206 and changed_size(meta, response.headers):
+                    d.logger.warning("File on the server differs from the partial file, starting fresh")
+                    response.close()
+                    downloaded = 0
+                    response = transport.get(download_url, {'Accept-Encoding': 'identity'})
+
+                # A full response to a range request restarts the file
+                if response.status_code == 200 and downloaded > 0:
+                    if 'If-Range' in headers:
+                        d.logger.info("File changed on the server, starting fresh")
+                    downloaded = 0
 
                 # Get total size
                 if total_size is None:
@@ -93,84 +282,34 @@ def download_direct(d, download_url, title=None, total_size=None, supports_resum
                 
                 # Download
                 mode = 'ab' if downloaded > 0 else 'wb'
+                if streamed:
+                    streamed.sync(temp_path, downloaded)
 
-                # Track speed
-                start_time = time.time()
-                last_update_time = start_time
-                last_downloaded = downloaded
-                speed_samples = []  # Keep last few samples for smoothing
-
-                with open(temp_path, mode) as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-
-                            if d.progress_callback and total_size:
-                                current_time = time.time()
-                                time_diff = current_time - last_update_time
-
-                                # Update speed every 0.5 seconds to avoid excessive updates
-                                if time_diff >= 0.5:
-                                    bytes_diff = downloaded - last_downloaded
-                                    current_speed = bytes_diff / time_diff
-
-                                    # Keep last 5 samples for smoothing
-                                    speed_samples.append(current_speed)
-                                    if len(speed_samples) > 5:
-                                        speed_samples.pop(0)
-
-                                    # Average speed for smoother display
-                                    avg_speed = sum(speed_samples) / len(speed_samples)
-
-                                    percent = (downloaded / total_size) * 100
-                                    should_continue = d.progress_callback({
-                                        'total_size': total_size,
-                                        'downloaded': downloaded,
-                                        'percent': round(percent, 1),
-                                        'speed': int(avg_speed)
-                                    })
-
-                                    # Check if callback returned False (cancel signal)
-                                    if should_continue is False:
-                                        if hasattr(d, 'status_callback'):
-                                            d.status_callback("Stopping download...")
-                                        return None
-
-                                    last_update_time = current_time
-                                    last_downloaded = downloaded
+                # Where the bytes come from, so a later resume can tell if the file changed
+                resumable = response.status_code in (200, 206)
+                try:
+                    with open(temp_path, mode) as f:
+                        offset = f.tell()
+                        if resumable:
+                            meta = save_meta(d, temp_path, download_url, response.headers, total_size, downloaded)
+                        try:
+                            if total_size:
+                                preallocate(f, total_size, keep_size=True)
+                            downloaded = transport.write_body(response, f, downloaded, total_size, streamed)
+                        finally:
+                            d.received += f.tell() - offset
+                            if resumable:
+                                meta = save_meta(d, temp_path, download_url, response.headers, total_size, f.tell())
+                finally:
+                    response.close()
+                if downloaded is None:
+                    return None
                 
                 # Verify complete
                 if total_size and downloaded < total_size:
                     raise Exception(f"Incomplete download: {downloaded}/{total_size} bytes")
 
-                # Verify MD5 hash if provided
-                if md5:
-                    if hasattr(d, 'status_callback'):
-                        d.status_callback("Verifying MD5 checksum...")
-                    d.logger.info("Verifying MD5 checksum...")
-                    file_md5 = calculate_md5(temp_path)
-                    if file_md5.lower() != md5.lower():
-                        d.logger.error(f"MD5 mismatch: expected {md5}, got {file_md5}")
-                        if hasattr(d, 'status_callback'):
-                            d.status_callback("MD5 verification failed - file corrupted")
-                        # Reset progress to 0%
-                        if d.progress_callback:
-                            d.progress_callback({
-                                'total_size': 0,
-                                'downloaded': 0,
-                                'percent': 0
-                            })
-                        temp_path.unlink()
-                        return None
-                    d.logger.info("MD5 checksum verified")
-
-                # Move to final location
-                final_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(temp_path), str(final_path))
-
-                d.logger.info(f"Downloaded: {final_path.name}")
-                return final_path
+                return finish_download(d, temp_path, final_path, md5, streamed)
                 
             except requests.exceptions.ChunkedEncodingError:
                 if attempt < resume_attempts - 1 and supports_resume:
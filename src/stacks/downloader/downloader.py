@@ -1,3 +1,4 @@
+import copy
 import logging
 import requests
 from pathlib import Path
@@ -7,14 +8,19 @@ from stacks.downloader.direct import download_direct
 from stacks.downloader.fast_download import try_fast_download, get_fast_download_info, refresh_fast_download_info
 from stacks.downloader.flaresolver import solve_with_flaresolverr
 from stacks.downloader.html import get_download_links, parse_download_link_from_html
-from stacks.downloader.mirrors import download_from_mirror
+from stacks.downloader.mirrors import download_from_mirror, resolve_mirror
 from stacks.downloader.orchestrator import orchestrate_download
+from stacks.downloader.ratelimit import DomainRateLimiter
+from stacks.downloader.scoreboard import MirrorScoreboard
+from stacks.downloader.breaker import CircuitBreaker, NegativeCache
 from stacks.downloader.utils import get_unique_filename
 
 class AnnaDownloader:
     def __init__(self, output_dir="./downloads", incomplete_dir=None, progress_callback=None,
                  fast_download_config=None, flaresolverr_url=None, flaresolverr_timeout=60000,
-                 status_callback=None, prefer_title_naming=False, include_hash="none"):
+                 status_callback=None, prefer_title_naming=False, include_hash="none", rate_limiter=None,
+                 segments=1, mirror_race=1, scoreboard=None,
+                 breaker=None, negative_cache=None):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -63,6 +69,23 @@ class AnnaDownloader:
         self.prefer_title_naming = prefer_title_naming
         self.include_hash = include_hash  # "none", "prefix", or "suffix"
 
+        # Connections per file for servers that accept range requests
+        self.segments = segments
+
+        # Mirrors resolved at the same time before a transfer starts (1 = one after another)
+        self.mirror_race = mirror_race
+
+        # Bytes the last download_direct call got over the network (not what was already on disk)
+        self.received = 0
+
+        # Per-domain rate limits, shared with the other download slots
+        self.rate_limiter = rate_limiter or DomainRateLimiter()
+
+        # Mirror outcomes used to order links, shared with the other download slots
+        self.scoreboard = scoreboard or MirrorScoreboard()
+        self.breaker = breaker or CircuitBreaker()
+        self.negative_cache = negative_cache or NegativeCache()
+
         if flaresolverr_url:
             self.logger.info(f"FlareSolverr enabled: {flaresolverr_url}")
             self.logger.info("Using ALL download sources (Anna's Archive slow_download + external mirrors)")
@@ -121,6 +144,9 @@ class AnnaDownloader:
     def download_from_mirror(self, mirror_url, mirror_type, md5, title=None, resume_attempts=3, subfolder=None):
         return download_from_mirror(self, mirror_url, mirror_type, md5, title, resume_attempts, subfolder)
 
+    def resolve_mirror(self, mirror_url, mirror_type, md5, outcome=None):
+        return resolve_mirror(self, mirror_url, mirror_type, md5, outcome)
+
 
     # Utils
     def extract_md5(self, input_string):
@@ -129,6 +155,13 @@ class AnnaDownloader:
     def get_unique_filename(self, base_path):
         return get_unique_filename(self, base_path)
 
+    def for_slot(self, progress_callback=None, status_callback=None):
+        """Shallow copy with its own callbacks, sharing the session and fast download state"""
+        slot = copy.copy(self)
+        slot.progress_callback = progress_callback
+        slot.status_callback = status_callback
+        return slot
+
     def cleanup(self):
         """Cleanup resources (close session, etc.)"""
         try:
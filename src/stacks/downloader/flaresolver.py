@@ -1,4 +1,40 @@
+import threading
 import requests
+from stacks.downloader.utils import is_cancelled
+
+# Seconds between cancel checks while FlareSolverr is solving
+CANCEL_POLL = 0.5
+
+def _post(d, payload):
+    """POST payload to FlareSolverr on a helper thread; None if d was cancelled first.
+
+    A solve can take up to flaresolverr_timeout, so the caller is released
+    as soon as it is cancelled (a mirror race was decided, or the download
+    stopped) and the abandoned answer is dropped.
+    """
+    result = {}
+
+    def post():
+        try:
+            result['response'] = requests.post(
+                f"{d.flaresolverr_url}/v1",
+                json=payload,
+                timeout=d.flaresolverr_timeout / 1000 + 10
+            )
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=post, daemon=True)
+    thread.start()
+    while True:
+        thread.join(CANCEL_POLL)
+        if not thread.is_alive():
+            break
+        if is_cancelled(d):
+            return None
+    if 'error' in result:
+        raise result['error']
+    return result['response']
 
 def solve_with_flaresolverr(d, url):
     """Use FlareSolverr to bypass DDoS-Guard/Cloudflare protection."""
@@ -14,11 +50,10 @@ def solve_with_flaresolverr(d, url):
             "maxTimeout": d.flaresolverr_timeout
         }
         
-        response = requests.post(
-            f"{d.flaresolverr_url}/v1",
-            json=payload,
-            timeout=d.flaresolverr_timeout / 1000 + 10
-        )
+        response = _post(d, payload)
+        if response is None:
+            d.logger.info("FlareSolverr: Cancelled, not waiting for the solution")
+            return False, {}, None
         response.raise_for_status()
         
         data = response.json()
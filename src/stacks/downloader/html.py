@@ -2,6 +2,7 @@ import re
 from urllib.parse import urlparse, urljoin
 from bs4 import BeautifulSoup
 from stacks.downloader.sites.zlib import parse_zlib_download_link, is_zlib_domain
+from stacks.downloader.utils import is_cancelled
 from stacks.constants import LEGAL_FILES
 
 def parse_download_link_from_html(d, html_content, md5, mirror_url=None):
@@ -120,7 +121,10 @@ def get_download_links(d, md5):
     url = f"https://annas-archive.org/md5/{md5}"
 
     try:
-        response = d.session.get(url, timeout=30)
+        with d.rate_limiter.limit(url, cancelled=lambda: is_cancelled(d)) as acquired:
+            if not acquired:
+                return "Unknown", []
+            response = d.session.get(url, timeout=30)
         response.raise_for_status()
 
         soup = BeautifulSoup(response.text, 'html.parser')
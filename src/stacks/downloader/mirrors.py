@@ -1,14 +1,51 @@
+import requests
+from stacks.downloader.utils import is_cancelled
+from stacks.downloader.scoreboard import FAILURE_TIMEOUT, FAILURE_CHALLENGE, FAILURE_NO_LINK, FAILURE_NOT_FOUND, FAILURE_ERROR
+
+def _failed(outcome, failure):
+    outcome['failure'] = failure
+    return None
+
+def _failure_class(e):
+    if isinstance(e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return FAILURE_TIMEOUT
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.status_code == 404:
+        return FAILURE_NOT_FOUND
+    return FAILURE_ERROR
+
 def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_attempts=3, subfolder=None):
     """
-    Download from any mirror with stale cookie handling.
+    Download from any mirror: resolve its download link, then fetch the file.
+
+    Args:
+        subfolder: Subfolder path to save file to (optional)
+    """
+    download_link = resolve_mirror(d, mirror_url, mirror_type, md5)
+    if not download_link:
+        return None
+
+    if hasattr(d, 'status_callback'):
+        d.status_callback("Downloading file...")
+    return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+
+def resolve_mirror(d, mirror_url, mirror_type, md5, outcome=None):
+    """
+    Get the file's download link from a mirror page, with stale cookie handling.
 
     Logic:
     - slow_download: Use pre-warmed cookies with direct HTTP requests
     - external_mirror: Try direct, use FlareSolverr on 403 (with cookie refresh)
 
-    Args:
-        subfolder: Subfolder path to save file to (optional)
+    Returns the download link, or None if the mirror did not yield one.
+    If given, outcome is filled with 'failure' (a scoreboard failure class)
+    and 'flaresolverr' (whether a challenge had to be solved). Once d's
+    progress callback asks to cancel, no further requests or challenge
+    solves are started and None is returned without a failure.
     """
+    outcome = {} if outcome is None else outcome
+    outcome['flaresolverr'] = False
+    if is_cancelled(d):
+        return None
     try:
         if mirror_type == 'slow_download':
             d.logger.debug("Accessing slow download (via cookies)")
@@ -27,19 +64,24 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                 if response.status_code in [403, 503]:
                     if not d.flaresolverr_url:
                         d.logger.warning(f"Got {response.status_code} but no FlareSolverr configured")
-                        return None
+                        return _failed(outcome, FAILURE_CHALLENGE)
 
+                    if is_cancelled(d):
+                        return None
                     d.logger.warning(f"Got {response.status_code}, solving challenge with FlareSolverr...")
 
                     if hasattr(d, 'status_callback'):
                         d.status_callback("Solving CAPTCHA with FlareSolverr...")
 
                     # Solve challenge for THIS specific URL
+                    outcome['flaresolverr'] = True
                     success, cookies, html_content = d.solve_with_flaresolverr(mirror_url)
 
                     if not success:
+                        if is_cancelled(d):
+                            return None
                         d.logger.error("FlareSolverr failed")
-                        return None
+                        return _failed(outcome, FAILURE_CHALLENGE)
 
                     if hasattr(d, 'status_callback'):
                         d.status_callback("Extracting download link...")
@@ -47,13 +89,10 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                     download_link = d.parse_download_link_from_html(html_content, md5, mirror_url)
                     if not download_link:
                         d.logger.warning("Could not find download link")
-                        return None
-
-                    if hasattr(d, 'status_callback'):
-                        d.status_callback("Downloading file...")
+                        return _failed(outcome, FAILURE_NO_LINK)
 
-                    d.logger.info("Found download URL via FlareSolverr, downloading...")
-                    return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+                    d.logger.info("Found download URL via FlareSolverr")
+                    return download_link
 
                 response.raise_for_status()
 
@@ -63,17 +102,14 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                 download_link = d.parse_download_link_from_html(response.text, md5, mirror_url)
                 if not download_link:
                     d.logger.warning("Could not find download link")
-                    return None
+                    return _failed(outcome, FAILURE_NO_LINK)
 
-                if hasattr(d, 'status_callback'):
-                    d.status_callback("Downloading file...")
-
-                d.logger.info("Found download URL, downloading...")
-                return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+                d.logger.info("Found download URL")
+                return download_link
 
             except Exception as e:
                 d.logger.error(f"Error accessing slow_download page: {e}")
-                return None
+                return _failed(outcome, _failure_class(e))
         
         else:  # external_mirror
             d.logger.debug(f"Accessing external mirror: {mirror_url}")
@@ -86,6 +122,8 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
 
                 # If 403, refresh cookies and retry
                 if response.status_code == 403:
+                    if is_cancelled(d):
+                        return None
                     if d.flaresolverr_url:
                         d.logger.warning("Got 403 - trying to refresh cookies")
 
@@ -107,16 +145,16 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                                 download_link = d.parse_download_link_from_html(response.text, md5, mirror_url)
                                 if not download_link:
                                     d.logger.warning("Could not find download link")
-                                    return None
+                                    return _failed(outcome, FAILURE_NO_LINK)
 
-                                if hasattr(d, 'status_callback'):
-                                    d.status_callback("Downloading file...")
-
-                                return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+                                return download_link
 
                         # If cookie refresh failed or still got 403, use FlareSolverr
+                        if is_cancelled(d):
+                            return None
                         if hasattr(d, 'status_callback'):
                             d.status_callback("Solving CAPTCHA with FlareSolverr...")
+                        outcome['flaresolverr'] = True
                         success, cookies, html_content = d.solve_with_flaresolverr(mirror_url)
 
                         if success:
@@ -124,14 +162,14 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                                 d.status_callback("Extracting download link...")
                             download_link = d.parse_download_link_from_html(html_content, md5, mirror_url)
                             if download_link:
-                                if hasattr(d, 'status_callback'):
-                                    d.status_callback("Downloading file...")
-                                d.logger.info("Found download URL via FlareSolverr, downloading...")
-                                return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
-                        return None
+                                d.logger.info("Found download URL via FlareSolverr")
+                                return download_link
+                        elif is_cancelled(d):
+                            return None
+                        return _failed(outcome, FAILURE_NO_LINK if success else FAILURE_CHALLENGE)
                     else:
                         d.logger.warning("Got 403 but FlareSolverr not configured")
-                        return None
+                        return _failed(outcome, FAILURE_CHALLENGE)
 
                 response.raise_for_status()
 
@@ -141,17 +179,14 @@ def download_from_mirror(d, mirror_url, mirror_type, md5, title=None, resume_att
                 download_link = d.parse_download_link_from_html(response.text, md5, mirror_url)
                 if not download_link:
                     d.logger.warning("Could not find download link")
-                    return None
-
-                if hasattr(d, 'status_callback'):
-                    d.status_callback("Downloading file...")
+                    return _failed(outcome, FAILURE_NO_LINK)
 
-                return d.download_direct(download_link, title=title, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+                return download_link
 
             except Exception as e:
                 d.logger.error(f"Error accessing external mirror: {e}")
-                return None
+                return _failed(outcome, _failure_class(e))
     
     except Exception as e:
         d.logger.error(f"Error downloading from mirror: {e}")
-        return None
\ No newline at end of file
+        return _failed(outcome, FAILURE_ERROR)
\ No newline at end of file
@@ -1,12 +1,115 @@
-import random
+import time
+from stacks.downloader.utils import is_cancelled as _is_cancelled, record_attempt
+from stacks.downloader.race import race_mirrors
+from stacks.downloader.scoreboard import mirror_key, FAILURE_TRANSFER
 
-def _is_cancelled(d):
-    """Check if download should be cancelled via progress callback"""
-    if hasattr(d, 'progress_callback') and d.progress_callback:
-        should_continue = d.progress_callback({'check_only': True})
-        return should_continue is False
+
+def _next_mirror(d, links, preferred):
+    """Pick the next mirror to try, favouring domains that are not rate limited right now.
+
+    Preferred mirrors keep their position; the user asked for them first.
+    """
+    if links[0] in preferred:
+        return links.pop(0)
+    for i, link in enumerate(links):
+        if link in preferred:
+            break
+        if d.rate_limiter.ready(link['url']):
+            return links.pop(i)
+    return links.pop(0)
+
+def _mirror_name(mirror_link):
+    return mirror_link.get('text', mirror_link.get('domain', 'Unknown'))
+
+def _allowed(d, mirror_link):
+    """Ask the circuit breaker whether to try mirror_link now"""
+    if d.breaker.allow(mirror_key(mirror_link)):
+        return True
+    d.logger.info(f"Skipping mirror {_mirror_name(mirror_link)}: failing recently, cooling down")
     return False
 
+def _try_mirror(d, mirror_link, position, total, md5, filename, resume_attempts, subfolder, resolved):
+    """Resolve and download one mirror, holding its domain's rate limit slot
+
+    A link in resolved (from a mirror race it lost) is used as it is.
+    """
+    mirror_name = _mirror_name(mirror_link)
+    d.logger.info(f"Trying mirror {position}/{total}: {mirror_name}")
+
+    if hasattr(d, 'status_callback'):
+        d.status_callback(f"Accessing mirror {position}/{total}: {mirror_name}")
+
+    if not d.rate_limiter.ready(mirror_link['url']):
+        d.logger.debug(f"Waiting for rate limit: {mirror_link['domain']}")
+        if hasattr(d, 'status_callback'):
+            d.status_callback(f"Waiting for rate limit: {mirror_name}")
+
+    with d.rate_limiter.limit(mirror_link['url'], cancelled=lambda: _is_cancelled(d)) as acquired:
+        if not acquired:
+            return None
+
+        outcome = {}
+        known = resolved.pop(mirror_link['url'], None)
+        if known:
+            d.logger.info(f"Using the link resolved during the race for {mirror_name}")
+            download_link, link_time, outcome['flaresolverr'] = known
+        else:
+            start = time.monotonic()
+            download_link = d.resolve_mirror(mirror_link['url'], mirror_link['type'], md5, outcome)
+            link_time = time.monotonic() - start
+        if not download_link:
+            if not _is_cancelled(d):
+                record_attempt(d, mirror_link, md5, False, failure=outcome.get('failure'),
+                               flaresolverr=outcome['flaresolverr'])
+            return None
+
+        if hasattr(d, 'status_callback'):
+            d.status_callback("Downloading file...")
+        return _transfer(d, mirror_link, download_link, link_time, outcome['flaresolverr'],
+                         md5, filename, resume_attempts, subfolder)
+
+def _transfer(d, mirror_link, download_link, link_time, flaresolverr, md5, filename, resume_attempts, subfolder):
+    """Download a resolved link and record how the mirror did"""
+    start = time.monotonic()
+    filepath = d.download_direct(download_link, title=filename, resume_attempts=resume_attempts, md5=md5, subfolder=subfolder)
+    elapsed = time.monotonic() - start
+
+    if filepath:
+        # Only what came over the network: a resumed or already complete .part says nothing about the mirror
+        record_attempt(d, mirror_link, md5, True, link_time=link_time,
+                       speed=d.received / max(elapsed, 0.001), flaresolverr=flaresolverr)
+    elif not _is_cancelled(d):
+        record_attempt(d, mirror_link, md5, False, failure=FAILURE_TRANSFER,
+                       link_time=link_time, flaresolverr=flaresolverr)
+    return filepath
+
+def _race_mirrors(d, batch, md5, filename, resume_attempts, subfolder, resolved):
+    """Resolve batch concurrently and download from the winner
+
+    Returns (filepath, unfinished mirrors to try again); links of mirrors
+    that lost are kept in resolved.
+    """
+    names = ", ".join(_mirror_name(mirror_link) for mirror_link in batch)
+    d.logger.info(f"Racing {len(batch)} mirrors: {names}")
+    if hasattr(d, 'status_callback'):
+        d.status_callback(f"Racing {len(batch)} mirrors...")
+
+    winner, unfinished = race_mirrors(d, batch, md5, resolved)
+    if winner is None:
+        return None, unfinished
+
+    mirror_link, download_link, link_time, flaresolverr, key = winner
+    try:
+        mirror_name = _mirror_name(mirror_link)
+        d.logger.info(f"Downloading from race winner: {mirror_name}")
+        if hasattr(d, 'status_callback'):
+            d.status_callback(f"Downloading file from {mirror_name}...")
+        filepath = _transfer(d, mirror_link, download_link, link_time, flaresolverr,
+                             md5, filename, resume_attempts, subfolder)
+    finally:
+        d.rate_limiter.release(key)
+    return filepath, unfinished
+
 def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3, filename=None, links=None, subfolder=None):
     """Download a file from Anna's Archive.
 
@@ -66,18 +169,30 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
 
     d.logger.info(f"Found {len(links)} mirror(s)")
 
+    # Mirrors that recently had no copy of this file
+    missing = [link for link in links if (md5, mirror_key(link)) in d.negative_cache]
+    if missing:
+        d.logger.info(f"Skipping {len(missing)} mirror(s) that did not have this file recently")
+        links = [link for link in links if link not in missing]
+
 
-    # Preferred mirror
+    # Preferred mirror first, the rest by how they did before (with some exploration)
+    preferred = []
     if prefer_mirror:
         preferred = [link for link in links if prefer_mirror.lower() in link['domain'].lower()]
         others = [link for link in links if prefer_mirror.lower() not in link['domain'].lower()]
-        links = preferred + others
+        links = preferred + d.scoreboard.rank(others)
     else:
-        # Shuffle to spread load across mirrors (unless user has preference)
-        random.shuffle(links)
-
-    # Try each mirror
-    for i, mirror_link in enumerate(links):
+        links = d.scoreboard.rank(links)
+
+    # Try each mirror (or race a few at a time), skipping ahead to domains that have capacity
+    total = len(links)
+    remaining = list(links)
+    # Mirror url -> (download link, link time, flaresolverr) resolved by races but not used yet
+    resolved = {}
+    tried = 0
+    attempted = False
+    while remaining:
         # Check if download was cancelled
         if _is_cancelled(d):
             if hasattr(d, 'status_callback'):
@@ -85,20 +200,25 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
             d.logger.info("Download cancelled")
             return False, False, None
 
-        mirror_name = mirror_link.get('text', mirror_link.get('domain', 'Unknown'))
-        d.logger.info(f"Trying mirror {i+1}/{len(links)}: {mirror_name}")
-
-        if hasattr(d, 'status_callback'):
-            d.status_callback(f"Accessing mirror {i+1}/{len(links)}: {mirror_name}")
-
-        filepath = d.download_from_mirror(
-            mirror_link['url'],
-            mirror_link['type'],
-            md5,
-            title=filename,
-            resume_attempts=resume_attempts,
-            subfolder=subfolder
-        )
+        if d.mirror_race > 1 and len(remaining) > 1:
+            batch = [_next_mirror(d, remaining, preferred) for _ in range(min(d.mirror_race, len(remaining)))]
+            allowed = [mirror_link for mirror_link in batch if _allowed(d, mirror_link)]
+            tried += len(batch) - len(allowed)
+            if not allowed:
+                continue
+            filepath, unfinished = _race_mirrors(d, allowed, md5, filename, resume_attempts, subfolder, resolved)
+            # Mirrors the race did not get to are tried again later
+            remaining[:0] = unfinished
+            tried += len(allowed) - len(unfinished)
+            attempt = "Mirror race"
+        else:
+            mirror_link = _next_mirror(d, remaining, preferred)
+            tried += 1
+            if not _allowed(d, mirror_link):
+                continue
+            attempt = f"Mirror {_mirror_name(mirror_link)}"
+            filepath = _try_mirror(d, mirror_link, tried, total, md5, filename, resume_attempts, subfolder, resolved)
+        attempted = True
 
         if filepath:
             d.logger.info("Download successful")
@@ -112,11 +232,14 @@ def orchestrate_download(d, input_string, prefer_mirror=None, resume_attempts=3,
                     d.status_callback("Stopping download...")
                 return False, False, None
 
-            d.logger.warning(f"Mirror {mirror_name} failed")
-            if i < len(links) - 1:
+            d.logger.warning(f"{attempt} failed")
+            if remaining:
                 d.logger.info("Trying next mirror...")
                 if hasattr(d, 'status_callback'):
                     d.status_callback("Mirror failed, trying next mirror...")
 
-    d.logger.error("All mirrors failed")
-    return False, False, None
\ No newline at end of file
+    if attempted:
+        d.logger.error("All mirrors failed")
+    else:
+        d.logger.error("No mirror to try: all are cooling down or recently lacked this file")
+    return False, False, None
@@ -0,0 +1,99 @@
+import json
+import os
+from stacks.constants import PARTIAL_META_SUFFIX, SEGMENT_MANIFEST_SUFFIX
+
+
+def partial_path(d, md5, final_path):
+    """.part path of a download: keyed by md5 when known, else by the file name.
+
+    A partial file left under the old name-based scheme is renamed to the
+    md5 name (with its segment manifest) so it is still resumed.
+    """
+    legacy = d.incomplete_dir / f"{final_path.name}.part"
+    if not md5:
+        return legacy
+
+    temp_path = d.incomplete_dir / f"{md5.lower()}.part"
+    if not temp_path.exists() and legacy.exists():
+        d.logger.info(f"Resuming partial file {legacy.name} as {temp_path.name}")
+        legacy_manifest = legacy.with_name(legacy.name + SEGMENT_MANIFEST_SUFFIX)
+        if legacy_manifest.exists():
+            os.replace(legacy_manifest, temp_path.with_name(temp_path.name + SEGMENT_MANIFEST_SUFFIX))
+        os.replace(legacy, temp_path)
+    return temp_path
+
+
+def meta_path(temp_path):
+    """Sidecar with where temp_path was downloaded from"""
+    return temp_path.with_name(temp_path.name + PARTIAL_META_SUFFIX)
+
+
+def load_meta(temp_path):
+    """Sidecar of temp_path as a dict (empty if missing or unreadable)"""
+    try:
+        with open(meta_path(temp_path)) as f:
+            meta = json.load(f)
+        return meta if isinstance(meta, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_meta(d, temp_path, url, headers, total_size, downloaded):
+    """Write the sidecar of temp_path atomically from a response's headers and return it"""
+    meta = {
+        'url': url,
+        **validators(headers),
+        'total_size': total_size,
+        'bytes': downloaded,
+    }
+    path = meta_path(temp_path)
+    try:
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError as e:
+        d.logger.warning(f"Could not save resume info for {temp_path.name}: {e}")
+    return meta
+
+
+def remove_meta(temp_path):
+    meta_path(temp_path).unlink(missing_ok=True)
+
+
+def validators(headers):
+    """ETag and Last-Modified of a response, as the sidecar and segment manifest keep them"""
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+
+def changed_validators(meta, current):
+    """True if two records of the same url (sidecar, manifest) disagree on ETag or Last-Modified"""
+    if meta.get('url') != current.get('url'):
+        return False
+    return any(meta.get(key) and current.get(key) and meta[key] != current[key] for key in ('etag', 'last_modified'))
+
+
+def if_range(meta, url):
+    """If-Range value for resuming from url, or None if the sidecar cannot vouch for it.
+
+    Validators only mean something to the server that sent them, and weak
+    ETags are not allowed in If-Range.
+    """
+    if meta.get('url') != url:
+        return None
+    etag = meta.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return meta.get('last_modified')
+
+
+def range_total(headers):
+    """Full file size from a Content-Range header (bytes start-end/total), or None"""
+    total = headers.get('Content-Range', '').rpartition('/')[2]
+    return int(total) if total.isdigit() else None
+
+
+def changed_size(meta, headers):
+    """True if a 206 response is for a file of another size than the partial one"""
+    total = range_total(headers)
+    return bool(meta.get('total_size') and total and total != meta['total_size'])
@@ -0,0 +1,160 @@
+import queue
+import threading
+import time
+from stacks.constants import RACE_PROBE_BYTES, RACE_PROBE_TIMEOUT, RACE_GRACE
+from stacks.downloader.utils import is_cancelled, record_attempt
+from stacks.downloader.scoreboard import mirror_key, FAILURE_TRANSFER
+
+
+def probe_link(d, url):
+    """Throughput (bytes/s) of the first bytes of url, or None if it does not serve a file"""
+    start = time.monotonic()
+    received = 0
+    try:
+        headers = {'Range': f'bytes=0-{RACE_PROBE_BYTES - 1}'}
+        with d.session.get(url, headers=headers, stream=True, timeout=RACE_PROBE_TIMEOUT) as response:
+            if response.status_code not in (200, 206):
+                d.logger.debug(f"Probe of {url} returned status {response.status_code}")
+                return None
+            # A page instead of the file is an error or a challenge
+            if response.headers.get('Content-Type', '').startswith('text/html'):
+                d.logger.debug(f"Probe of {url} returned a web page")
+                return None
+
+            for chunk in response.iter_content(chunk_size=16384):
+                received += len(chunk)
+                if received >= RACE_PROBE_BYTES or time.monotonic() - start > RACE_PROBE_TIMEOUT:
+                    break
+    except Exception as e:
+        d.logger.debug(f"Probe of {url} failed: {e}")
+        return None
+
+    if not received:
+        return None
+    return received / max(time.monotonic() - start, 0.001)
+
+
+def race_mirrors(d, mirrors, md5, resolved=None):
+    """Resolve mirrors at the same time and pick the download link to use.
+
+    Each mirror is resolved on its own thread (holding its rate limit slot)
+    and its link probed with probe_link(). The first working link opens a
+    RACE_GRACE window in which a faster one can still win; mirrors that
+    have not finished by then are told to stop (resolve_mirror and
+    FlareSolverr check the racer's cancel callback) and abandoned.
+
+    resolved maps mirror URLs to (download_link, link_time, flaresolverr)
+    of links resolved before: those mirrors are only probed, and working
+    links of mirrors that lose are added so a later attempt can skip
+    resolving them again.
+
+    Returns (winner, unfinished): winner is (mirror, download_link,
+    link_time, flaresolverr, key) where key is the rate limit slot the
+    caller must release after the transfer, or None; unfinished are the
+    mirrors that did not fail and may be tried again. Failures are
+    recorded with record_attempt(); the winner's result is left to the caller.
+    """
+    resolved = {} if resolved is None else resolved
+    known = {mirror['url']: resolved.pop(mirror['url']) for mirror in mirrors if mirror['url'] in resolved}
+    results = queue.Queue()
+    lock = threading.Lock()
+    closed = False
+    race_over = threading.Event()
+
+    def stopped():
+        return race_over.is_set() or is_cancelled(d)
+
+    def racer(mirror):
+        racer_d = d.for_slot(lambda progress: not stopped(), lambda message: None)
+        acquired, key = d.rate_limiter.acquire(mirror['url'], cancelled=stopped)
+        link = speed = None
+        outcome = {'flaresolverr': False}
+        start = time.monotonic()
+        if acquired:
+            if mirror['url'] in known:
+                link, link_time, outcome['flaresolverr'] = known[mirror['url']]
+            else:
+                link = racer_d.resolve_mirror(mirror['url'], mirror['type'], md5, outcome)
+                link_time = time.monotonic() - start
+            if link and not stopped():
+                speed = probe_link(racer_d, link)
+                if speed is None:
+                    outcome['failure'] = FAILURE_TRANSFER
+                else:
+                    # Serving files, even if another mirror wins
+                    d.breaker.success(mirror_key(mirror))
+
+            # Abandoned racers are not counted against their mirror
+            if 'failure' in outcome and not stopped():
+                record_attempt(d, mirror, md5, False, failure=outcome['failure'],
+                               link_time=link_time if link else None, flaresolverr=outcome['flaresolverr'])
+            outcome['link_time'] = link_time
+
+        with lock:
+            if not closed:
+                results.put((mirror, link, speed, outcome, key))
+                return
+        # Abandoned: nobody will read the result
+        d.rate_limiter.release(key)
+
+    for mirror in mirrors:
+        threading.Thread(target=racer, args=(mirror,), daemon=True).start()
+
+    def keep(mirror, link, outcome):
+        """Remember the working link of a mirror that lost"""
+        resolved[mirror['url']] = (link, outcome['link_time'], outcome['flaresolverr'])
+
+    best = None
+    failed = []
+    deadline = None
+    pending = len(mirrors)
+    while pending:
+        timeout = 0.5 if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            mirror, link, speed, outcome, key = results.get(timeout=timeout)
+        except queue.Empty:
+            if (deadline is not None and time.monotonic() >= deadline) or is_cancelled(d):
+                break
+            continue
+
+        pending -= 1
+        name = mirror.get('text', mirror.get('domain', 'Unknown'))
+        if speed is None:
+            d.logger.info(f"Mirror {name} dropped out of the race")
+            failed.append(mirror)
+            d.rate_limiter.release(key)
+            continue
+
+        d.logger.info(f"Mirror {name} ready at {speed / 1024:.0f} KiB/s")
+        if best is None or speed > best[2]:
+            if best is not None:
+                d.rate_limiter.release(best[3])
+                keep(best[0], best[1], best[4])
+            best = (mirror, link, speed, key, outcome)
+            if deadline is None:
+                deadline = time.monotonic() + RACE_GRACE
+        else:
+            d.rate_limiter.release(key)
+            keep(mirror, link, outcome)
+
+    with lock:
+        closed = True
+    race_over.set()
+    # Results that arrived after the race ended
+    while not results.empty():
+        mirror, link, speed, outcome, key = results.get()
+        d.rate_limiter.release(key)
+        if speed is not None:
+            keep(mirror, link, outcome)
+
+    if best is not None and is_cancelled(d):
+        d.rate_limiter.release(best[3])
+        best = None
+
+    winner = (best[0], best[1], best[4]['link_time'], best[4]['flaresolverr'], best[3]) if best else None
+    unfinished = [m for m in mirrors if m not in failed and (best is None or m is not best[0])]
+    # Known links of mirrors the race did not get to
+    for mirror in unfinished:
+        if mirror['url'] in known:
+            resolved.setdefault(mirror['url'], known[mirror['url']])
+    return winner, unfinished
@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+
+class DomainRateLimiter:
+    """
+    Token bucket plus concurrency cap per target domain.
+
+    Policies map a domain to {'interval', 'burst', 'concurrency'}: one
+    token is added every 'interval' seconds up to 'burst', and at most
+    'concurrency' requests (0 = unlimited) hold the domain at once. A
+    policy covers the domain and its subdomains; '*' applies to every
+    domain without a policy of its own. Domains without a policy are not
+    limited. The limiter is shared by all download slots.
+    """
+
+    def __init__(self, policies=None):
+        self.lock = threading.Lock()
+        self.released = threading.Condition(self.lock)
+        self.policies = {}
+        self.buckets = {}
+        self.configure(policies or {})
+
+    def configure(self, policies):
+        """Replace the policies, keeping the state of domains that stay limited"""
+        with self.lock:
+            self.policies = {key.lower(): dict(policy) for key, policy in policies.items()}
+            now = time.monotonic()
+            buckets = {}
+            for key, policy in self.policies.items():
+                bucket = self.buckets.get(key) or {'tokens': policy['burst'], 'updated': now, 'active': 0}
+                bucket['tokens'] = min(bucket['tokens'], policy['burst'])
+                buckets[key] = bucket
+            self.buckets = buckets
+            self.released.notify_all()
+
+    def _policy_key(self, url):
+        host = (urlparse(url).hostname or url).lower()
+        while host:
+            if host in self.policies:
+                return host
+            _, _, host = host.partition('.')
+        return '*' if '*' in self.policies else None
+
+    def _refill(self, key, now):
+        policy, bucket = self.policies[key], self.buckets[key]
+        if policy['interval'] <= 0:
+            bucket['tokens'] = policy['burst']
+        else:
+            bucket['tokens'] = min(policy['burst'], bucket['tokens'] + (now - bucket['updated']) / policy['interval'])
+        bucket['updated'] = now
+
+    def _wait_time(self, key, now):
+        """Seconds until key can be acquired (0 = now, None = when a holder releases)"""
+        policy, bucket = self.policies[key], self.buckets[key]
+        if policy['concurrency'] and bucket['active'] >= policy['concurrency']:
+            return None
+        self._refill(key, now)
+        if bucket['tokens'] >= 1:
+            return 0
+        return (1 - bucket['tokens']) * policy['interval']
+
+    def ready(self, url):
+        """True if a request to url would not have to wait right now"""
+        with self.lock:
+            key = self._policy_key(url)
+            return key is None or self._wait_time(key, time.monotonic()) == 0
+
+    def acquire(self, url, cancelled=None):
+        """Wait for a token and a concurrency slot for url's domain.
+
+        cancelled is polled while waiting; returns (acquired, key) where
+        key must be passed to release() and is None for unlimited domains.
+        """
+        with self.lock:
+            while True:
+                key = self._policy_key(url)
+                if key is None:
+                    return True, None
+
+                wait = self._wait_time(key, time.monotonic())
+                if wait == 0:
+                    self.buckets[key]['tokens'] -= 1
+                    self.buckets[key]['active'] += 1
+                    return True, key
+
+                if cancelled and cancelled():
+                    return False, None
+                self.released.wait(1 if wait is None else min(wait, 1))
+
+    def release(self, key):
+        if key is None:
+            return
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket and bucket['active'] > 0:
+                bucket['active'] -= 1
+            self.released.notify_all()
+
+    @contextmanager
+    def limit(self, url, cancelled=None):
+        """Hold url's domain for the duration of the block; yields whether it was acquired"""
+        acquired, key = self.acquire(url, cancelled)
+        try:
+            yield acquired
+        finally:
+            self.release(key)
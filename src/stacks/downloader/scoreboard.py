@@ -0,0 +1,138 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from stacks.constants import MIRROR_TYPICAL_SIZE, MIRROR_SCORE_DECAY, MIRROR_EWMA_WEIGHT
+
+logger = logging.getLogger('scoreboard')
+
+# Failure classes recorded by the orchestrator
+FAILURE_TIMEOUT = 'timeout'        # Mirror page did not answer or the connection failed
+FAILURE_CHALLENGE = 'challenge'    # Blocked (403/503) and not solved
+FAILURE_NO_LINK = 'no_link'        # Page loaded but had no download link
+FAILURE_NOT_FOUND = 'not_found'    # Mirror page returned 404 for this file
+FAILURE_ERROR = 'error'            # Other HTTP or parsing error
+FAILURE_TRANSFER = 'transfer'      # Link found but the file transfer or checksum failed
+
+
+def mirror_key(link):
+    """Scoreboard key of a mirror link: its domain, or the server for slow downloads"""
+    if link.get('type') == 'slow_download':
+        return f"{link['domain']}: {link.get('text', 'slow download')}"
+    return link['domain']
+
+
+class MirrorScoreboard:
+    """
+    Outcomes per mirror, kept across restarts and used to order mirrors.
+
+    For each mirror: success and failure counts (decayed by
+    MIRROR_SCORE_DECAY on every new outcome), failures per class, how often
+    FlareSolverr was needed, and moving averages of the time to get a
+    download link and of the transfer speed. rank() orders links by the
+    expected speed of a MIRROR_TYPICAL_SIZE download times a success rate
+    drawn from Beta(successes + 1, failures + 1), so mirrors with few
+    results keep getting tried now and then.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mirrors = {}
+        self.load()
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path) as f:
+                self.mirrors = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read mirror scoreboard, starting fresh: {e}")
+            self.mirrors = {}
+
+    def save(self):
+        """Write the scoreboard atomically (call with lock held)"""
+        if self.path is None:
+            return
+        try:
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(self.mirrors, f, separators=(',', ':'))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save mirror scoreboard: {e}")
+
+    @staticmethod
+    def _ewma(old, new):
+        if old is None:
+            return new
+        return old + MIRROR_EWMA_WEIGHT * (new - old)
+
+    def record(self, key, success, failure=None, link_time=None, speed=None, flaresolverr=False):
+        """Add one attempt: link_time in seconds, speed in bytes per second"""
+        with self.lock:
+            stats = self.mirrors.setdefault(key, {
+                'attempts': 0, 'successes': 0.0, 'failures': 0.0, 'failure_classes': {},
+                'flaresolverr': 0, 'link_time': None, 'speed': None,
+                'last_success': None, 'last_failure': None, 'last_failure_class': None
+            })
+            stats['attempts'] += 1
+            stats['successes'] *= MIRROR_SCORE_DECAY
+            stats['failures'] *= MIRROR_SCORE_DECAY
+            if success:
+                stats['successes'] += 1
+                stats['last_success'] = time.time()
+            else:
+                stats['failures'] += 1
+                stats['failure_classes'][failure] = stats['failure_classes'].get(failure, 0) + 1
+                stats['last_failure'] = time.time()
+                stats['last_failure_class'] = failure
+            if flaresolverr:
+                stats['flaresolverr'] += 1
+            if link_time is not None:
+                stats['link_time'] = self._ewma(stats['link_time'], link_time)
+            if speed:
+                stats['speed'] = self._ewma(stats['speed'], speed)
+            self.save()
+
+    def _score(self, stats, best_speed, sample):
+        successes, failures = stats['successes'], stats['failures']
+        if sample:
+            rate = random.betavariate(successes + 1, failures + 1)
+        else:
+            rate = (successes + 1) / (successes + failures + 2)
+
+        # Unmeasured mirrors are assumed as fast as the best one, so they get tried
+        speed = stats['speed'] or best_speed
+        link_time = stats['link_time'] or 0
+        return rate * MIRROR_TYPICAL_SIZE / (link_time + MIRROR_TYPICAL_SIZE / speed)
+
+    def _best_speed(self):
+        speeds = [stats['speed'] for stats in self.mirrors.values() if stats['speed']]
+        return max(speeds, default=1024 * 1024)
+
+    def rank(self, links):
+        """links ordered best first, with some randomness for exploration"""
+        with self.lock:
+            best_speed = self._best_speed()
+            empty = {'successes': 0, 'failures': 0, 'speed': None, 'link_time': None}
+            scores = {id(link): self._score(self.mirrors.get(mirror_key(link), empty), best_speed, sample=True)
+                      for link in links}
+        return sorted(links, key=lambda link: scores[id(link)], reverse=True)
+
+    def snapshot(self):
+        """All mirrors with their expected score (no randomness), best first"""
+        with self.lock:
+            best_speed = self._best_speed()
+            mirrors = [dict(stats, mirror=key, failure_classes=dict(stats['failure_classes']),
+                            score=round(self._score(stats, best_speed, sample=False)))
+                       for key, stats in self.mirrors.items()]
+        return sorted(mirrors, key=lambda stats: stats['score'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.mirrors = {}
+            self.save()
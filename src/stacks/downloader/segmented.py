@@ -0,0 +1,289 @@
+import json
+import os
+import threading
+import time
+from stacks.constants import SEGMENT_MIN_SIZE, SEGMENT_MANIFEST_SUFFIX, SEGMENT_MANIFEST_INTERVAL
+from stacks.downloader.utils import ProgressTracker, preallocate, next_read_size, READ_MIN, READ_MAX
+from stacks.downloader.partial import load_meta, remove_meta, validators, changed_validators, if_range
+
+
+def manifest_path(temp_path):
+    """Manifest with the per-segment progress of temp_path"""
+    return temp_path.with_name(temp_path.name + SEGMENT_MANIFEST_SUFFIX)
+
+
+def probe_ranges(d, url):
+    """(total size, response headers) of url if the server answers byte range requests, else None"""
+    try:
+        response = d.session.get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'}, stream=True, timeout=30)
+        response.close()
+    except Exception as e:
+        d.logger.debug(f"Range probe failed: {e}")
+        return None
+
+    if response.status_code != 206:
+        return None
+
+    # Content-Range: bytes 0-0/<total>
+    total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    return (int(total), response.headers) if total.isdigit() else None
+
+
+class FileChanged(Exception):
+    """The server sent the whole file to an If-Range request: it is not the file the segments hold"""
+
+
+class SegmentedDownload:
+    """
+    One file fetched as byte ranges over several connections.
+
+    Segments are {'start', 'end', 'pos'} with end exclusive and pos the
+    next byte to fetch; each is written at its offset of the .part file,
+    which is extended to the full size first. A connection that runs out
+    of pending segments splits the busy segment with the most bytes left,
+    so a slow connection does not hold up the end of the download. The
+    segments are saved to a manifest next to the .part file, with the
+    ETag and Last-Modified of the file, which lets an interrupted download
+    continue every range where it stopped as long as the file is the same.
+    """
+
+    def __init__(self, d, url, temp_path, total_size, connections, attempts, meta=None):
+        self.d = d
+        self.url = url
+        self.temp_path = temp_path
+        self.manifest = manifest_path(temp_path)
+        self.total_size = total_size
+        # url and validators of the file on the server, as the sidecar keeps them
+        self.meta = meta or {'url': url}
+        self.connections = connections
+        self.attempts = max(attempts, 1)
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.error = None
+        self.segments = self._load() or self._plan()
+
+    def _load(self):
+        """Segments from the manifest, if it belongs to this file"""
+        try:
+            with open(self.manifest) as f:
+                manifest = json.load(f)
+            if manifest['total_size'] != self.total_size or self.temp_path.stat().st_size != self.total_size:
+                raise ValueError("size changed")
+            if changed_validators(manifest, self.meta):
+                raise ValueError("file changed on the server")
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.d.logger.warning(f"Discarding segment manifest of {self.temp_path.name}: {e}")
+            self.temp_path.unlink(missing_ok=True)
+            return None
+
+        self.d.logger.info(f"Resuming segmented download: {self.total_size - self._remaining(manifest['segments'])}/{self.total_size} bytes")
+        return [dict(segment, busy=False) for segment in manifest['segments']]
+
+    def _plan(self):
+        """Split the bytes not yet on disk evenly and preallocate the .part file"""
+        # A .part file from a single-connection download is a finished prefix
+        done = 0
+        if self.temp_path.exists():
+            done = self.temp_path.stat().st_size
+            if done > self.total_size:
+                self.temp_path.unlink()
+                done = 0
+            elif done:
+                self.d.logger.info(f"Continuing partial file over ranges from byte {done}")
+
+        with open(self.temp_path, 'r+b' if done else 'wb') as f:
+            preallocate(f, self.total_size)
+
+        remaining = self.total_size - done
+        count = max(1, min(self.connections, remaining // SEGMENT_MIN_SIZE))
+        size = -(-remaining // count)
+        segments = []
+        for start in range(done, self.total_size, size):
+            end = min(start + size, self.total_size)
+            segments.append({'start': start, 'end': end, 'pos': start, 'busy': False})
+        return segments
+
+    @staticmethod
+    def _remaining(segments):
+        return sum(segment['end'] - segment['pos'] for segment in segments)
+
+    def downloaded(self):
+        with self.lock:
+            return self.total_size - self._remaining(self.segments)
+
+    def save(self):
+        """Write the manifest atomically (dropped once every segment is complete)"""
+        with self.lock:
+            segments = [{'start': s['start'], 'end': s['end'], 'pos': s['pos']}
+                        for s in self.segments if s['pos'] < s['end']]
+        if not segments:
+            self.manifest.unlink(missing_ok=True)
+            return
+
+        tmp = self.manifest.with_name(self.manifest.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump({**self.meta, 'total_size': self.total_size, 'segments': segments}, f)
+        os.replace(tmp, self.manifest)
+
+    def _claim(self):
+        """A pending segment, or half of the busiest one; None when nothing is left to take"""
+        with self.lock:
+            for segment in self.segments:
+                if not segment['busy'] and segment['pos'] < segment['end']:
+                    segment['busy'] = True
+                    return segment
+
+            # Rebalance: take over the back half of the segment with the most bytes left
+            busy = [s for s in self.segments if s['busy'] and s['pos'] < s['end']]
+            if not busy:
+                return None
+            largest = max(busy, key=lambda s: s['end'] - s['pos'])
+            remaining = largest['end'] - largest['pos']
+            if remaining < 2 * SEGMENT_MIN_SIZE:
+                return None
+
+            middle = largest['pos'] + remaining // 2
+            segment = {'start': middle, 'end': largest['end'], 'pos': middle, 'busy': True}
+            largest['end'] = middle
+            self.segments.append(segment)
+            return segment
+
+    def _connection(self):
+        """One connection: fetch segments until none are left"""
+        while not self.stop.is_set():
+            segment = self._claim()
+            if segment is None:
+                return
+            try:
+                self._fetch(segment)
+            finally:
+                with self.lock:
+                    segment['busy'] = False
+
+    def _fetch(self, segment):
+        attempt = 0
+        view = memoryview(bytearray(READ_MAX))
+        size = READ_MIN
+        while segment['pos'] < segment['end'] and not self.stop.is_set():
+            try:
+                headers = {'Range': f"bytes={segment['pos']}-{segment['end'] - 1}", 'Accept-Encoding': 'identity'}
+                # The server sends the whole file instead if it changed since the probe
+                validator = if_range(self.meta, self.url)
+                if validator:
+                    headers['If-Range'] = validator
+                with self.d.session.get(self.url, headers=headers, stream=True, timeout=30) as response:
+                    if response.status_code == 200 and validator:
+                        raise FileChanged("File changed on the server during the download")
+                    if response.status_code != 206:
+                        raise Exception(f"Range request returned status {response.status_code}")
+                    if response.headers.get('Content-Encoding', 'identity') != 'identity':
+                        raise Exception("Server compressed a range response")
+
+                    # Unbuffered: a byte counted in pos (and the manifest) is already with the OS
+                    with open(self.temp_path, 'r+b', buffering=0) as f:
+                        f.seek(segment['pos'])
+                        while not self.stop.is_set():
+                            # end moves down when another connection takes over the back
+                            # half; bytes read past it are the same the other one fetches
+                            left = segment['end'] - segment['pos']
+                            if left <= 0:
+                                break
+                            start = time.monotonic()
+                            count = response.raw.readinto(view[:min(size, left)])
+                            if not count:
+                                break
+                            f.write(view[:count])
+                            with self.lock:
+                                segment['pos'] = min(segment['pos'] + count, segment['end'])
+                            size = next_read_size(size, count, time.monotonic() - start)
+                        if self.stop.is_set():
+                            return
+
+                if segment['pos'] < segment['end']:
+                    raise Exception(f"Connection closed at byte {segment['pos']} of range ending {segment['end']}")
+
+            except FileChanged as e:
+                self.error = e
+                self.stop.set()
+                return
+            except Exception as e:
+                attempt += 1
+                if attempt >= self.attempts:
+                    self.error = e
+                    self.stop.set()
+                    return
+                self.d.logger.warning(f"Segment at byte {segment['pos']} interrupted, retrying (attempt {attempt}/{self.attempts - 1}): {e}")
+                self.stop.wait(2 ** (attempt - 1))
+
+    def run(self):
+        """Fetch all segments; True when complete, False when cancelled
+
+        Raises the error of a segment that failed every attempt; the .part
+        file and manifest are kept for resume in either case.
+        """
+        self.d.logger.info(f"Segmented download: {len(self.segments)} range(s) over up to {self.connections} connection(s)")
+        threads = [threading.Thread(target=self._connection, daemon=True) for _ in range(self.connections)]
+        for thread in threads:
+            thread.start()
+
+        cancelled = False
+        progress = ProgressTracker(self.d, self.downloaded())
+        last_save = time.monotonic()
+        while True:
+            alive = [thread for thread in threads if thread.is_alive()]
+            if not alive:
+                break
+            alive[0].join(0.25)
+            if not cancelled and not progress.update(self.downloaded(), self.total_size):
+                cancelled = True
+                self.stop.set()
+            if time.monotonic() - last_save >= SEGMENT_MANIFEST_INTERVAL:
+                self.save()
+                last_save = time.monotonic()
+
+        self.save()
+
+        if cancelled:
+            return False
+        if self.error is not None:
+            raise self.error
+        return self.downloaded() == self.total_size
+
+
+def download_segmented(d, download_url, temp_path, resume_attempts=3):
+    """Fetch download_url into temp_path over d.segments connections.
+
+    Returns True when temp_path is complete, False when cancelled, or None
+    if the server does not serve ranges (any stale manifest and preallocated
+    .part are removed so the caller can fall back to a single connection).
+    The bytes fetched are added to d.received.
+    """
+    probe = probe_ranges(d, download_url)
+    if not probe:
+        manifest = manifest_path(temp_path)
+        if manifest.exists():
+            d.logger.warning("Server no longer accepts range requests, restarting download")
+            manifest.unlink()
+            temp_path.unlink(missing_ok=True)
+        return None
+
+    total_size, headers = probe
+    current = {'url': download_url, **validators(headers)}
+
+    # A single-connection partial file of another size or version is not this file
+    meta = load_meta(temp_path)
+    if not manifest_path(temp_path).exists() and (meta.get('total_size') not in (None, total_size)
+                                                  or changed_validators(meta, current)):
+        d.logger.warning("File on the server differs from the partial file, restarting download")
+        temp_path.unlink(missing_ok=True)
+    # From here on the segment manifest tracks the partial file
+    remove_meta(temp_path)
+
+    download = SegmentedDownload(d, download_url, temp_path, total_size, max(d.segments, 1), resume_attempts, current)
+    start = download.downloaded()
+    try:
+        return download.run()
+    finally:
+        d.received += download.downloaded() - start
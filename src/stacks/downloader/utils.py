@@ -1,3 +1,155 @@
+import ctypes
+import errno
+import os
+import shutil
+import time
+from stacks.downloader.scoreboard import mirror_key, FAILURE_NOT_FOUND, FAILURE_NO_LINK
+
+# Socket reads grow from READ_MIN to READ_MAX bytes while each one takes
+# less than half of READ_TARGET seconds, and shrink when one takes more
+# than twice that, so progress and cancel checks stay timely on slow links
+READ_MIN = 64 * 1024
+READ_MAX = 1024 * 1024
+READ_TARGET = 0.1
+
+# Linux fallocate(), which can reserve space without changing the file length
+FALLOC_FL_KEEP_SIZE = 1
+try:
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _fallocate = getattr(_libc, 'fallocate64', None) or _libc.fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (OSError, AttributeError):
+    _fallocate = None
+
+def preallocate(f, size, keep_size=False):
+    """Reserve disk space for the first size bytes of open file f.
+
+    Avoids fragmented files and fails early with ENOSPC when the disk is
+    too small. With keep_size the file length is left alone (appending
+    downloads resume from it); that needs Linux and is skipped elsewhere.
+    Otherwise the file is extended to size. Filesystems that cannot
+    reserve space are left as they are.
+    """
+    length = os.fstat(f.fileno()).st_size
+    if keep_size:
+        if _fallocate is not None and _fallocate(f.fileno(), FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                # A failed reservation can keep what it got; truncating releases it
+                f.truncate(length)
+                raise OSError(err, os.strerror(err))
+        return
+
+    try:
+        os.posix_fallocate(f.fileno(), 0, size)
+    except (AttributeError, OSError) as e:
+        if getattr(e, 'errno', None) == errno.ENOSPC:
+            f.truncate(length)
+            raise
+        f.truncate(size)
+
+def _copy_contents(src, dst, size):
+    """Copy size bytes between open files inside the kernel where the platform allows"""
+    offset = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while offset < size:
+                copied = os.copy_file_range(src.fileno(), dst.fileno(), size - offset, offset, offset)
+                if not copied:
+                    break
+                offset += copied
+        except OSError as e:
+            # Not supported between these filesystems (or by this kernel)
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    if offset < size and hasattr(os, 'sendfile'):
+        dst.seek(offset)
+        try:
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                if not sent:
+                    break
+                offset += sent
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL):
+                raise
+    if offset < size:
+        src.seek(offset)
+        dst.seek(offset)
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+
+def move_file(src, dst):
+    """Move src to dst, by renaming when both are on the same filesystem.
+
+    Across filesystems the file is copied inside the kernel
+    (copy_file_range, else sendfile) to a hidden temporary name next to
+    dst, synced to disk, renamed into place and only then removed from
+    src, so a crash never leaves a half-copied file under the final name.
+    """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    tmp = dst.with_name(f".{dst.name}.moving")
+    try:
+        with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+            size = os.fstat(fin.fileno()).st_size
+            preallocate(fout, size)
+            _copy_contents(fin, fout, size)
+            fout.flush()
+            os.fsync(fout.fileno())
+        shutil.copystat(src, tmp)
+        os.rename(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+    # Make the new directory entry durable before the only other copy goes
+    try:
+        fd = os.open(dst.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+    os.unlink(src)
+
+def next_read_size(size, count, elapsed):
+    """Size of the next socket read after one of size bytes got count in elapsed seconds"""
+    if count == size and elapsed < READ_TARGET / 2:
+        return min(size * 2, READ_MAX)
+    if elapsed > READ_TARGET * 2:
+        return max(size // 2, READ_MIN)
+    return size
+
+def same_filesystem(a, b):
+    """True if existing paths a and b are on the same filesystem (renames between them are free)"""
+    return os.stat(a).st_dev == os.stat(b).st_dev
+
+def is_cancelled(d):
+    """Check if download should be cancelled via progress callback"""
+    if hasattr(d, 'progress_callback') and d.progress_callback:
+        should_continue = d.progress_callback({'check_only': True})
+        return should_continue is False
+    return False
+
+def record_attempt(d, mirror, md5, success, failure=None, **stats):
+    """Record a mirror attempt in the scoreboard, circuit breaker and negative cache"""
+    key = mirror_key(mirror)
+    d.scoreboard.record(key, success, failure=failure, **stats)
+    if success:
+        d.breaker.success(key)
+    elif failure in (FAILURE_NOT_FOUND, FAILURE_NO_LINK):
+        # The mirror answered, it just does not have this file
+        d.negative_cache.add(md5, key)
+        d.breaker.success(key)
+    elif d.breaker.failure(key):
+        d.logger.warning(f"Mirror {key} keeps failing, skipping it for a while")
+
 def get_unique_filename(d, base_path):
     """Generate a unique filename by adding (1), (2), etc. if file exists."""
     if not base_path.exists():
@@ -14,4 +166,54 @@ def get_unique_filename(d, base_path):
         if not new_path.exists():
             d.logger.info(f"File exists, using unique name: {new_name}")
             return new_path
-        counter += 1
\ No newline at end of file
+        counter += 1
+
+class ProgressTracker:
+    """Report progress with a smoothed speed to d.progress_callback, at most every 0.5 seconds"""
+
+    def __init__(self, d, downloaded):
+        self.d = d
+        self.last_update_time = time.time()
+        self.last_downloaded = downloaded
+        self.speed_samples = []  # Keep last few samples for smoothing
+
+    def update(self, downloaded, total_size):
+        """Returns False if the callback asked to cancel"""
+        if not self.d.progress_callback or not total_size:
+            return True
+
+        current_time = time.time()
+        time_diff = current_time - self.last_update_time
+
+        # Update speed every 0.5 seconds to avoid excessive updates
+        if time_diff < 0.5:
+            return True
+
+        bytes_diff = downloaded - self.last_downloaded
+        current_speed = bytes_diff / time_diff
+
+        # Keep last 5 samples for smoothing
+        self.speed_samples.append(current_speed)
+        if len(self.speed_samples) > 5:
+            self.speed_samples.pop(0)
+
+        # Average speed for smoother display
+        avg_speed = sum(self.speed_samples) / len(self.speed_samples)
+
+        percent = (downloaded / total_size) * 100
+        should_continue = self.d.progress_callback({
+            'total_size': total_size,
+            'downloaded': downloaded,
+            'percent': round(percent, 1),
+            'speed': int(avg_speed)
+        })
+
+        self.last_update_time = current_time
+        self.last_downloaded = downloaded
+
+        # Check if callback returned False (cancel signal)
+        if should_continue is False:
+            if hasattr(self.d, 'status_callback'):
+                self.d.status_callback("Stopping download...")
+            return False
+        return True
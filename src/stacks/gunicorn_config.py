@@ -17,12 +17,13 @@
 
 这个配置文件就是告诉经理：
 - 餐厅地址在哪里（0.0.0.0:7788）
-- 雇几个厨师（workers = 1）
-- 厨师的工作方式（同步模式）
+- 雇几个厨师（workers = CPU核心数，最多4个）
+- 厨师的工作方式（线程模式）
 - 等等各种运营细节
 """
 
 import multiprocessing  # 🔢 多进程模块，用于检测CPU核心数
+import os               # 🌍 环境变量，用于覆盖工作进程数量
 import signal           # 📞 信号处理模块，用于优雅关闭程序
 import sys              # 💻 系统模块，用于输出信息
 
@@ -42,21 +43,33 @@ bind = "0.0.0.0:7788"
 # 就像决定雇多少个厨师，每个厨师怎么工作
 
 # Worker processes - 雇佣的工作进程数量
-workers = 1
+workers = int(os.environ.get("STACKS_WEB_WORKERS", min(multiprocessing.cpu_count(), 4)))
 """
 【解释】
-- 1 = 只雇1个厨师，一次只能处理1个请求
-- 如果网站访问量大，需要增加数量
-- 一般设为CPU核心数的2-4倍
+- 默认按CPU核心数雇厨师，最多4个；可以用环境变量 STACKS_WEB_WORKERS 指定
+- 下载引擎（队列和下载线程）只在其中一个进程里运行，靠 config/engine.lock 选出来
+- 其他进程只负责网页和接口，通过 config/engine.sock 找引擎进程读写队列
+- 引擎进程退出（比如被重启）时，另一个进程会自动接手
+- 设为1就和以前一样：一个进程全包
 """
 
 # Worker class - 工作进程类型
-worker_class = "sync"
+worker_class = "gthread"
 """
 【解释】
-- "sync" = 同步模式：厨师做完一道菜再做下一道
-- 还有 "async"（异步）、"gevent"（协程）等
-- 同步模式简单稳定，适合大多数情况
+- "gthread" = 线程模式：一个厨师带着几个帮手，同时处理多个请求
+- 原来的 "sync"（同步模式）一次只能服务一个顾客
+- /api/events 推送流会一直占着一个连接，同步模式下整个网站都会卡住
+- 所以必须用线程模式，让推送流和普通请求同时进行
+"""
+
+# Threads - 每个工作进程的线程数
+threads = 16
+"""
+【解释】
+- 每个打开的网页标签占用1个线程接收推送
+- 16个线程 = 十几个标签同时在线，还有余量处理普通请求
+- 线程只是在等待数据，几乎不占CPU
 """
 
 # Worker connections - 每个工作进程的最大连接数
@@ -185,12 +198,15 @@ def on_exit(server):
 
 def worker_exit(server, worker):
     """👨‍🍳 厨师下班 - 工作进程退出后调用"""
-    # Cleanup happens automatically when the worker process exits
-    # The Flask app's worker and queue objects will be garbage collected
+    # The engine process requeues active downloads, saves the queue and
+    # releases the engine lock so another worker takes over
     """
     【解释】
-    - 工作进程退出时自动清理资源
-    - Flask应用的工作进程和队列对象会被垃圾回收
-    - pass 表示什么都不做，让系统自动处理
+    - 如果这个进程正在运行下载引擎，先把正在下载的任务放回队列并保存
+    - 然后释放引擎锁，让其他工作进程接手下载
+    - 不是引擎的进程什么都不用做
     """
-    pass
+    app = getattr(worker, "wsgi", None)
+    engine = getattr(app, "stacks_engine", None)
+    if engine is not None:
+        engine.shutdown()
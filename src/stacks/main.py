@@ -22,6 +22,7 @@ import sys          # 用于Python系统相关功能
 import signal       # 用于处理系统信号（如Ctrl+C关闭程序）
 import argparse     # 用于解析命令行参数（如 --debug 参数）
 from stacks.server.webserver import create_app  # 导入创建Web应用的函数
+from stacks.config.config import Config  # 导入配置类，在启动Gunicorn前生成密钥
 from pathlib import Path  # 用于处理文件路径
 # 导入常量值（这些值定义了重要文件的位置）
 from stacks.constants import CONFIG_FILE, PROJECT_ROOT, LOG_PATH, DOWNLOAD_PATH, GUNICORN_CONFIG_FILE
@@ -253,26 +254,13 @@ def setup_signal_handlers(app):
         print(f"\n{WARN}◼ 收到{signal_name}信号，正在优雅关闭...{RESET}")
         sys.stdout.flush()  # 立即显示消息
 
-        # 🛑 第一步：停止下载工作线程
-        # 就像告诉正在下载文件的工作人员："请停止工作"
-        if hasattr(app, 'stacks_worker') and app.stacks_worker:
-            print(f"{INFO}  正在停止下载工作线程...{RESET}")
+        # 🛑 停止下载引擎：停止下载线程、清理下载器资源、保存队列状态
+        # 就像告诉仓库："停工、收拾、把账本存好"
+        # 如果这个进程不是引擎进程，这一步只会释放等待中的引擎锁
+        if hasattr(app, 'stacks_engine') and app.stacks_engine:
+            print(f"{INFO}  正在停止下载引擎并保存队列状态...{RESET}")
             sys.stdout.flush()
-            app.stacks_worker.stop()
-
-        # 🧹 第二步：清理下载器资源
-        # 就像关闭打开的文件、断开网络连接等
-        if hasattr(app, 'stacks_worker') and app.stacks_worker and hasattr(app.stacks_worker, 'downloader'):
-            print(f"{INFO}  正在清理下载器资源...{RESET}")
-            sys.stdout.flush()
-            app.stacks_worker.downloader.cleanup()
-
-        # 💾 第三步：保存队列状态到磁盘
-        # 就像保存游戏进度一样，把用户的下载队列保存起来
-        if hasattr(app, 'stacks_queue') and app.stacks_queue:
-            print(f"{INFO}  正在保存队列状态...{RESET}")
-            sys.stdout.flush()
-            app.stacks_queue.save()
+            app.stacks_engine.shutdown()
 
         # ✅ 完成关闭
         print(f"{GOOD}◼ 关闭完成{RESET}")
@@ -397,6 +385,11 @@ def main():
         print(f"{INFO}◼ 正在使用Gunicorn启动Stacks...{RESET}")
         sys.stdout.flush()
 
+        # 🔐 先完整加载一次配置（会生成缺少的密钥并保存）
+        # 多个Gunicorn工作进程同时启动时，如果各自生成密钥，会得到不同的 session_secret，
+        # 登录状态和进程之间的引擎连接都会对不上
+        Config(config_path)
+
         # 📤 将配置路径设置为环境变量
         # 就像把"菜单"传递给后厨工作人员
         os.environ["STACKS_CONFIG_PATH"] = config_path
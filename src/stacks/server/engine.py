@@ -0,0 +1,273 @@
+import os
+import time
+import logging
+import threading
+import functools
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from stacks.constants import ENGINE_LOCK_FILE, ENGINE_SOCKET, ENGINE_CONNECT_TIMEOUT, ENGINE_POOL_SIZE
+from stacks.server.queue import DownloadQueue
+from stacks.server.worker import DownloadWorker
+from stacks.utils.logutils import read_log_buffer, setup_logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: no gunicorn, always a single process
+    fcntl = None
+
+logger = logging.getLogger('engine')
+
+
+class EngineUnavailable(RuntimeError):
+    """The engine process could not be reached"""
+
+
+class Engine:
+    """
+    The download engine (queue + worker), run by exactly one process.
+
+    With several gunicorn workers, the process that locks ENGINE_LOCK_FILE
+    runs the engine and serves the others over ENGINE_SOCKET. The other
+    processes wait for the lock in the background and take over when the
+    engine process exits; their web code talks to the engine through
+    EngineProxy objects in place of the queue and worker.
+    """
+
+    # Engine calls other processes may make, and the method that serves each
+    REMOTE_CALLS = {'read_logs': '_read_logs', 'apply_config': '_apply_config'}
+
+    def __init__(self, config):
+        self.config = config
+        self.authkey = config.get('api', 'session_secret').encode()
+        self.queue = None
+        self.worker = None
+        self.local = False
+        self.listener = None
+        self.lock_file = None
+        self.pool = []
+        self.pool_lock = threading.Lock()
+
+    def start(self):
+        """Run the engine here if no other process does, otherwise wait to take over"""
+        if self._lock(blocking=False):
+            self._run()
+        else:
+            logger.info("Download engine runs in another process")
+            threading.Thread(target=self._wait_for_lock, daemon=True).start()
+
+    def _lock(self, blocking):
+        if fcntl is None:
+            return True
+
+        if self.lock_file is None:
+            self.lock_file = open(ENGINE_LOCK_FILE, 'a+')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            return False
+
+        self.lock_file.seek(0)
+        self.lock_file.truncate()
+        self.lock_file.write(f"{os.getpid()}\n")
+        self.lock_file.flush()
+        return True
+
+    def _wait_for_lock(self):
+        self._lock(blocking=True)
+        logger.info("Download engine process exited, taking over")
+        self._run()
+
+    def _run(self):
+        self.queue = DownloadQueue(self.config)
+        self.worker = DownloadWorker(self.queue, self.config)
+        self.worker.start()
+        self._serve_others()
+        logger.info(f"Download engine started (pid {os.getpid()})")
+
+    def _serve_others(self):
+        """Become the engine for this process and accept calls from the others"""
+        self.local = True
+
+        # Connections to the previous engine are dead now
+        with self.pool_lock:
+            for conn in self.pool:
+                conn.close()
+            self.pool.clear()
+
+        if fcntl is not None:
+            # Holding the lock means any socket file left behind is stale
+            ENGINE_SOCKET.unlink(missing_ok=True)
+            self.listener = Listener(str(ENGINE_SOCKET), family='AF_UNIX', authkey=self.authkey)
+            threading.Thread(target=self._accept_loop, daemon=True).start()
+
+    def shutdown(self):
+        """Stop downloads, save the queue and hand the engine to another process"""
+        if self.local:
+            self.worker.stop()
+            self.worker.downloader.cleanup()
+            self.queue.save()
+            if self.listener is not None:
+                self.listener.close()
+                ENGINE_SOCKET.unlink(missing_ok=True)
+            self.local = False
+
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    # Engine side
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                logger.warning("Rejected engine connection with a wrong key")
+                continue
+            except OSError:
+                return  # Listener closed
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        """Answer calls on one connection until the other side closes it"""
+        with conn:
+            while True:
+                try:
+                    target, name, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    reply = ('ok', self._dispatch(target, name, args, kwargs))
+                except Exception as e:
+                    reply = ('error', e)
+
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    # Unpicklable result or exception
+                    conn.send(('error', RuntimeError(str(e))))
+
+    def _dispatch(self, target, name, args, kwargs):
+        if target == 'engine' and name in self.REMOTE_CALLS:
+            obj, name = self, self.REMOTE_CALLS[name]
+        elif target in ('queue', 'worker') and not name.startswith('_'):
+            obj = getattr(self, target)
+        else:
+            raise AttributeError(f"{target}.{name} is not available remotely")
+
+        attr = getattr(obj, name)
+        return attr(*args, **kwargs) if callable(attr) else attr
+
+    def _read_logs(self, after=None, level=None, logger=None, epoch=None):
+        return read_log_buffer(after=after, level=level, logger=logger, epoch=epoch)
+
+    def _apply_config(self):
+        self.worker.update_config()
+        setup_logging(self.config)
+
+    # Client side
+
+    def read_logs(self, after=None, level=None, logger=None, epoch=None):
+        """Console lines of the engine process, see read_log_buffer()"""
+        return self.call('engine', 'read_logs', after=after, level=level, logger=logger, epoch=epoch)
+
+    def apply_config(self):
+        """Make the engine pick up a config saved by any process"""
+        self.call('engine', 'apply_config')
+
+    def call(self, target, name, *args, **kwargs):
+        """Call target.name() in the engine process (or read the attribute)"""
+        if self.local:
+            return self._dispatch(target, name, args, kwargs)
+
+        deadline = time.monotonic() + ENGINE_CONNECT_TIMEOUT
+        while True:
+            conn, pooled = self._connection(deadline)
+            if conn is None:
+                # Took over while waiting
+                return self._dispatch(target, name, args, kwargs)
+
+            try:
+                conn.send((target, name, args, kwargs))
+                status, result = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                if pooled:
+                    continue  # Stale connection to a previous engine
+                raise EngineUnavailable(f"Engine process went away during {target}.{name}")
+
+            self._release(conn)
+            if status == 'error':
+                raise result
+            return result
+
+    def _connection(self, deadline):
+        """A pooled or new connection, or (None, False) once this process runs the engine"""
+        with self.pool_lock:
+            if self.pool:
+                return self.pool.pop(), True
+
+        while not self.local:
+            try:
+                return Client(str(ENGINE_SOCKET), family='AF_UNIX', authkey=self.authkey), False
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() >= deadline:
+                    raise EngineUnavailable("Download engine is not running")
+                time.sleep(0.2)
+        return None, False
+
+    def _release(self, conn):
+        with self.pool_lock:
+            if len(self.pool) < ENGINE_POOL_SIZE and not self.local:
+                self.pool.append(conn)
+                return
+        conn.close()
+
+    def proxies(self):
+        """(queue, worker) for the web code of this process"""
+        if self.local:
+            return self.queue, self.worker
+        return QueueProxy(self), EngineProxy(self, 'worker', DownloadWorker)
+
+
+class EngineProxy:
+    """
+    Stand-in for the engine's DownloadQueue or DownloadWorker.
+
+    Methods of cls become remote calls and other attributes remote reads;
+    both go straight to the real object once this process runs the engine.
+    """
+
+    def __init__(self, engine, target, cls):
+        self._engine = engine
+        self._target = target
+        self._cls = cls
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._engine.local:
+            return getattr(getattr(self._engine, self._target), name)
+        if callable(getattr(self._cls, name, None)):
+            return functools.partial(self._engine.call, self._target, name)
+        return self._engine.call(self._target, name)
+
+
+class QueueProxy(EngineProxy):
+    """EngineProxy for the queue that only transfers the status snapshot when it changed"""
+
+    def __init__(self, engine):
+        super().__init__(engine, 'queue', DownloadQueue)
+        self._snapshot = (None, b'')
+
+    @property
+    def status_snapshot(self):
+        if self._engine.local:
+            return self._engine.queue.status_snapshot
+
+        tag, body = self._engine.call('queue', 'snapshot_if_changed', self._snapshot[0])
+        if body is not None:
+            self._snapshot = (tag, body)
+        return self._snapshot
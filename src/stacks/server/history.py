@@ -0,0 +1,164 @@
+from bisect import bisect_left, bisect_right
+
+
+def until_bound(until):
+    """until as a string bound for ISO timestamps; a date alone includes that whole day"""
+    if len(until) == len('YYYY-MM-DD'):
+        return f"{until}T23:59:59.999999"
+    return until
+
+
+class HistoryIndex:
+    """
+    Download history ordered by id, with posting lists for filtering.
+
+    Every entry gets a monotonically increasing 'id' which doubles as the
+    pagination cursor. Posting lists (ascending ids per filter value) are
+    kept for md5, success, method and subfolder; ids of removed entries
+    are skipped lazily and the lists are rebuilt once they are mostly dead.
+    Entry and success counts per md5 answer duplicate checks in O(1).
+    """
+
+    def __init__(self, items=()):
+        self.last_id = 0
+        self.clear()
+        for item in items:
+            self.append(item)
+
+    def clear(self):
+        """Drop every entry; ids keep counting up so old cursors stay meaningful"""
+        self.ids = []
+        self.items = {}
+        self.postings = {}
+        self.dead = 0
+        # md5 -> [entries, successful entries]
+        self.md5_counts = {}
+
+    def _keys(self, item):
+        keys = [('md5', item['md5']), ('success', bool(item.get('success', False)))]
+        if item.get('success', False):
+            keys.append(('method', 'fast' if item.get('used_fast_download') else 'mirror'))
+        keys.append(('subfolder', item.get('subfolder')))
+        return keys
+
+    def append(self, item):
+        """Append an entry, assigning it an id if it has none (or a stale one)"""
+        if not isinstance(item.get('id'), int) or item['id'] <= self.last_id:
+            item['id'] = self.last_id + 1
+        self.last_id = item['id']
+
+        self.ids.append(item['id'])
+        self.items[item['id']] = item
+        for key in self._keys(item):
+            self.postings.setdefault(key, []).append(item['id'])
+        counts = self.md5_counts.setdefault(item['md5'], [0, 0])
+        counts[0] += 1
+        counts[1] += bool(item.get('success', False))
+        return item
+
+    def _forget(self, removed):
+        for item in removed:
+            del self.items[item['id']]
+            counts = self.md5_counts[item['md5']]
+            counts[0] -= 1
+            counts[1] -= bool(item.get('success', False))
+            if not counts[0]:
+                del self.md5_counts[item['md5']]
+        self.dead += len(removed)
+        if self.dead > len(self.items):
+            self._rebuild_postings()
+
+    def _rebuild_postings(self):
+        self.postings = {}
+        for item_id in self.ids:
+            for key in self._keys(self.items[item_id]):
+                self.postings.setdefault(key, []).append(item_id)
+        self.dead = 0
+
+    def trim(self, count):
+        """Drop the oldest count entries and return them"""
+        removed = [self.items[item_id] for item_id in self.ids[:count]]
+        del self.ids[:count]
+        self._forget(removed)
+        return removed
+
+    def remove_md5(self, md5):
+        """Drop every entry for md5 and return them"""
+        removed = [self.items[item_id] for item_id in self.postings.get(('md5', md5), ())
+                   if item_id in self.items]
+        if removed:
+            removed_ids = {item['id'] for item in removed}
+            self.ids = [item_id for item_id in self.ids if item_id not in removed_ids]
+            self._forget(removed)
+            self.postings.pop(('md5', md5), None)
+        return removed
+
+    def counts(self, md5):
+        """(entries, successful entries) for md5, or None if it has none"""
+        counts = self.md5_counts.get(md5)
+        return tuple(counts) if counts else None
+
+    def first_id(self):
+        """Id of the oldest entry, or None if there are none"""
+        return self.ids[0] if self.ids else None
+
+    def tail(self, count):
+        """The newest count entries, oldest first"""
+        if count <= 0:
+            return []
+        return [self.items[item_id] for item_id in self.ids[-count:]]
+
+    def recent(self, count):
+        """The newest count entries, newest first"""
+        return self.tail(count)[::-1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        for item_id in self.ids:
+            yield self.items[item_id]
+
+    def query(self, cursor=None, limit=50, success=None, method=None, subfolder=None, since=None, until=None):
+        """Page through entries newest first.
+
+        cursor is the id of the last entry of the previous page; only older
+        entries are returned. Filters use the smallest matching posting list
+        and date bounds use the fact that completed_at grows with id.
+
+        Returns (items, next_cursor); next_cursor is None on the last page.
+        """
+        filters = []
+        if success is not None:
+            filters.append(('success', bool(success)))
+        if method is not None:
+            filters.append(('method', method))
+        if subfolder is not None:
+            filters.append(('subfolder', subfolder or None))
+
+        candidates = self.ids
+        if filters:
+            candidates = min((self.postings.get(key, []) for key in filters), key=len)
+
+        upper = cursor if cursor is not None else self.last_id + 1
+        if until is not None:
+            # First id completed after the bound (ids and timestamps grow together)
+            until = until_bound(until)
+            pos = bisect_right(self.ids, until, key=lambda item_id: self.items[item_id].get('completed_at') or '')
+            if pos < len(self.ids):
+                upper = min(upper, self.ids[pos])
+
+        page = []
+        pos = bisect_left(candidates, upper) - 1
+        while pos >= 0 and len(page) < limit:
+            item = self.items.get(candidates[pos])
+            pos -= 1
+            if item is None:
+                continue
+            if since is not None and (item.get('completed_at') or '') < since:
+                break
+            if all(key in self._keys(item) for key in filters):
+                page.append(item)
+
+        next_cursor = page[-1]['id'] if len(page) == limit and pos >= 0 else None
+        return page, next_cursor
@@ -1,82 +1,410 @@
 import threading
 from pathlib import Path
 import json
+import time
 import logging
+from collections import deque
+from itertools import chain, islice
+from operator import itemgetter
 from datetime import datetime
-from stacks.constants import QUEUE_FILE
+from stacks.constants import (
+    QUEUE_JOURNAL_COMPACT_ENTRIES,
+    QUEUE_CHANGE_LOG_SIZE,
+    QUEUE_PRIORITIES,
+    QUEUE_DEFAULT_PRIORITY
+)
+from stacks.server.storage import create_store
+from stacks.server.history import HistoryIndex
+
+# md5 states tracked by DownloadQueue.get_state()
+STATE_QUEUED = 'queued'
+STATE_DOWNLOADING = 'downloading'
+STATE_COMPLETED = 'completed'
+STATE_FAILED = 'failed'
+
+# Change log ops that alter the queue / the history
+QUEUE_OPS = {'add', 'remove', 'requeue', 'complete', 'retry', 'clear_queue'}
+HISTORY_OPS = {'complete', 'retry', 'clear_history', 'trim_history'}
+
+class PriorityLanes:
+    """
+    Queued items split into one deque per priority.
+
+    append/appendleft/popleft are O(1); iteration yields items in the order
+    they will be downloaded (highest priority lane first).
+    """
+
+    def __init__(self, items=()):
+        self.lanes = {priority: deque() for priority in QUEUE_PRIORITIES}
+        self.items = {}
+        for item in items:
+            self.append(item)
+
+    def _lane(self, item):
+        priority = item.get('priority')
+        if priority not in self.lanes:
+            priority = item['priority'] = QUEUE_DEFAULT_PRIORITY
+        return self.lanes[priority]
+
+    def append(self, item):
+        self._lane(item).append(item)
+        self.items[item['md5']] = item
+
+    def appendleft(self, item):
+        self._lane(item).appendleft(item)
+        self.items[item['md5']] = item
+
+    def popleft(self):
+        for lane in self.lanes.values():
+            if lane:
+                item = lane.popleft()
+                del self.items[item['md5']]
+                return item
+        raise IndexError("pop from an empty queue")
+
+    def remove(self, md5):
+        """Remove an item by md5; O(lane length) but only used on user action"""
+        item = self.items.pop(md5, None)
+        if item is None:
+            return False
+        self._lane(item).remove(item)
+        return True
+
+    def clear(self):
+        for lane in self.lanes.values():
+            lane.clear()
+        self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return chain.from_iterable(self.lanes.values())
 
 class DownloadQueue:
     def __init__(self, config):
         self.config = config
-        self.storage_file = Path(QUEUE_FILE)
-        self.storage_file.parent.mkdir(parents=True, exist_ok=True)
-        self.queue = []
-        self.current_download = None
-        self.history = []
+        self.store = create_store(config)
+        self.queue = PriorityLanes()
+        # slot -> item being downloaded by that worker slot
+        self.active = {}
+        # HistoryIndex, or a view of the history table with the SQLite store
+        self.history = HistoryIndex()
+        # md5 -> STATE_QUEUED / STATE_DOWNLOADING for queued and in-flight items
+        self.active_index = {}
+        # Versions start at the wall clock in ms so a client holding a
+        # version from before a restart never matches the new change log
+        self.version = time.time_ns() // 1_000_000
+        self.changes = deque(maxlen=QUEUE_CHANGE_LOG_SIZE)
         self.lock = threading.Lock()
+        # Signalled on every change, including progress, for /api/events
+        self.updated = threading.Condition(self.lock)
+        self.ticks = 0
+        # Set when items join or leave the queue and on notify(), never for
+        # progress; lets the prefetcher sleep through download progress
+        self.queue_changed = threading.Event()
+        # (etag, body) of the full status, replaced on every change so that
+        # readers never need the lock; queue and history JSON are cached
+        # until they change, so progress ticks only re-serialize 'current'
+        self.status_snapshot = None
+        self._queue_json = None
+        self._history_json = None
+        # md5 -> JSON of every queued item, so republishing the queue is a join
+        self._item_json = {}
+        self.compact_lock = threading.Lock()
+        self.compact_wakeup = threading.Event()
         self.logger = logging.getLogger('queue')
         self.load()
+
+        self.compactor = threading.Thread(target=self._compactor_loop, daemon=True)
+        self.compactor.start()
+
+    @property
+    def current_download(self):
+        """The active download of the lowest slot, or None"""
+        slots = sorted(self.active)
+        return self.active[slots[0]] if slots else None
+
+    def _active_list(self):
+        """Copies of the active downloads in slot order (call with lock held)"""
+        return [dict(self.active[slot]) for slot in sorted(self.active)]
     
     def load(self):
-        """Load queue from disk"""
-        if self.storage_file.exists():
+        """Load queue from the configured store"""
+        try:
+            queue, history, replayed = self.store.load()
+            self.history = self.store.open_history(history)
+            self.queue = PriorityLanes(queue)
+            self.active_index = {item['md5']: STATE_QUEUED for item in self.queue}
+            self.logger.info(f"Loaded queue: {len(self.queue)} items, {len(self.history)} history")
+            if replayed:
+                self.logger.info(f"Replayed {replayed} stored entries")
+                self.save()
+        except Exception as e:
+            self.logger.error(f"Failed to load queue: {e}")
+
+        with self.lock:
+            # max_history may have been lowered since the last run
+            self._trim_history()
+            self.version += 1
+            self.changes.clear()
+            self._item_json = {item['md5']: self._dump(item) for item in self.queue}
+            self._queue_json = self._history_json = None
+            self._notify()
+
+    def save(self):
+        """Write a full snapshot (JSON) or checkpoint the database (SQLite)"""
+        with self.compact_lock:
             try:
-                with open(self.storage_file, 'r') as f:
-                    data = json.load(f)
-                    self.queue = data.get('queue', [])
-                    self.history = data.get('history', [])
-                self.logger.info(f"Loaded queue: {len(self.queue)} items, {len(self.history)} history")
+                # Copy the state and rotate the journal atomically, then write
+                # the snapshot without holding the queue lock
+                with self.lock:
+                    queue, history = self._snapshot_state() if self.store.snapshots else (None, None)
+                    seq = self.store.rotate()
+                self.store.write_snapshot(queue, history, seq)
             except Exception as e:
-                self.logger.error(f"Failed to load queue: {e}")
-    
-    def save(self):
-        """Save queue to disk"""
+                self.logger.error(f"Failed to save queue: {e}")
+
+    def _trim_history(self):
+        """Drop history beyond queue.max_history (call with lock held)
+
+        Trimming happens in batches of 10% so appends stay amortized O(1).
+        """
+        max_history = self.config.get('queue', 'max_history', default=100)
+        length = len(self.history)
+        if max_history == 0 or length <= max_history + max(max_history // 10, 1):
+            return
+
+        self.history.trim(length - max_history)
+        self._changed({'op': 'trim_history', 'before': self.history.first_id()})
+
+    def get_state(self, md5):
+        """Return the state of an md5 in O(1), or None if it is unknown"""
+        state = self.active_index.get(md5)
+        if state:
+            return state
+        counts = self.history.counts(md5)
+        if counts:
+            return STATE_COMPLETED if counts[1] else STATE_FAILED
+        return None
+
+    def _snapshot_state(self):
+        """Copy queue and history in their persisted form (call with lock held)"""
+        max_history = self.config.get('queue', 'max_history', default=100)
+        history = list(self.history) if max_history == 0 else self.history.tail(max_history)
+
+        # In-flight downloads are persisted at the head of the queue
+        queue = [self._queue_item(item) for item in self._active_list()]
+        queue.extend(self.queue)
+        return queue, history
+
+    def _queue_item(self, item, source=None, added_at=None):
+        """Build a queued item from a queue, current or history entry"""
+        return {
+            'md5': item['md5'],
+            'source': source or item.get('source'),
+            'added_at': added_at or item.get('added_at') or datetime.now().isoformat(),
+            'status': 'queued',
+            'subfolder': item.get('subfolder'),
+            'priority': item.get('priority', QUEUE_DEFAULT_PRIORITY)
+        }
+
+    def _changed(self, *entries):
+        """Log entries for delta clients, one version each (call with lock held)
+
+        Per-entry versions let _changes_since() notice when part of a large
+        batch has already fallen out of the change log.
+        """
+        for entry in entries:
+            self.version += 1
+            self.changes.append((self.version, entry))
+            op = entry['op']
+            if op in QUEUE_OPS:
+                self._queue_json = None
+                self.queue_changed.set()
+                if op in ('add', 'requeue', 'retry'):
+                    self._item_json[entry['item']['md5']] = self._dump(entry['item'])
+                elif op == 'remove':
+                    self._item_json.pop(entry['md5'], None)
+                elif op == 'clear_queue':
+                    self._item_json.clear()
+            if op in HISTORY_OPS:
+                self._history_json = None
+        self._notify()
+
+    def _notify(self):
+        """Publish a new status snapshot and wake stream listeners (call with lock held)"""
+        self.ticks += 1
+        self._publish()
+        self.updated.notify_all()
+
+    @staticmethod
+    def _dump(obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+    def _publish(self):
+        """Serialize the full status into status_snapshot (call with lock held)"""
+        if self._queue_json is None:
+            parts = map(self._item_json.__getitem__, map(itemgetter('md5'), self.queue))
+            self._queue_json = '[' + ','.join(parts) + ']'
+        if self._history_json is None:
+            self._history_json = self._dump(self.history.recent(10))
+        active = self._active_list()
+        current = self._dump(active[0] if active else None)
+
+        body = (
+            f'{{"version":{self.version},"current":{current},"active":{self._dump(active)},'
+            f'"queue_size":{len(self.queue)},'
+            f'"queue":{self._queue_json},"recent_history":{self._history_json}}}'
+        )
+        self.status_snapshot = (f'{self.version}.{self.ticks}', body.encode())
+
+    def snapshot_if_changed(self, tag):
+        """status_snapshot, with the body left out (None) if its tag is still tag"""
+        current_tag, body = self.status_snapshot
+        return current_tag, (None if current_tag == tag else body)
+
+    def notify(self):
+        """Wake stream listeners and the prefetcher after a change the queue does not track itself"""
+        with self.lock:
+            self.queue_changed.set()
+            self._notify()
+
+    def wait_for_update(self, ticks, timeout):
+        """Block until something changed after ticks or timeout passed
+
+        Returns the current tick count to pass to the next call.
+        """
+        with self.lock:
+            self.updated.wait_for(lambda: self.ticks != ticks, timeout=timeout)
+            return self.ticks
+
+    def wait_until(self, predicate, timeout=None):
+        """Block until predicate() is true, re-checking it on every change
+
+        predicate is called with the lock held; returns its last result.
+        """
+        with self.lock:
+            return self.updated.wait_for(predicate, timeout=timeout)
+
+    def has_queued(self):
+        """True if items are waiting (call with lock held, e.g. in a wait_until predicate)"""
+        return len(self.queue) > 0
+
+    def _changes_since(self, since):
+        """Entries after version since, or None if they are no longer all logged"""
+        if since > self.version:
+            return None
+        if since == self.version:
+            return []
+        if not self.changes or self.changes[0][0] > since + 1:
+            return None
+        return [entry for version, entry in self.changes if version > since]
+
+    def _record(self, *entries):
+        """Append mutations to the journal and the change log (call with lock held)"""
+        if not entries:
+            return
+
         try:
-            max_history = self.config.get('queue', 'max_history', default=100)
-            history_to_save = self.history if max_history == 0 else self.history[-max_history:]
-            
-            with open(self.storage_file, 'w') as f:
-                json.dump({
-                    'queue': self.queue,
-                    'history': history_to_save
-                }, f, indent=2)
+            self.store.record(*entries)
+            if self.store.pending >= QUEUE_JOURNAL_COMPACT_ENTRIES:
+                self.compact_wakeup.set()
         except Exception as e:
-            self.logger.error(f"Failed to save queue: {e}")
+            self.logger.error(f"Failed to write queue journal: {e}")
+
+        # After the store, so a history served from SQLite already has the entries
+        self._changed(*entries)
+
+    def _compactor_loop(self):
+        """Periodically fold the journal into queue.json"""
+        while True:
+            interval = self.config.get('queue', 'compact_interval', default=60)
+            self.compact_wakeup.wait(timeout=interval)
+            self.compact_wakeup.clear()
+            if self.store.pending:
+                self.save()
     
-    def add(self, md5, source=None, subfolder=None):
+    def add(self, md5, source=None, subfolder=None, priority=QUEUE_DEFAULT_PRIORITY):
         """Add item to queue"""
         with self.lock:
-            # Check if in queue
-            if any(item['md5'] == md5 for item in self.queue):
-                return False, "Already in queue"
+            success, message, item = self._add_locked(md5, source, subfolder, priority)
+            if item:
+                self._record({'op': 'add', 'item': item})
+                self.logger.info(f"Added to queue: {md5}{f' (subfolder: {subfolder})' if subfolder else ''}")
+            return success, message
 
-            # Check if currently downloading
-            if self.current_download and self.current_download['md5'] == md5:
-                return False, "Currently downloading"
+    def add_many(self, entries, source=None):
+        """Add several items under a single lock acquisition and journal write
 
-            # Check if recently SUCCESSFULLY downloaded (allow retry of failures)
-            if any(item['md5'] == md5 and item.get('success', False) for item in self.history[-50:]):
-                return False, "Recently downloaded"
+        entries is a list of (md5, subfolder, priority) tuples. Returns a
+        list of (success, message) in the same order.
+        """
+        results = []
+        added = []
+        with self.lock:
+            for md5, subfolder, priority in entries:
+                success, message, item = self._add_locked(md5, source, subfolder, priority)
+                results.append((success, message))
+                if item:
+                    added.append({'op': 'add', 'item': item})
+            self._record(*added)
 
-            item = {
-                'md5': md5,
-                'source': source,
-                'added_at': datetime.now().isoformat(),
-                'status': 'queued',
-                'subfolder': subfolder
-            }
+        if added:
+            self.logger.info(f"Added {len(added)} of {len(entries)} items to queue")
+        return results
+
+    def _add_locked(self, md5, source, subfolder, priority=QUEUE_DEFAULT_PRIORITY):
+        """Validate and append an item (call with lock held)
+
+        Returns (success, message, item); item is None when nothing was added.
+        """
+        state = self.get_state(md5)
+        if state == STATE_QUEUED:
+            return False, "Already in queue", None
+        if state == STATE_DOWNLOADING:
+            return False, "Currently downloading", None
+        # Failed downloads may be added again
+        if state == STATE_COMPLETED:
+            return False, "Recently downloaded", None
 
-            self.queue.append(item)
-            self.save()
-            self.logger.info(f"Added to queue: {md5}{f' (subfolder: {subfolder})' if subfolder else ''}")
-            return True, "Added to queue"
+        item = {
+            'md5': md5,
+            'source': source,
+            'added_at': datetime.now().isoformat(),
+            'status': 'queued',
+            'subfolder': subfolder,
+            'priority': priority
+        }
+
+        self.queue.append(item)
+        self.active_index[md5] = STATE_QUEUED
+        return True, "Added to queue", item
     
-    def get_next(self):
-        """Get next item from queue"""
+    def get_next(self, slot=0):
+        """Pop the next item and make it the active download of slot"""
         with self.lock:
             if self.queue:
-                return self.queue.pop(0)
+                item = self.queue.popleft()
+                self.active_index[item['md5']] = STATE_DOWNLOADING
+                # The worker annotates the active download in place; keep
+                # the logged 'add' entry untouched
+                item = dict(item, status='downloading', started_at=datetime.now().isoformat(), slot=slot)
+                self.active[slot] = item
+                self._changed({'op': 'remove', 'md5': item['md5']})
+                return item
             return None
+
+    def peek(self, count):
+        """md5s of the next count items get_next() would return, in order"""
+        with self.lock:
+            return [item['md5'] for item in islice(self.queue, count)]
+
+    def _release(self, md5):
+        """Forget the active download of md5 (call with lock held)"""
+        for slot, item in list(self.active.items()):
+            if item['md5'] == md5:
+                del self.active[slot]
     
     def mark_complete(self, md5, success, filepath=None, error=None, used_fast_download=False, filename=None, subfolder=None):
         """Mark download as complete"""
@@ -96,8 +424,10 @@ class DownloadQueue:
                 'subfolder': subfolder
             }
             self.history.append(item)
-            self.current_download = None
-            self.save()
+            self.active_index.pop(md5, None)
+            self._release(md5)
+            self._record({'op': 'complete', 'item': item})
+            self._trim_history()
 
             if success:
                 method = "fast download" if used_fast_download else "mirror"
@@ -106,33 +436,64 @@ class DownloadQueue:
             else:
                 self.logger.warning(f"Download failed: {filename or md5} - {error}")
     
-    def get_status(self):
-        """Get current queue status"""
-        with self.lock:
-            return {
-                'current': self.current_download,
-                'queue': self.queue.copy(),
-                'queue_size': len(self.queue),
-                'recent_history': self.history[-10:][::-1]
+    def update_current(self, slot=0, **fields):
+        """Update fields of the active download of slot"""
+        with self.lock:
+            if slot in self.active:
+                self.active[slot].update(fields)
+                self._notify()
+
+    def query_history(self, **filters):
+        """Page through history newest first, see HistoryIndex.query()"""
+        with self.lock:
+            return self.history.query(**filters)
+
+    def get_status(self, since=None):
+        """Get current queue status
+
+        With since (a version from an earlier call) the queue and history are
+        replaced by 'changes', the journal-style entries applied after it.
+        Falls back to the full status if since is unknown or too old.
+        """
+        with self.lock:
+            # Copied so serializing them races no worker update
+            active = self._active_list()
+            status = {
+                'version': self.version,
+                'current': active[0] if active else None,
+                'active': active,
+                'queue_size': len(self.queue)
             }
+
+            changes = self._changes_since(since) if since is not None else None
+            if changes is not None:
+                status['since'] = since
+                status['changes'] = changes
+            else:
+                status['queue'] = list(self.queue)
+                status['recent_history'] = self.history.recent(10)
+            return status
     
     def remove_from_queue(self, md5):
         """Remove item from queue"""
         with self.lock:
-            original_length = len(self.queue)
-            self.queue = [item for item in self.queue if item['md5'] != md5]
-            removed = original_length != len(self.queue)
-            if removed:
-                self.save()
-                self.logger.info(f"Removed from queue: {md5}")
-            return removed
+            if self.active_index.get(md5) != STATE_QUEUED:
+                return False
+
+            self.queue.remove(md5)
+            del self.active_index[md5]
+            self._record({'op': 'remove', 'md5': md5})
+            self.logger.info(f"Removed from queue: {md5}")
+            return True
     
     def clear_queue(self):
         """Clear all items from queue"""
         with self.lock:
             count = len(self.queue)
-            self.queue = []
-            self.save()
+            for item in self.queue:
+                self.active_index.pop(item['md5'], None)
+            self.queue.clear()
+            self._record({'op': 'clear_queue'})
             self.logger.info(f"Cleared queue: {count} items removed")
             return count
     
@@ -140,60 +501,81 @@ class DownloadQueue:
         """Clear all items from history"""
         with self.lock:
             count = len(self.history)
-            self.history = []
-            self.save()
+            self.history.clear()
+            self._record({'op': 'clear_history'})
             self.logger.info(f"Cleared history: {count} items removed")
             return count
     
     def retry_failed(self, md5):
         """Retry a failed download by removing from history and re-adding to queue"""
         with self.lock:
-            # Find the failed item in history
-            failed_item = None
-            for item in self.history:
-                if item['md5'] == md5 and not item.get('success', False):
-                    failed_item = item
-                    break
-
-            if not failed_item:
+            # Any failed entry can be retried, even if the md5 also succeeded later
+            counts = self.history.counts(md5)
+            if not counts or counts[0] == counts[1]:
                 return False, "Item not found in failed history"
+            if md5 in self.active_index:
+                return False, "Already in queue"
 
             # Remove from history
-            self.history = [item for item in self.history if item['md5'] != md5]
+            self.history.remove_md5(md5)
 
             # Add back to queue
             new_item = {
                 'md5': md5,
                 'source': 'retry',
                 'added_at': datetime.now().isoformat(),
-                'status': 'queued'
+                'status': 'queued',
+                'priority': QUEUE_DEFAULT_PRIORITY
             }
 
             self.queue.append(new_item)
-            self.save()
+            self.active_index[md5] = STATE_QUEUED
+            self._record({'op': 'retry', 'item': new_item})
             self.logger.info(f"Retrying failed download: {md5}")
             return True, "Added to queue for retry"
 
-    def requeue_current(self):
-        """Move current download back to front of queue"""
+    def _slots(self, slot):
+        """The given slot if active, or every active slot when slot is None"""
+        if slot is None:
+            return sorted(self.active)
+        return [slot] if slot in self.active else []
+
+    def requeue_current(self, slot=None, front=True):
+        """Move the active download of slot (or all of them) back to the front of its lane
+
+        With front=False it goes behind the items already waiting in its lane.
+        """
         with self.lock:
-            if not self.current_download:
-                return False
+            slots = self._slots(slot)
 
-            md5 = self.current_download['md5']
+            # Requeue the highest slot first so the lowest ends up in front
+            for slot in (reversed(slots) if front else slots):
+                current = self.active.pop(slot)
+                md5 = current['md5']
 
-            # Create queue item from current download
-            item = {
-                'md5': md5,
-                'source': self.current_download.get('source', 'paused'),
-                'added_at': datetime.now().isoformat(),
-                'status': 'queued',
-                'subfolder': self.current_download.get('subfolder')
-            }
+                # Create queue item from current download
+                item = self._queue_item(current, source=current.get('source', 'paused'),
+                                        added_at=datetime.now().isoformat())
+
+                entry = {'op': 'requeue', 'item': item}
+                if front:
+                    self.queue.appendleft(item)
+                else:
+                    self.queue.append(item)
+                    entry['front'] = False
+                self.active_index[md5] = STATE_QUEUED
+                self._record(entry)
+                self.logger.info(f"Requeued current download: {md5}")
+            return bool(slots)
+
+    def drop_current(self, slot=None):
+        """Forget the active download of slot (or all of them) without adding it to history"""
+        with self.lock:
+            slots = self._slots(slot)
 
-            # Add to front of queue
-            self.queue.insert(0, item)
-            self.current_download = None
-            self.save()
-            self.logger.info(f"Requeued current download: {md5}")
-            return True
\ No newline at end of file
+            for slot in slots:
+                md5 = self.active.pop(slot)['md5']
+                self.active_index.pop(md5, None)
+                self._record({'op': 'remove', 'md5': md5})
+                self.logger.info(f"Dropped current download: {md5}")
+            return bool(slots)
@@ -0,0 +1,498 @@
+import os
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from stacks.constants import QUEUE_FILE, QUEUE_JOURNAL_FILE, QUEUE_DB_FILE
+from stacks.server.history import HistoryIndex, until_bound
+
+logger = logging.getLogger('queue')
+
+
+def apply_op(queue, history, entry):
+    """Apply a single journal entry to plain queue/history lists.
+
+    An item that is being downloaded stays in the persisted queue until its
+    'complete' (or 'remove') entry is written, so a crash mid-download
+    leaves it queued for the next start.
+    """
+    op = entry.get('op')
+
+    if op == 'add':
+        queue.append(entry['item'])
+    elif op == 'remove':
+        queue[:] = [item for item in queue if item['md5'] != entry['md5']]
+    elif op == 'requeue':
+        item = entry['item']
+        queue[:] = [i for i in queue if i['md5'] != item['md5']]
+        if entry.get('front', True):
+            queue.insert(0, item)
+        else:
+            queue.append(item)
+    elif op == 'complete':
+        item = entry['item']
+        queue[:] = [i for i in queue if i['md5'] != item['md5']]
+        history.append(item)
+    elif op == 'retry':
+        item = entry['item']
+        history[:] = [i for i in history if i['md5'] != item['md5']]
+        queue.append(item)
+    elif op == 'clear_queue':
+        queue.clear()
+    elif op == 'clear_history':
+        history.clear()
+    else:
+        logger.warning(f"Unknown journal op: {op}")
+
+
+class JournalStore:
+    """
+    Queue persistence as a snapshot (queue.json) plus an append-only journal.
+
+    Every mutation is appended to the journal as one JSON line carrying a
+    sequence number. DownloadQueue.save() folds the journal into a new
+    snapshot which records the last sequence number it contains, so
+    replaying a journal that survived a crash never applies an entry twice.
+    """
+
+    # save() hands the full queue and history to write_snapshot()
+    snapshots = True
+
+    def __init__(self, snapshot_file, journal_file):
+        self.snapshot_file = Path(snapshot_file)
+        self.journal_file = Path(journal_file)
+        self.rotated_file = self.journal_file.with_name(self.journal_file.name + '.old')
+        self.snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        self.seq = 0
+        self.pending = 0
+        self._fh = None
+
+    def load(self):
+        """Read the snapshot and replay the journal on top of it.
+
+        Returns (queue, history, replayed_entries).
+        """
+        queue, history, snapshot_seq = [], [], 0
+
+        if self.snapshot_file.exists():
+            with open(self.snapshot_file, 'r') as f:
+                data = json.load(f)
+            queue = data.get('queue', [])
+            history = data.get('history', [])
+            snapshot_seq = data.get('seq', 0)
+
+        self.seq = snapshot_seq
+        replayed = 0
+
+        # A rotated journal exists only if a compaction was interrupted
+        for path in (self.rotated_file, self.journal_file):
+            for entry in self._read_journal(path):
+                seq = entry.get('seq', 0)
+                if seq <= snapshot_seq:
+                    continue
+                apply_op(queue, history, entry)
+                self.seq = max(self.seq, seq)
+                replayed += 1
+
+        self.pending = replayed
+        return queue, history, replayed
+
+    def open_history(self, history):
+        """History as DownloadQueue uses it: indexed in memory"""
+        return HistoryIndex(history)
+
+    def _read_journal(self, path):
+        if not path.exists():
+            return
+
+        with open(path, 'r') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line is expected after a crash mid-write
+                    logger.warning(f"Skipping unreadable journal entry {path.name}:{line_no}")
+
+    def record(self, *entries):
+        """Append one or more entries to the journal with a single write.
+
+        Callers must hold the queue lock so sequence numbers match the order
+        in which the mutations were applied in memory.
+        """
+        if not entries:
+            return
+
+        lines = []
+        for entry in entries:
+            self.seq += 1
+            lines.append(json.dumps({'seq': self.seq, **entry}, separators=(',', ':')))
+
+        if self._fh is None:
+            # A torn last line left by a crash must not swallow the first new entry
+            if self._torn(self.journal_file):
+                lines.insert(0, '')
+            self._fh = open(self.journal_file, 'a')
+        self._fh.write('\n'.join(lines) + '\n')
+        self._fh.flush()
+        self.pending += len(entries)
+
+    @staticmethod
+    def _torn(path):
+        """True if path does not end with a complete line"""
+        try:
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                if not f.tell():
+                    return False
+                f.seek(-1, os.SEEK_END)
+                return f.read(1) != b'\n'
+        except FileNotFoundError:
+            return False
+
+    def rotate(self):
+        """Start a fresh journal and return the sequence number it starts after.
+
+        Must be called under the queue lock, together with taking the copy
+        of the state that will become the next snapshot.
+        """
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+        if self.journal_file.exists():
+            if self.rotated_file.exists():
+                # A previous compaction failed before finishing; keep both
+                torn = self._torn(self.rotated_file)
+                with open(self.rotated_file, 'a') as dst, open(self.journal_file, 'r') as src:
+                    if torn:
+                        dst.write('\n')
+                    dst.write(src.read())
+                self.journal_file.unlink()
+            else:
+                os.replace(self.journal_file, self.rotated_file)
+
+        self.pending = 0
+        return self.seq
+
+    def write_snapshot(self, queue, history, seq):
+        """Atomically replace queue.json and drop the rotated journal."""
+        tmp_file = self.snapshot_file.with_name(self.snapshot_file.name + '.tmp')
+
+        with open(tmp_file, 'w') as f:
+            json.dump({
+                'seq': seq,
+                'queue': queue,
+                'history': history
+            }, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp_file, self.snapshot_file)
+        self.rotated_file.unlink(missing_ok=True)
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class SQLiteStore:
+    """
+    Queue persistence in an SQLite database.
+
+    Each journal entry is applied as SQL inside one transaction, so the
+    database is always current and there is nothing to compact. Only the
+    queue is read at startup; the history stays in its table and is served
+    by SQLiteHistory with indexed queries. On first use the JSON snapshot
+    and journal are imported and renamed with a .migrated suffix.
+    """
+
+    # The database is always current: save() only checkpoints it
+    snapshots = False
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS queue (
+            md5 TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_queue_position ON queue(position);
+        CREATE INDEX IF NOT EXISTS idx_queue_status ON queue(status);
+
+        CREATE TABLE IF NOT EXISTS history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            md5 TEXT NOT NULL,
+            completed_at TEXT,
+            success INTEGER NOT NULL DEFAULT 0,
+            used_fast_download INTEGER NOT NULL DEFAULT 0,
+            subfolder TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_history_md5 ON history(md5);
+        CREATE INDEX IF NOT EXISTS idx_history_completed_at ON history(completed_at);
+        CREATE INDEX IF NOT EXISTS idx_history_success ON history(success);
+    """
+
+    def __init__(self, db_file, legacy_store=None):
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.legacy_store = legacy_store
+        self.seq = 0
+        self.pending = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(str(self.db_file), check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+
+    def load(self):
+        """Read the queue, importing the JSON store on first use.
+
+        Returns (queue, None, migrated_entries); see open_history() for the history.
+        """
+        migrated = 0
+        if self._is_empty() and self.legacy_store and self.legacy_store.snapshot_file.exists():
+            migrated = self._migrate_legacy()
+
+        with self._lock:
+            queue = [json.loads(row[0]) for row in
+                     self.conn.execute("SELECT data FROM queue ORDER BY position")]
+            self._head, self._tail = self.conn.execute(
+                "SELECT COALESCE(MIN(position), 0), COALESCE(MAX(position), 0) FROM queue"
+            ).fetchone()
+
+        return queue, None, migrated
+
+    def open_history(self, history):
+        """History as DownloadQueue uses it: queried from the history table"""
+        return SQLiteHistory(self)
+
+    def fetch(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def _is_empty(self):
+        with self._lock:
+            queued = self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+            completed = self.conn.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+        return queued == 0 and completed == 0
+
+    def _migrate_legacy(self):
+        legacy = self.legacy_store
+        queue, history, _ = legacy.load()
+        legacy.close()
+
+        self._head = self._tail = 0
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for item in queue:
+                    self._insert_queue(item, front=False)
+                for item in history:
+                    self._insert_history(item)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        for path in (legacy.snapshot_file, legacy.rotated_file, legacy.journal_file):
+            if path.exists():
+                os.replace(path, path.with_name(path.name + '.migrated'))
+
+        logger.info(f"Migrated {len(queue)} queued and {len(history)} history items from {legacy.snapshot_file.name} to {self.db_file.name}")
+        return len(queue) + len(history)
+
+    def _insert_queue(self, item, front):
+        if front:
+            self._head -= 1
+            position = self._head
+        else:
+            self._tail += 1
+            position = self._tail
+        self.conn.execute(
+            "INSERT OR REPLACE INTO queue (md5, position, status, data) VALUES (?, ?, ?, ?)",
+            (item['md5'], position, item.get('status', 'queued'), json.dumps(item))
+        )
+
+    def _insert_history(self, item):
+        # The id assigned by SQLiteHistory.append(), if any, so cursors match rows
+        item_id = item.get('id') if isinstance(item.get('id'), int) else None
+        self.conn.execute(
+            "INSERT INTO history (id, md5, completed_at, success, used_fast_download, subfolder, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (item_id, item['md5'], item.get('completed_at'), int(bool(item.get('success'))),
+             int(bool(item.get('used_fast_download'))), item.get('subfolder'), json.dumps(item))
+        )
+
+    def _apply(self, entry):
+        op = entry.get('op')
+
+        if op == 'add':
+            self._insert_queue(entry['item'], front=False)
+        elif op == 'remove':
+            self.conn.execute("DELETE FROM queue WHERE md5 = ?", (entry['md5'],))
+        elif op == 'requeue':
+            self._insert_queue(entry['item'], front=entry.get('front', True))
+        elif op == 'complete':
+            item = entry['item']
+            self.conn.execute("DELETE FROM queue WHERE md5 = ?", (item['md5'],))
+            self._insert_history(item)
+        elif op == 'retry':
+            item = entry['item']
+            self.conn.execute("DELETE FROM history WHERE md5 = ?", (item['md5'],))
+            self._insert_queue(item, front=False)
+        elif op == 'clear_queue':
+            self.conn.execute("DELETE FROM queue")
+        elif op == 'clear_history':
+            self.conn.execute("DELETE FROM history")
+        else:
+            logger.warning(f"Unknown journal op: {op}")
+
+    def record(self, *entries):
+        """Apply one or more entries in a single transaction"""
+        if not entries:
+            return
+
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for entry in entries:
+                    self._apply(entry)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        self.seq += len(entries)
+        self.pending += len(entries)
+
+    def rotate(self):
+        self.pending = 0
+        return self.seq
+
+    def write_snapshot(self, queue, history, seq):
+        """Checkpoint the WAL (history is trimmed by SQLiteHistory.trim() as it grows)"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class SQLiteHistory:
+    """
+    The history table of an SQLiteStore, with the interface of HistoryIndex.
+
+    Lookups are indexed queries: md5 counts use idx_history_md5, success
+    and method filters idx_history_success and date bounds
+    idx_history_completed_at (secondary indexes end in the row id, so
+    pages come out newest first without sorting). Ids come from the
+    AUTOINCREMENT sequence and never repeat, even after a clear.
+
+    Changes that are journaled ('complete', 'retry', 'clear_history') are
+    written by SQLiteStore.record(): append() only assigns the id, and
+    remove_md5() and clear() leave the rows to the entry that follows.
+    trim() is not journaled and deletes rows itself.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        rows = store.fetch("SELECT seq FROM sqlite_sequence WHERE name = 'history'")
+        self.last_id = rows[0][0] if rows else 0
+
+    @staticmethod
+    def _item(row):
+        item = json.loads(row[1])
+        item['id'] = row[0]
+        return item
+
+    def append(self, item):
+        self.last_id += 1
+        item['id'] = self.last_id
+        return item
+
+    def remove_md5(self, md5):
+        """Nothing to do here: the 'retry' entry recorded next deletes the md5's rows"""
+
+    def clear(self):
+        """Nothing to do here: the 'clear_history' entry recorded next deletes the rows"""
+
+    def trim(self, count):
+        """Delete the oldest count rows"""
+        with self.store._lock:
+            self.store.conn.execute(
+                "DELETE FROM history WHERE id IN (SELECT id FROM history ORDER BY id LIMIT ?)", (count,)
+            )
+
+    def counts(self, md5):
+        """(entries, successful entries) for md5, or None if it has none"""
+        entries, successes = self.store.fetch(
+            "SELECT COUNT(*), COALESCE(SUM(success), 0) FROM history WHERE md5 = ?", (md5,)
+        )[0]
+        return (entries, successes) if entries else None
+
+    def first_id(self):
+        return self.store.fetch("SELECT MIN(id) FROM history")[0][0]
+
+    def tail(self, count):
+        """The newest count entries, oldest first"""
+        if count <= 0:
+            return []
+        rows = self.store.fetch("SELECT id, data FROM history ORDER BY id DESC LIMIT ?", (count,))
+        return [self._item(row) for row in reversed(rows)]
+
+    def recent(self, count):
+        return self.tail(count)[::-1]
+
+    def __len__(self):
+        return self.store.fetch("SELECT COUNT(*) FROM history")[0][0]
+
+    def __iter__(self):
+        return map(self._item, self.store.fetch("SELECT id, data FROM history ORDER BY id"))
+
+    def query(self, cursor=None, limit=50, success=None, method=None, subfolder=None, since=None, until=None):
+        """Page through entries newest first, see HistoryIndex.query()"""
+        where, params = [], []
+        if cursor is not None:
+            where.append("id < ?")
+            params.append(cursor)
+        if success is not None:
+            where.append("success = ?")
+            params.append(int(bool(success)))
+        if method is not None:
+            where.append("success = 1 AND used_fast_download = ?")
+            params.append(int(method == 'fast'))
+        if subfolder is not None:
+            where.append("subfolder IS ?")
+            params.append(subfolder or None)
+        if since is not None:
+            where.append("completed_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("completed_at <= ?")
+            params.append(until_bound(until))
+
+        sql = "SELECT id, data FROM history"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        # One row more than the page tells whether there is a next page
+        rows = self.store.fetch(sql + " ORDER BY id DESC LIMIT ?", (*params, limit + 1))
+        page = [self._item(row) for row in rows[:limit]]
+        next_cursor = page[-1]['id'] if len(rows) > limit else None
+        return page, next_cursor
+
+
+def create_store(config):
+    """Create the queue store selected by queue.storage"""
+    journal_store = JournalStore(QUEUE_FILE, QUEUE_JOURNAL_FILE)
+
+    if config.get('queue', 'storage', default='json') == 'sqlite':
+        return SQLiteStore(QUEUE_DB_FILE, legacy_store=journal_store)
+    return journal_store
@@ -8,8 +8,7 @@ from flask import Flask
 from flask_cors import CORS
 from stacks.config.config import Config
 from stacks.constants import WWW_PATH, TIMESTAMP, CONFIG_FILE
-from stacks.server.queue import DownloadQueue
-from stacks.server.worker import DownloadWorker
+from stacks.server.engine import Engine
 from stacks.utils.logutils import setup_logging
 from stacks.api import register_api
 import logging
@@ -23,7 +22,7 @@ def create_app(config_path: str = None, debug_mode: bool = False):
     - Flask应用实例
     - CORS支持
     - 配置加载
-    - 下载队列和工作线程
+    - 下载引擎（下载队列和工作线程，多个工作进程时只有一个进程运行）
     - API路由注册
     
     Args:
@@ -66,16 +65,29 @@ def create_app(config_path: str = None, debug_mode: bool = False):
     # ---- 从配置设置会话密钥 ----
     app.secret_key = config.get("api", "session_secret")
 
-    # ---- 初始化下载队列和工作线程 ----
-    queue = DownloadQueue(config)  # 创建下载队列管理器
-    worker = DownloadWorker(queue, config)  # 创建下载工作线程
-    worker.start()  # 启动工作线程（开始处理下载任务）
+    # ---- 启动下载引擎（下载队列和工作线程）----
+    # Gunicorn 的每个工作进程都会执行到这里，但只有抢到 ENGINE_LOCK_FILE 的进程
+    # 真正运行下载引擎；其他进程拿到的是代理对象，通过 ENGINE_SOCKET 转发给引擎进程
+    engine = Engine(config)
+    engine.start()
+    queue, worker = engine.proxies()
 
     # ---- 将后端对象附加到Flask应用 ----
     # 这样可以在路由处理函数中访问这些对象
     app.stacks_config = config    # 配置对象
-    app.stacks_queue = queue      # 下载队列
-    app.stacks_worker = worker    # 工作线程
+    app.stacks_engine = engine    # 下载引擎
+    app.stacks_queue = queue      # 下载队列（或代理）
+    app.stacks_worker = worker    # 工作线程（或代理）
+
+    # ---- 跟上其他进程保存的配置 ----
+    @app.before_request
+    def refresh_config():
+        """
+        请求前检查配置文件是否被其他工作进程修改过
+        只比较文件修改时间，修改过才重新加载并更新日志设置。
+        """
+        if config.refresh():
+            setup_logging(config)
 
     # ---- 设置默认端口和主机 ----
     app.stacks_host = config.get("server", "host", default="0.0.0.0")
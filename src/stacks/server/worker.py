@@ -1,10 +1,46 @@
+import json
 import threading
 import logging
 import time
-from datetime import datetime
 from pathlib import Path
 from stacks.downloader.downloader import AnnaDownloader
-from stacks.constants import FAST_DOWNLOAD_API_URL, DOWNLOAD_PATH, PROJECT_ROOT
+from stacks.downloader import aio
+from stacks.downloader.ratelimit import DomainRateLimiter
+from stacks.downloader.utils import same_filesystem
+from stacks.downloader.scoreboard import MirrorScoreboard
+from stacks.downloader.breaker import CircuitBreaker, NegativeCache
+from stacks.server.queue import STATE_QUEUED, STATE_DOWNLOADING
+from stacks.constants import FAST_DOWNLOAD_API_URL, DOWNLOAD_PATH, PROJECT_ROOT, RATE_LIMIT_DEFAULT_DOMAIN, MIRROR_SCOREBOARD_FILE, MIGRATION_STATE_FILE
+from stacks.utils.migrationutils import migrate_incomplete_folder
+
+class DownloadSlot:
+    """One download thread with its own cancel state and progress reporting"""
+
+    def __init__(self, queue, index):
+        self.queue = queue
+        self.index = index
+        self.thread = None
+        self.cancel = False
+        self.remove = False
+
+    def progress_callback(self, progress):
+        # Check if download should be cancelled
+        if self.cancel:
+            return False  # Signal to downloader to cancel
+
+        # Handle check_only requests (for orchestrator)
+        if isinstance(progress, dict) and progress.get('check_only'):
+            return True  # Continue if not cancelled
+
+        self.queue.update_current(self.index, progress=progress)
+        return True  # Continue download
+
+    def status_callback(self, status_message):
+        self.queue.update_current(self.index, status_message=status_message)
+
+    def reset(self):
+        self.cancel = False
+        self.remove = False
 
 class DownloadWorker:
     def __init__(self, queue, config):
@@ -12,38 +48,28 @@ class DownloadWorker:
         self.config = config
         self.running = False
         self.paused = False
-        self.cancel_current = False
-        self.thread = None
+        # slot index -> DownloadSlot, one thread each
+        self.slots = {}
+        self.slots_lock = threading.Lock()
         self.logger = logging.getLogger('worker')
-        
-        # Progress callback to update current download
-        def progress_callback(progress):
-            # Check if download should be cancelled
-            if self.cancel_current:
-                return False  # Signal to downloader to cancel
-
-            # Handle check_only requests (for orchestrator)
-            if isinstance(progress, dict) and progress.get('check_only'):
-                return True  # Continue if not cancelled
-
-            if self.queue.current_download:
-                with self.queue.lock:
-                    self.queue.current_download.update({
-                        'progress': progress
-                    })
-            return True  # Continue download
-
-        # Status callback to update current download status
-        def status_callback(status_message):
-            if self.queue.current_download:
-                with self.queue.lock:
-                    self.queue.current_download.update({
-                        'status_message': status_message
-                    })
-
-        # Initialize downloader
-        self.progress_callback = progress_callback
-        self.status_callback = status_callback
+
+        # md5 -> (expires_at, filename, links) resolved ahead of time by the prefetcher
+        self.prefetched = {}
+        self.prefetch_lock = threading.Lock()
+        self.prefetch_thread = None
+
+        # Background move of .part files to a new incomplete folder (see start_migration)
+        self.migration = None
+        self.migration_thread = None
+        self.migration_lock = threading.Lock()
+
+        # Per-domain limits outlive the downloader so config changes keep their state
+        self.rate_limiter = DomainRateLimiter()
+        self.scoreboard = MirrorScoreboard(MIRROR_SCOREBOARD_FILE)
+        self.breaker = CircuitBreaker()
+        self.negative_cache = NegativeCache()
+
+        # Initialize downloader; slots use copies with their own callbacks
         self.recreate_downloader()
     
     def recreate_downloader(self):
@@ -77,18 +103,36 @@ class DownloadWorker:
         incomplete_folder_path = self.config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
         incomplete_dir = PROJECT_ROOT / incomplete_folder_path.lstrip('/')
 
+        self.rate_limiter.configure(self._rate_limits())
+
+        # Transfer backend
+        downloader_class = AnnaDownloader
+        if self.config.get('downloads', 'backend', default='threads') == 'asyncio':
+            if aio.available():
+                downloader_class = aio.AsyncAnnaDownloader
+            else:
+                self.logger.warning("downloads.backend is asyncio but aiohttp is not installed, using threads")
+
         # Pass None if FlareSolverr is disabled, otherwise pass the URL
-        self.downloader = AnnaDownloader(
+        self.downloader = downloader_class(
             output_dir=DOWNLOAD_PATH,
             incomplete_dir=incomplete_dir,
-            progress_callback=self.progress_callback,
-            status_callback=self.status_callback,
             fast_download_config=fast_config,
             flaresolverr_url=flaresolverr_url if flaresolverr_enabled else None,
             flaresolverr_timeout=flaresolverr_timeout_ms,
             prefer_title_naming=prefer_title_naming,
-            include_hash=include_hash
+            include_hash=include_hash,
+            rate_limiter=self.rate_limiter,
+            segments=self.config.get('downloads', 'segments', default=1),
+            mirror_race=self.config.get('downloads', 'mirror_race', default=1),
+            scoreboard=self.scoreboard,
+            breaker=self.breaker,
+            negative_cache=self.negative_cache
         )
+
+        if not same_filesystem(incomplete_dir, DOWNLOAD_PATH):
+            self.logger.info("Incomplete folder is on a different filesystem than the download folder, "
+                             "finished files will be copied instead of renamed")
         
         # Test fast download key if enabled and key is present
         if fast_config['enabled'] and fast_config['key']:
@@ -127,88 +171,241 @@ class DownloadWorker:
     
     def update_config(self):
         """Update downloader with new config (called when config changes)"""
+        self.config.refresh()
         self.recreate_downloader()
-    
+        if self.running:
+            self._sync_slots()
+        # Wake idle slots (retirement) and the prefetcher (prefetch_count)
+        self.queue.notify()
+
+    def _rate_limits(self):
+        """Per-domain policies from downloads.rate_limits, or downloads.delay for Anna's Archive"""
+        policies = self.config.get('downloads', 'rate_limits', default=None)
+        if policies is not None:
+            return policies
+
+        delay = self.config.get('downloads', 'delay', default=2)
+        return {RATE_LIMIT_DEFAULT_DOMAIN: {'interval': delay, 'burst': 1, 'concurrency': 0}}
+
+    def _slot_count(self):
+        return self.config.get('downloads', 'concurrent_downloads', default=1)
+
+    def _slot_retired(self, slot):
+        """True once the worker stopped or slot is above downloads.concurrent_downloads"""
+        return not self.running or slot.index >= self._slot_count()
+
+    def _sync_slots(self):
+        """Start slots up to downloads.concurrent_downloads
+
+        Slots above the limit finish their current download and exit.
+        """
+        with self.slots_lock:
+            for index in range(self._slot_count()):
+                if index in self.slots:
+                    continue
+                slot = DownloadSlot(self.queue, index)
+                slot.thread = threading.Thread(target=self._worker_loop, args=(slot,), daemon=True)
+                self.slots[index] = slot
+                slot.thread.start()
+
     def start(self):
-        """Start worker thread"""
+        """Start worker threads"""
         if not self.running:
             self.running = True
-            self.thread = threading.Thread(target=self._worker_loop, daemon=True)
-            self.thread.start()
-            self.logger.info("Download worker started")
+            self._sync_slots()
+            if self.prefetch_thread is None or not self.prefetch_thread.is_alive():
+                self.prefetch_thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+                self.prefetch_thread.start()
+            self.logger.info(f"Download worker started ({len(self.slots)} slot(s))")
+            self._resume_migration()
     
     def stop(self):
-        """Stop worker thread and cancel any active downloads"""
+        """Stop worker threads and cancel any active downloads"""
         self.logger.info("Stopping download worker...")
         self.running = False
-
-        # Mark current download as interrupted if one is active
-        if self.queue.current_download:
-            with self.queue.lock:
-                item = self.queue.current_download
-                self.logger.warning(f"Cancelling active download: {item.get('title', 'Unknown')}")
-                # Put it back in the queue so it can be resumed later
-                self.queue.queue.insert(0, {
-                    'md5': item['md5'],
-                    'title': item.get('title', 'Unknown'),
-                    'source': item.get('source'),
-                    'added_at': item.get('added_at'),
-                    'status': 'queued',
-                    'subfolder': item.get('subfolder')
-                })
-                self.queue.current_download = None
-                self.queue.save()
-
-        if self.thread:
-            self.thread.join(timeout=5)
-            if self.thread.is_alive():
-                self.logger.warning("Worker thread did not stop gracefully within timeout")
-            else:
-                self.logger.info("Download worker stopped")
+        self.queue.notify()
+
+        # Mark active downloads as interrupted
+        with self.queue.lock:
+            active = list(self.queue.active.values())
+        for item in active:
+            self.logger.warning(f"Cancelling active download: {item.get('filename', 'Unknown')}")
+        # Put them back in the queue so they can be resumed later
+        self.queue.requeue_current()
+
+        with self.slots_lock:
+            slots = list(self.slots.values())
+        # Abort transfers so they do not complete after being requeued
+        for slot in slots:
+            slot.cancel = True
+        deadline = time.time() + 5
+        for slot in slots:
+            slot.thread.join(timeout=max(deadline - time.time(), 0))
+        if any(slot.thread.is_alive() for slot in slots):
+            self.logger.warning("Worker thread did not stop gracefully within timeout")
+        else:
+            self.logger.info("Download worker stopped")
 
     def pause(self):
         """Pause the worker"""
         if not self.paused:
             self.paused = True
+            self.queue.notify()
             self.logger.info("Download worker paused")
-            # Note: Active downloads will be requeued when they complete (see worker loop)
+            # Note: Active downloads finish and are marked complete; slots then wait for resume
 
     def resume(self):
         """Resume the worker"""
+        if self.migrating():
+            self.logger.warning("Not resuming while incomplete downloads are being moved")
+            return
         if self.paused:
             self.paused = False
+            self.queue.notify()
             self.logger.info("Download worker resumed")
 
-    def cancel_and_requeue_current(self):
-        """Cancel current download and requeue it"""
-        if self.queue.current_download:
-            self.cancel_current = True
-            # Also pause the queue so it doesn't immediately restart
-            if not self.paused:
-                self.paused = True
-                self.logger.info("Pausing queue after pausing download")
-            self.logger.info(f"Pausing download and requeueing: {self.queue.current_download.get('filename', 'Unknown')}")
-            return True
-        return False
-
-    def cancel_and_remove_current(self):
-        """Cancel current download and remove it completely"""
-        if self.queue.current_download:
-            self.cancel_current = True
+    def _active_slots(self, md5=None):
+        """(slot, item) for active downloads, optionally only the one for md5"""
+        with self.queue.lock:
+            active = [(self.slots.get(index), item) for index, item in sorted(self.queue.active.items())]
+        return [(slot, item) for slot, item in active
+                if slot is not None and (md5 is None or item['md5'] == md5)]
+
+    def cancel_and_requeue_current(self, md5=None):
+        """Cancel the active download of md5 (or all of them) and requeue it
+
+        Cancelling every download also pauses the queue so they do not restart
+        right away. A single one goes back behind the items waiting in its
+        lane while the other slots keep going.
+        """
+        active = self._active_slots(md5)
+        if not active:
+            return False
+
+        for slot, item in active:
+            slot.cancel = True
+            self.logger.info(f"Pausing download and requeueing: {item.get('filename', 'Unknown')}")
+        if md5 is None and not self.paused:
+            self.paused = True
+            self.queue.notify()
+            self.logger.info("Pausing queue after pausing downloads")
+        return True
+
+    def cancel_and_remove_current(self, md5=None):
+        """Cancel the active download of md5 (or all of them) and remove it completely"""
+        active = self._active_slots(md5)
+        if not active:
+            return False
+
+        for slot, item in active:
             # Mark for removal (worker loop will handle it)
-            with self.queue.lock:
-                self.queue.current_download['_remove'] = True
+            slot.remove = True
+            slot.cancel = True
             # Don't pause when removing - user explicitly wants it gone and queue should continue
-            self.logger.info(f"Stopping download and removing: {self.queue.current_download.get('filename', 'Unknown')}")
-            return True
-        return False
+            self.logger.info(f"Stopping download and removing: {item.get('filename', 'Unknown')}")
+        return True
 
     def wait_for_current_download_to_stop(self, timeout=10):
-        """Wait for current download to stop (for migration)"""
-        start = time.time()
-        while self.queue.current_download and (time.time() - start) < timeout:
-            time.sleep(0.1)
-        return self.queue.current_download is None
+        """Wait for all active downloads to stop (for migration)"""
+        return self.queue.wait_until(lambda: not self.queue.active, timeout=timeout)
+
+    def migrating(self):
+        """True while .part files are being moved to a new incomplete folder"""
+        return self.migration_thread is not None and self.migration_thread.is_alive()
+
+    def start_migration(self, old_folder, new_folder):
+        """Move .part files from old_folder to new_folder in the background, then switch to it.
+
+        Folders are downloads.incomplete_folder_path values; the setting is
+        only changed once every file has moved. Downloads are paused
+        meanwhile. The job is recorded in MIGRATION_STATE_FILE so it
+        continues after a restart. Returns False if a migration is running.
+        """
+        with self.migration_lock:
+            if self.migrating():
+                return False
+            job = {'from': old_folder, 'to': new_folder, 'was_paused': self.paused}
+            tmp = MIGRATION_STATE_FILE.with_name(MIGRATION_STATE_FILE.name + '.tmp')
+            with open(tmp, 'w') as f:
+                json.dump(job, f)
+            tmp.replace(MIGRATION_STATE_FILE)
+            self._start_migration_thread(job)
+        return True
+
+    def _resume_migration(self):
+        """Continue a migration that was interrupted by a restart"""
+        try:
+            with open(MIGRATION_STATE_FILE) as f:
+                job = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Could not read interrupted migration, discarding it: {e}")
+            MIGRATION_STATE_FILE.unlink(missing_ok=True)
+            return
+
+        self.logger.info(f"Resuming interrupted migration from {job['from']} to {job['to']}")
+        with self.migration_lock:
+            self._start_migration_thread(job)
+
+    def _start_migration_thread(self, job):
+        self.migration = {
+            'state': 'running',
+            'from': job['from'],
+            'to': job['to'],
+            'message': None,
+            'stats': None,
+            'started_at': time.time(),
+            'finished_at': None
+        }
+        self.migration_thread = threading.Thread(target=self._migrate, args=(job,), name='migration', daemon=True)
+        self.migration_thread.start()
+
+    def _migration_progress(self, stats):
+        self.migration['stats'] = stats
+
+    def _migrate(self, job):
+        """Run a migration job (migration thread)"""
+        self.pause()
+        if self.has_active_downloads():
+            self.logger.info("Cancelling active downloads for migration")
+            self.cancel_and_requeue_current()
+            self.wait_for_current_download_to_stop(timeout=None)
+
+        old_path = PROJECT_ROOT / job['from'].lstrip('/')
+        new_path = PROJECT_ROOT / job['to'].lstrip('/')
+        self.logger.info(f"Starting migration from {old_path} to {new_path}")
+        try:
+            success, message, stats = migrate_incomplete_folder(old_path, new_path, progress=self._migration_progress)
+        except Exception as e:
+            success, message, stats = False, f"Migration failed: {e}", self.migration['stats']
+
+        if success:
+            self.logger.info(f"Migration completed: {message}")
+            self.config.refresh()
+            self.config.set('downloads', 'incomplete_folder_path', value=job['to'])
+            self.config.save()
+            self.update_config()
+        else:
+            # The old folder stays in use; saving the new one again moves what is left
+            self.logger.error(f"Migration failed: {message}")
+        self.logger.info(f"Migration stats: {stats}")
+
+        MIGRATION_STATE_FILE.unlink(missing_ok=True)
+        self.migration.update({
+            'state': 'done' if success else 'failed',
+            'message': message,
+            'stats': stats,
+            'finished_at': time.time()
+        })
+        with self.migration_lock:
+            self.migration_thread = None
+        if not job['was_paused']:
+            self.resume()
+
+    def get_migration_status(self):
+        """State of the current or last incomplete folder migration, or None"""
+        return self.migration
 
     def _cleanup_partial_file(self, md5):
         """Clean up partial download file in incomplete directory"""
@@ -216,9 +413,9 @@ class DownloadWorker:
             incomplete_folder_path = self.config.get('downloads', 'incomplete_folder_path', default='/download/incomplete')
             incomplete_dir = PROJECT_ROOT / incomplete_folder_path.lstrip('/')
 
-            # Look for any files with this MD5 in incomplete directory
+            # <md5>.part with its segment manifest and resume sidecar
             if incomplete_dir.exists():
-                for file in incomplete_dir.glob(f"*{md5}*"):
+                for file in incomplete_dir.glob(f"{md5.lower()}.part*"):
                     try:
                         file.unlink()
                         self.logger.info(f"Cleaned up partial file: {file.name}")
@@ -230,86 +427,198 @@ class DownloadWorker:
     def get_fast_download_info(self):
         """Get current fast download status"""
         return self.downloader.get_fast_download_info()
+
+    def update_fast_download_info(self, key, info):
+        """Record account info from a key test, if key is the one in use"""
+        if self.downloader.fast_download_key == key:
+            self.downloader.fast_download_info.update({
+                'available': True,
+                'downloads_left': info.get('downloads_left'),
+                'downloads_per_day': info.get('downloads_per_day'),
+                'last_refresh': time.time()
+            })
+
+    def get_mirror_stats(self):
+        """Mirror scoreboard with circuit breaker state, best mirror first"""
+        mirrors = self.scoreboard.snapshot()
+        for stats in mirrors:
+            stats['circuit'], stats['retry_at'] = self.breaker.state(stats['mirror'])
+        return mirrors
+
+    def reset_mirror_stats(self):
+        """Forget all mirror outcomes, open circuits and missing files"""
+        self.scoreboard.reset()
+        self.breaker.reset()
+        self.negative_cache.reset()
+        self.logger.info("Mirror scoreboard reset")
+
+    def get_status(self):
+        """Worker state added to every status response"""
+        self.refresh_fast_download_info_if_stale()
+        return {
+            "fast_download": self.get_fast_download_info(),
+            "paused": self.paused,
+            "migration": self.migration
+        }
+
+    def has_active_downloads(self):
+        with self.queue.lock:
+            return bool(self.queue.active)
     
     def refresh_fast_download_info_if_stale(self):
         """Refresh fast download info if it's been more than an hour"""
         return self.downloader.refresh_fast_download_info(force=False)
     
-    def _worker_loop(self):
-        """Main worker loop"""
-        delay = self.config.get('downloads', 'delay', default=2)
-        resume_attempts = self.config.get('downloads', 'resume_attempts', default=3)
+    def _take_prefetched(self, md5):
+        """Claim the prefetched (filename, links) of md5 if they have not expired"""
+        with self.prefetch_lock:
+            entry = self.prefetched.pop(md5, None)
+        if entry and entry[2] and entry[0] > time.time():
+            return entry[1], entry[2]
+        return None
+
+    def _prefetch_wanted(self):
+        """md5s of the upcoming items that have no fresh prefetched info"""
+        count = self.config.get('downloads', 'prefetch_count', default=2)
+        if self.paused or count <= 0:
+            upcoming = []
+        else:
+            upcoming = self.queue.peek(count)
+
+        now = time.time()
+        with self.prefetch_lock:
+            # Drop expired info and info for items that left the queue
+            for md5, entry in list(self.prefetched.items()):
+                if entry[0] <= now or self.queue.get_state(md5) not in (STATE_QUEUED, STATE_DOWNLOADING):
+                    del self.prefetched[md5]
+            return [md5 for md5 in upcoming if md5 not in self.prefetched]
+
+    def _prefetch_loop(self):
+        """Resolve filename and mirror links of the next queued items while slots are busy"""
+        # Waits for the rate limiter give up as soon as the worker stops or pauses
+        downloader = None
 
         while self.running:
-            # Check if paused
-            if self.paused:
-                time.sleep(1)
+            # Cleared before looking, so a change made meanwhile is not missed
+            self.queue.queue_changed.clear()
+            wanted = self._prefetch_wanted()
+            if not wanted:
+                # Sleep until items join or leave the queue (not on progress),
+                # the worker is paused, resumed or reconfigured, or the next
+                # prefetched entry expires
+                with self.prefetch_lock:
+                    expires = min((entry[0] for entry in self.prefetched.values()), default=None)
+                timeout = None if expires is None else max(expires - time.time(), 0)
+                self.queue.queue_changed.wait(timeout=timeout)
                 continue
 
-            item = self.queue.get_next()
+            if downloader is None or downloader.session is not self.downloader.session:
+                downloader = self.downloader.for_slot(lambda progress: self.running and not self.paused)
 
-            if item is None:
-                time.sleep(1)
-                continue
-            
-            # Set as current download FIRST (before fetching download info)
-            # This allows pause to work properly even during the fetch phase
-            with self.queue.lock:
-                self.queue.current_download = item
-                self.queue.current_download['status'] = 'downloading'
-                self.queue.current_download['started_at'] = datetime.now().isoformat()
-
-            # Fetch download info
-            self.logger.info(f"Fetching download info: {item['md5']}")
+            md5 = wanted[0]
             try:
-                filename, links = self.downloader.get_download_links(item['md5'])
+                filename, links = downloader.get_download_links(md5)
             except Exception as e:
-                self.logger.error(f"Failed to fetch download info: {e}")
+                self.logger.debug(f"Prefetch failed for {md5}: {e}")
+                filename, links = None, []
 
-                # Check if paused - if so, requeue instead of marking as failed
-                if self.paused:
-                    self.logger.info(f"Pausing download after fetch failure: {item['md5']}")
-                    self.queue.requeue_current()
-                    continue
+            if not self.running or self.paused:
+                continue
+
+            # Failures are left to the slot, which fetches again and reports them
+            ttl = self.config.get('downloads', 'prefetch_ttl', default=600)
+            with self.prefetch_lock:
+                if links and self.queue.get_state(md5) == STATE_QUEUED:
+                    self.prefetched[md5] = (time.time() + ttl, filename, links)
+                    self.logger.debug(f"Prefetched download info: {filename} ({len(links)} mirror(s))")
+                else:
+                    # Remember the miss until the TTL so the item is not fetched over and over
+                    self.prefetched[md5] = (time.time() + ttl, None, None)
+
+    def _interrupted(self, slot, item, name, stage=''):
+        """Stop the slot's download after a remove, pause or cancel; True if one was asked for
+
+        Removing drops the item and its partial file, pausing the worker
+        puts it back in front of its lane, cancelling it alone puts it
+        behind the others.
+        """
+        if slot.remove:
+            self.logger.info(f"Stopping download{stage}: {name}")
+            self._cleanup_partial_file(item['md5'])
+            self.queue.drop_current(slot.index)
+        elif self.paused:
+            self.logger.info(f"Pausing download{stage}: {name}")
+            self.queue.requeue_current(slot.index)
+        elif slot.cancel:
+            self.logger.info(f"Requeueing cancelled download{stage}: {name}")
+            self.queue.requeue_current(slot.index, front=False)
+        else:
+            return False
+        slot.reset()
+        return True
+
+    def _worker_loop(self, slot):
+        """Main loop of one download slot"""
+        resume_attempts = self.config.get('downloads', 'resume_attempts', default=3)
+
+        while True:
+            # Sleep until there is work or the slot has to exit; add, retry,
+            # resume, stop and config changes all signal the queue
+            self.queue.wait_until(lambda: self._slot_retired(slot) or (not self.paused and self.queue.has_queued()))
+            if self._slot_retired(slot):
+                break
 
-                self.queue.mark_complete(item['md5'], False, error=f"Failed to fetch download info: {e}", subfolder=item.get('subfolder'))
+            # Becomes the slot's active download right away, so pause works
+            # properly even during the fetch phase
+            item = self.queue.get_next(slot.index)
+
+            # Another slot took it first
+            if item is None:
                 continue
 
+            slot.reset()
+            downloader = self.downloader.for_slot(slot.progress_callback, slot.status_callback)
+
+            # Fetch download info, unless the prefetcher already did
+            prefetched = self._take_prefetched(item['md5'])
+            if prefetched:
+                filename, links = prefetched
+                self.logger.info(f"Using prefetched download info: {item['md5']}")
+            else:
+                self.logger.info(f"Fetching download info: {item['md5']}")
+                try:
+                    filename, links = downloader.get_download_links(item['md5'])
+                except Exception as e:
+                    self.logger.error(f"Failed to fetch download info: {e}")
+
+                    # Removed, paused or cancelled meanwhile: not a failure
+                    if self._interrupted(slot, item, item['md5'], ' after fetch failure'):
+                        continue
+
+                    self.queue.mark_complete(item['md5'], False, error=f"Failed to fetch download info: {e}", subfolder=item.get('subfolder'))
+                    continue
+
             # Update current download with fetched information
-            with self.queue.lock:
-                self.queue.current_download['filename'] = filename
-                self.queue.current_download['status_message'] = f"Found {len(links)} mirror(s)"
-                self.queue.current_download['progress'] = {
+            self.queue.update_current(
+                slot.index,
+                filename=filename,
+                status_message=f"Found {len(links)} mirror(s)",
+                progress={
                     'total_size': 0,
                     'downloaded': 0,
                     'percent': 0
                 }
+            )
 
-            # Check if paused after fetching download info
-            if self.paused:
-                self.logger.info(f"Pausing download after fetch: {filename}")
-                self.queue.requeue_current()
-                continue
-
-            # Check if cancelled
-            if self.cancel_current:
-                should_remove = self.queue.current_download.get('_remove', False)
-                if should_remove:
-                    self.logger.info(f"Stopping download after fetch: {filename}")
-                    self._cleanup_partial_file(item['md5'])
-                    self.queue.current_download = None
-                    self.queue.save()
-                else:
-                    self.logger.info(f"Pausing download after fetch: {filename}")
-                    self.queue.requeue_current()
-                self.cancel_current = False
+            # Check if removed, paused or cancelled while fetching
+            if self._interrupted(slot, item, filename, ' after fetch'):
                 continue
 
             self.logger.info(f"Starting download: {filename} ({item['md5']})")
 
             try:
                 # Pass pre-fetched filename and links to avoid duplicate API calls
-                success, used_fast_download, filepath = self.downloader.download(
+                success, used_fast_download, filepath = downloader.download(
                     item['md5'],
                     resume_attempts=resume_attempts,
                     filename=filename,
@@ -317,47 +626,29 @@ class DownloadWorker:
                     subfolder=item.get('subfolder')
                 )
 
-                # Once download completes (success or failure), it's too late to cancel
-                # Reset the cancel flag if it was set - cancellation is handled during download via progress_callback
-                if self.cancel_current:
-                    self.cancel_current = False
-
-                # Check if paused after download completes - if so, requeue instead of marking complete
-                if self.paused:
-                    self.logger.info(f"Pausing download: {filename}")
-                    self.queue.requeue_current()
-                    continue
+                # stop() already put the item back in the queue
+                if not self.running:
+                    break
 
+                # A finished download is complete whatever was asked meanwhile: its file is already in place
                 if success:
+                    slot.reset()
                     self.queue.mark_complete(item['md5'], True, filepath=filepath, used_fast_download=used_fast_download, filename=filename, subfolder=item.get('subfolder'))
-                else:
+                elif not self._interrupted(slot, item, filename):
                     self.queue.mark_complete(item['md5'], False, error="Download failed", filename=filename, subfolder=item.get('subfolder'))
 
             except Exception as e:
                 self.logger.error(f"Download error: {item['md5']} - {e}")
 
-                # Check if cancelled during exception
-                if self.cancel_current:
-                    should_remove = self.queue.current_download.get('_remove', False)
-                    if should_remove:
-                        self.logger.info(f"Stopping download after error: {filename}")
-                        self._cleanup_partial_file(item['md5'])
-                        self.queue.current_download = None
-                        self.queue.save()
-                    else:
-                        self.logger.info(f"Pausing download after error: {filename}")
-                        self.queue.requeue_current()
-                    self.cancel_current = False
-                    continue
+                if not self.running:
+                    break
 
-                # Check if paused - if so, requeue instead of marking as failed
-                if self.paused:
-                    self.logger.info(f"Pausing download after error: {filename}")
-                    self.queue.requeue_current()
+                # Removed, paused or cancelled: not a failure
+                if self._interrupted(slot, item, filename, ' after error'):
                     continue
 
                 self.queue.mark_complete(item['md5'], False, error=str(e), filename=filename, subfolder=item.get('subfolder'))
-            
-            # Rate limiting
-            if self.queue.queue:
-                time.sleep(delay)
\ No newline at end of file
+
+        with self.slots_lock:
+            if self.slots.get(slot.index) is slot:
+                del self.slots[slot.index]
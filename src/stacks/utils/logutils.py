@@ -1,12 +1,26 @@
 import logging
+import os
 import sys
+import uuid
 import flask
 from stacks.constants import LOG_PATH, LOG_FORMAT, LOG_DATE_FORMAT, LOG_VIEW_LENGTH
 from pathlib import Path
 from datetime import datetime
 from collections import deque
+from itertools import count, islice
 
+# (seq, levelno, logger name, formatted line) for the web console
 LOG_BUFFER = deque(maxlen=LOG_VIEW_LENGTH)
+LOG_SEQ = count(1)
+# Tells this process's sequence numbers from those of an earlier run or
+# another process (a forked engine starts a new one)
+LOG_EPOCH = uuid.uuid4().hex
+
+def _new_log_epoch():
+    global LOG_EPOCH
+    LOG_EPOCH = uuid.uuid4().hex
+
+os.register_at_fork(after_in_child=_new_log_epoch)
 
 def setup_logging(config=None):
     """
@@ -83,10 +97,40 @@ def setup_logging(config=None):
 
 
 
+def read_log_buffer(after=None, level=None, logger=None, epoch=None):
+    """
+    Read console lines from LOG_BUFFER.
+
+    Only lines with a sequence number above after are returned, optionally
+    limited to a minimum level and a logger (including its children).
+    Returns (lines, last_seq, reset, LOG_EPOCH); reset is True when the
+    whole buffer is returned instead: after is missing, comes from another
+    epoch (before a restart) or is no longer in the buffer.
+    """
+    entries = list(LOG_BUFFER)
+    last_seq = entries[-1][0] if entries else 0
+
+    reset = (after is None or after > last_seq
+             or (epoch is not None and epoch != LOG_EPOCH)
+             # Lines after it were dropped from the buffer already
+             or bool(entries and after < entries[0][0] - 1))
+    if not reset and entries:
+        # Sequence numbers are contiguous, so the start is a plain offset
+        entries = list(islice(entries, max(after - entries[0][0] + 1, 0), None))
+
+    lines = [
+        line for _, levelno, name, line in entries
+        if (level is None or levelno >= level)
+        and (logger is None or name == logger or name.startswith(logger + '.'))
+    ]
+    return lines, last_seq, reset, LOG_EPOCH
+
+
 class UILogHandler(logging.Handler):
     def emit(self, record):
         try:
             msg = self.format(record)
-            LOG_BUFFER.append(msg)
+            # Handler.handle() holds the handler lock, so seq order matches append order
+            LOG_BUFFER.append((next(LOG_SEQ), record.levelno, record.name, msg))
         except Exception:
             pass
\ No newline at end of file
@@ -1,22 +1,37 @@
 import logging
-import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, List
+from typing import Callable, Optional, Tuple, List
+from stacks.constants import MIGRATION_WORKERS, PARTIAL_META_SUFFIX, SEGMENT_MANIFEST_SUFFIX
+from stacks.downloader.utils import move_file, same_filesystem
+from stacks.downloader.segmented import manifest_path
+from stacks.downloader.partial import meta_path
 
 logger = logging.getLogger('migration')
 
-def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str, dict]:
+def migrate_incomplete_folder(old_path: Path, new_path: Path,
+                              progress: Optional[Callable[[dict], None]] = None) -> Tuple[bool, str, dict]:
     """
     Migrate .part files from old incomplete folder to new incomplete folder.
+
+    Each file is moved on its own (renamed on the same filesystem, copied
+    by MIGRATION_WORKERS threads otherwise), so running this again after
+    an interruption picks up the files that are still in old_path. The
+    segment manifest and resume sidecar of a .part file go with it and are
+    not counted separately; sidecars whose .part file is gone are deleted.
+    progress, if given, is called with a copy of the stats after each file.
     """
     stats = {
         'files_found': 0,
         'files_migrated': 0,
         'files_failed': 0,
         'files_left': 0,
+        'bytes_total': 0,
         'bytes_migrated': 0,
         'errors': []
     }
+    stats_lock = threading.Lock()
 
     try:
         # Validate paths
@@ -41,63 +56,67 @@ def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str
             logger.info("No migration needed (paths are the same or old path doesn't exist)")
             return True, "No migration needed", stats
 
+        # Copies cut short by an earlier interruption; their sources are still in old_path
+        for leftover in new_path.glob('.*.moving'):
+            leftover.unlink(missing_ok=True)
+
         # Find all .part files
         part_files: List[Path] = []
         try:
             part_files = list(old_path.glob('*.part'))
+            # Segment manifests and resume sidecars belong to their .part file
+            sidecars = {part_file: [path for path in (manifest_path(part_file), meta_path(part_file)) if path.exists()]
+                        for part_file in part_files}
+            sizes = {part_file: sum(path.stat().st_size for path in [part_file, *sidecars[part_file]])
+                     for part_file in part_files}
             stats['files_found'] = len(part_files)
+            stats['bytes_total'] = sum(sizes.values())
             logger.info(f"Found {len(part_files)} .part files to migrate")
         except Exception as e:
             logger.error(f"Failed to scan old incomplete directory: {e}")
             return False, f"Failed to scan old directory: {str(e)}", stats
 
+        _settle_orphan_sidecars(old_path, new_path)
+
         if not part_files:
             logger.info("No .part files to migrate")
             return True, "No .part files found to migrate", stats
 
-        # Migrate each .part file
-        migrated_files = []
-        for part_file in part_files:
-            try:
-                dest_file = new_path / part_file.name
-                file_size = part_file.stat().st_size
-
-                # Copy file
-                logger.debug(f"Copying {part_file.name} to {dest_file}")
-                shutil.copy2(part_file, dest_file)
+        if progress:
+            progress(dict(stats, errors=list(stats['errors'])))
 
-                # Verify copy succeeded
-                if dest_file.exists() and dest_file.stat().st_size == file_size:
-                    migrated_files.append(part_file)
+        def migrate(part_file):
+            try:
+                logger.debug(f"Moving {part_file.name} to {new_path}")
+                # Sidecars first: a .part file never arrives without its manifest
+                for sidecar in sidecars[part_file]:
+                    move_file(sidecar, new_path / sidecar.name)
+                move_file(part_file, new_path / part_file.name)
+                with stats_lock:
                     stats['files_migrated'] += 1
-                    stats['bytes_migrated'] += file_size
-                    logger.debug(f"Successfully copied {part_file.name}")
-                else:
-                    stats['files_failed'] += 1
-                    error_msg = f"Copy verification failed for {part_file.name}"
-                    stats['errors'].append(error_msg)
-                    logger.error(error_msg)
-
+                    stats['bytes_migrated'] += sizes[part_file]
             except Exception as e:
-                stats['files_failed'] += 1
                 error_msg = f"Failed to migrate {part_file.name}: {str(e)}"
-                stats['errors'].append(error_msg)
                 logger.error(error_msg)
+                with stats_lock:
+                    stats['files_failed'] += 1
+                    stats['errors'].append(error_msg)
+            if progress:
+                with stats_lock:
+                    snapshot = dict(stats, errors=list(stats['errors']))
+                progress(snapshot)
 
-        # Delete successfully migrated files from old location
-        for part_file in migrated_files:
-            try:
-                part_file.unlink()
-                logger.debug(f"Deleted {part_file.name} from old location")
-            except Exception as e:
-                logger.warning(f"Failed to delete {part_file.name} from old location: {e}")
+        # Renames are instant; copies between filesystems run side by side
+        workers = 1 if same_filesystem(old_path, new_path) else MIGRATION_WORKERS
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='migration') as pool:
+            list(pool.map(migrate, part_files))
 
-        # Count files left in old directory
+        # Count .part files left in old directory
         try:
-            remaining_files = list(old_path.iterdir())
+            remaining_files = list(old_path.glob('*.part'))
             stats['files_left'] = len(remaining_files)
             if remaining_files:
-                logger.info(f"{len(remaining_files)} files remain in old incomplete directory")
+                logger.info(f"{len(remaining_files)} .part files remain in old incomplete directory")
         except Exception as e:
             logger.warning(f"Failed to count remaining files: {e}")
 
@@ -115,3 +134,24 @@ def migrate_incomplete_folder(old_path: Path, new_path: Path) -> Tuple[bool, str
     except Exception as e:
         logger.error(f"Unexpected error during migration: {e}", exc_info=True)
         return False, f"Migration failed: {str(e)}", stats
+
+
+def _settle_orphan_sidecars(old_path: Path, new_path: Path) -> None:
+    """Deal with sidecars in old_path that have no .part file next to them
+
+    One whose .part file already is in new_path follows it there; the
+    others belong to downloads that are gone and are deleted.
+    """
+    for suffix in (SEGMENT_MANIFEST_SUFFIX, PARTIAL_META_SUFFIX):
+        for sidecar in old_path.glob(f'*.part{suffix}'):
+            part_name = sidecar.name[:-len(suffix)]
+            if (old_path / part_name).exists():
+                continue
+            try:
+                if (new_path / part_name).exists():
+                    move_file(sidecar, new_path / sidecar.name)
+                else:
+                    logger.info(f"Deleting {sidecar.name}, its .part file is gone")
+                    sidecar.unlink(missing_ok=True)
+            except Exception as e:
+                logger.warning(f"Failed to clean up {sidecar.name}: {e}")
@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# stacks.constants reads STACKS_PROJECT_ROOT on import: keep tests away from a real install
+os.environ.setdefault('STACKS_PROJECT_ROOT', tempfile.mkdtemp(prefix='stacks-tests-'))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+
+class StubConfig:
+    """Config.get() and set() over a nested dict of settings; nothing is read or written to disk"""
+
+    def __init__(self, values=None):
+        self.values = values or {}
+        self.saved = 0
+
+    def get(self, *keys, default=None):
+        value = self.values
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                return default
+            value = value[key]
+        return value
+
+    def set(self, *keys, value):
+        target = self.values
+        for key in keys[:-1]:
+            target = target.setdefault(key, {})
+        target[keys[-1]] = value
+
+    def save(self):
+        self.saved += 1
+
+    def refresh(self):
+        return False
+
+
+@pytest.fixture
+def make_queue():
+    """DownloadQueue factory on a clean config folder"""
+    from stacks.constants import CONFIG_PATH
+    from stacks.server.queue import DownloadQueue
+
+    def clean():
+        for path in CONFIG_PATH.glob('queue*'):
+            path.unlink()
+
+    CONFIG_PATH.mkdir(parents=True, exist_ok=True)
+    clean()
+    queues = []
+
+    def make(**settings):
+        queue = DownloadQueue(StubConfig(settings))
+        queues.append(queue)
+        return queue
+
+    yield make
+    for queue in queues:
+        queue.store.close()
+    clean()
+
+
+class StubWorker:
+    """The worker state /api/status adds to the queue status"""
+
+    paused = False
+
+    def get_status(self):
+        return {'fast_download': {}, 'paused': self.paused, 'migration': None}
+
+
+@pytest.fixture
+def make_client(make_queue):
+    """Flask test client for the API with login disabled, over a fresh queue"""
+    from flask import Flask
+    from stacks.api import register_api
+
+    def make(**settings):
+        app = Flask(__name__)
+        register_api(app)
+        app.stacks_config = StubConfig({'login': {'disable': True}, **settings})
+        app.stacks_queue = make_queue(**settings)
+        app.stacks_worker = StubWorker()
+        return app.test_client(), app.stacks_queue
+
+    return make
@@ -0,0 +1,121 @@
+import json
+import threading
+import time
+
+from stacks.constants import QUEUE_BATCH_DEFAULT_PRIORITY, QUEUE_BATCH_MAX_ITEMS
+
+
+def md5_of(n):
+    return f"{n:032x}"
+
+
+def test_add_batch_reports_every_item(make_client):
+    client, queue = make_client(downloads={'subdirectories': ['batch', 'own']})
+    queue.add(md5_of(1))
+
+    response = client.post('/api/queue/add_batch', json={'subfolder': 'batch', 'items': [
+        md5_of(1),
+        f"https://annas-archive.org/md5/{md5_of(2)}",
+        {'md5': md5_of(3), 'priority': 'high', 'subfolder': 'own'},
+        'not an md5',
+        {'md5': md5_of(4), 'priority': 'urgent'},
+        md5_of(2),
+    ]})
+
+    data = response.get_json()
+    assert data['added'] == 2 and data['skipped'] == 4
+    assert [(r['md5'], r['success'], r['message']) for r in data['results']] == [
+        (md5_of(1), False, "Already in queue"),
+        (md5_of(2), True, "Added to queue"),
+        (md5_of(3), True, "Added to queue"),
+        (None, False, "Invalid MD5 format"),
+        (None, False, "Invalid priority"),
+        (md5_of(2), False, "Already in queue"),
+    ]
+    assert data['results'][1]['priority'] == QUEUE_BATCH_DEFAULT_PRIORITY
+    assert data['results'][1]['subfolder'] == 'batch'
+    # High priority goes ahead of the item that was already waiting
+    assert queue.peek(3) == [md5_of(3), md5_of(1), md5_of(2)]
+    assert queue.get_next()['subfolder'] == 'own'
+
+
+def test_add_batch_rejects_bad_requests(make_client):
+    client, queue = make_client()
+
+    assert client.post('/api/queue/add_batch', json={'items': []}).status_code == 400
+    assert client.post('/api/queue/add_batch', json={'items': md5_of(1)}).status_code == 400
+    too_many = [md5_of(n) for n in range(QUEUE_BATCH_MAX_ITEMS + 1)]
+    assert client.post('/api/queue/add_batch', json={'items': too_many}).status_code == 400
+    assert queue.peek(1) == []
+
+
+def status_events(response):
+    """Status payloads of an /api/events stream"""
+    for chunk in response.response:
+        chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+        if chunk.startswith('event: status\n'):
+            yield json.loads(chunk.partition('data: ')[2])
+
+
+def test_events_stream_changes_after_the_full_status(make_client):
+    client, queue = make_client(queue={'progress_interval': 200})
+    queue.add(md5_of(1))
+
+    response = client.get('/api/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    events = status_events(response)
+
+    first = next(events)
+    assert [item['md5'] for item in first['queue']] == [md5_of(1)]
+    assert first['paused'] is False
+
+    queue.add(md5_of(2))
+    second = next(events)
+    start = time.monotonic()
+    assert second['since'] == first['version']
+    assert [(change['op'], change['item']['md5']) for change in second['changes']] == [('add', md5_of(2))]
+
+    # Progress ticks within the interval are coalesced into one event
+    queue.get_next(slot=0)
+    for percent in (10, 20, 30):
+        queue.update_current(0, progress={'percent': percent})
+    third = next(events)
+    assert time.monotonic() - start >= 0.15
+    assert third['active'][0]['progress']['percent'] == 30
+    response.close()
+
+
+def test_status_is_served_from_the_snapshot(make_client):
+    client, queue = make_client()
+    queue.add(md5_of(1))
+
+    response = client.get('/api/status')
+    status = response.get_json()
+    assert [item['md5'] for item in status['queue']] == [md5_of(1)]
+    assert status['paused'] is False and status['version'] == queue.version
+    etag = response.headers['ETag']
+
+    assert client.get('/api/status', headers={'If-None-Match': etag}).status_code == 304
+
+    # Served while another thread holds the queue lock
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with queue.lock:
+            locked.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait(5)
+    try:
+        assert client.get('/api/status').headers['ETag'] == etag
+    finally:
+        release.set()
+        holder.join()
+
+    queue.add(md5_of(2))
+    response = client.get('/api/status', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert len(response.get_json()['queue']) == 2
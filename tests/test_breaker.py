@@ -0,0 +1,111 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from stacks.constants import BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN, BREAKER_THRESHOLD, NEGATIVE_CACHE_TTL
+from stacks.downloader import breaker
+from stacks.downloader.breaker import CircuitBreaker, NegativeCache
+from stacks.downloader.scoreboard import FAILURE_NOT_FOUND, FAILURE_TRANSFER, MirrorScoreboard, mirror_key
+from stacks.downloader.utils import record_attempt
+
+MD5 = '0' * 32
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(breaker, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    circuits = CircuitBreaker()
+    for _ in range(BREAKER_THRESHOLD - 1):
+        assert not circuits.failure('mirror')
+    assert circuits.allow('mirror')
+
+    assert circuits.failure('mirror')
+    assert not circuits.allow('mirror')
+    assert circuits.state('mirror') == ('open', clock.now + BREAKER_COOLDOWN)
+    # Other mirrors are not affected
+    assert circuits.allow('other')
+
+
+def test_half_open_breaker_lets_one_probe_through(clock):
+    circuits = CircuitBreaker()
+    for _ in range(BREAKER_THRESHOLD):
+        circuits.failure('mirror')
+
+    clock.now += BREAKER_COOLDOWN
+    assert circuits.state('mirror')[0] == 'half_open'
+    assert circuits.allow('mirror')
+    assert not circuits.allow('mirror')
+
+    # A failed probe doubles the cooldown
+    assert circuits.failure('mirror')
+    assert circuits.state('mirror') == ('open', clock.now + 2 * BREAKER_COOLDOWN)
+
+    # ... up to the maximum
+    for _ in range(10):
+        clock.now += BREAKER_MAX_COOLDOWN
+        assert circuits.allow('mirror')
+        circuits.failure('mirror')
+    assert circuits.state('mirror') == ('open', clock.now + BREAKER_MAX_COOLDOWN)
+
+    # A successful probe closes it
+    clock.now += BREAKER_MAX_COOLDOWN
+    assert circuits.allow('mirror')
+    circuits.success('mirror')
+    assert circuits.state('mirror') == ('closed', None)
+    assert circuits.allow('mirror') and circuits.allow('mirror')
+
+
+def test_failures_from_before_the_breaker_opened_do_not_extend_it(clock):
+    circuits = CircuitBreaker()
+    for _ in range(BREAKER_THRESHOLD):
+        circuits.failure('mirror')
+    retry_at = circuits.state('mirror')[1]
+
+    clock.now += 10
+    assert not circuits.failure('mirror')
+    assert circuits.state('mirror') == ('open', retry_at)
+
+
+def test_negative_cache_expires_and_stays_bounded(clock, monkeypatch):
+    cache = NegativeCache()
+    cache.add(MD5, 'mirror')
+    assert (MD5, 'mirror') in cache
+    assert (MD5, 'other') not in cache
+
+    clock.now += NEGATIVE_CACHE_TTL
+    assert (MD5, 'mirror') not in cache
+
+    monkeypatch.setattr(breaker, 'NEGATIVE_CACHE_SIZE', 2)
+    for key in ('a', 'b', 'c'):
+        cache.add(MD5, key)
+    assert [(MD5, key) in cache for key in ('a', 'b', 'c')] == [False, True, True]
+
+
+def test_missing_files_are_cached_without_tripping_the_breaker(clock):
+    d = SimpleNamespace(scoreboard=MirrorScoreboard(), breaker=CircuitBreaker(), negative_cache=NegativeCache(),
+                        logger=logging.getLogger('stacks_tests'))
+    mirror = {'url': 'https://mirror.example/file', 'domain': 'mirror.example', 'type': 'external_mirror'}
+    key = mirror_key(mirror)
+
+    for _ in range(BREAKER_THRESHOLD):
+        record_attempt(d, mirror, MD5, False, failure=FAILURE_NOT_FOUND)
+    assert (MD5, key) in d.negative_cache
+    assert d.breaker.state(key)[0] == 'closed'
+
+    for _ in range(BREAKER_THRESHOLD):
+        record_attempt(d, mirror, MD5, False, failure=FAILURE_TRANSFER)
+    assert d.breaker.state(key)[0] == 'open'
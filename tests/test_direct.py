@@ -0,0 +1,265 @@
+import hashlib
+import io
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+import urllib3
+
+from stacks.downloader import aio, direct, orchestrator, utils
+from stacks.downloader.direct import StreamingMD5, write_body
+from stacks.downloader.downloader import AnnaDownloader
+from stacks.downloader.partial import save_meta
+from stacks.downloader.scoreboard import mirror_key
+from stacks.downloader.utils import READ_MAX, READ_MIN, READ_TARGET
+
+BODY = bytes(range(256)) * 4096
+BODY_MD5 = hashlib.md5(BODY).hexdigest()
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRaw:
+    """urllib3 response body: serves data through readinto, each read taking delay(n) seconds"""
+
+    def __init__(self, data, clock, delay=lambda n: 0.0, error=None):
+        self.data = io.BytesIO(data)
+        self.clock = clock
+        self.delay = delay
+        self.error = error
+        self.sizes = []
+
+    def readinto(self, buffer):
+        self.sizes.append(len(buffer))
+        count = self.data.readinto(buffer)
+        if not count and self.error:
+            raise self.error
+        self.clock.now += self.delay(len(self.sizes))
+        return count
+
+
+class FakeResponse:
+    def __init__(self, raw=None, headers=None, chunks=()):
+        self.raw = raw
+        self.headers = headers or {}
+        self.chunks = chunks
+        self.chunk_size = None
+
+    def iter_content(self, chunk_size):
+        self.chunk_size = chunk_size
+        yield from self.chunks
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # write_body times reads with monotonic, ProgressTracker throttles with time
+    monkeypatch.setattr(direct, 'time', SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(utils, 'time', SimpleNamespace(time=clock))
+    return clock
+
+
+def downloader(progress_callback=None):
+    return SimpleNamespace(
+        progress_callback=progress_callback,
+        status_callback=lambda message: None,
+        logger=logging.getLogger('stacks_tests'),
+    )
+
+
+def test_write_body_grows_reads_on_a_fast_link(clock):
+    data = bytes(range(256)) * (8 * READ_MAX // 256)
+    raw = FakeRaw(data, clock)
+    f = io.BytesIO()
+    streamed = StreamingMD5()
+
+    assert write_body(downloader(), FakeResponse(raw), f, 0, len(data), streamed) == len(data)
+    assert f.getvalue() == data
+    assert streamed.hexdigest() == hashlib.md5(data).hexdigest()
+    # Doubles from READ_MIN on every fast, full read and stays at READ_MAX
+    assert raw.sizes[:6] == [READ_MIN * 2 ** n for n in range(5)] + [READ_MAX]
+    assert set(raw.sizes[5:]) == {READ_MAX}
+
+
+def test_write_body_shrinks_reads_on_a_slow_link(clock):
+    data = b'x' * (10 * READ_MAX)
+    # Fast until the reads reach READ_MAX, then every read stalls
+    raw = FakeRaw(data, clock, delay=lambda n: 0.0 if n <= 5 else READ_TARGET * 3)
+
+    assert write_body(downloader(), FakeResponse(raw), io.BytesIO(), 0, len(data)) == len(data)
+    assert raw.sizes[5:10] == [READ_MAX, READ_MAX // 2, READ_MAX // 4, READ_MAX // 8, READ_MAX // 16]
+    assert min(raw.sizes) == READ_MIN
+    assert raw.sizes[-1] == READ_MIN
+
+
+def test_write_body_continues_a_resumed_count(clock):
+    raw = FakeRaw(b'abc', clock)
+    f = io.BytesIO()
+
+    assert write_body(downloader(), FakeResponse(raw), f, 100, 103) == 103
+    assert f.getvalue() == b'abc'
+
+
+def test_write_body_stops_when_progress_asks_to_cancel(clock):
+    reports = []
+
+    def progress(info):
+        reports.append(info['downloaded'])
+        return False
+
+    data = b'x' * (4 * READ_MIN)
+    raw = FakeRaw(data, clock, delay=lambda n: 1.0)
+
+    assert write_body(downloader(progress), FakeResponse(raw), io.BytesIO(), 0, len(data)) is None
+    assert reports == [READ_MIN]
+
+
+@pytest.mark.parametrize('error, expected', [
+    (urllib3.exceptions.ProtocolError('Connection broken'), requests.exceptions.ChunkedEncodingError),
+    (urllib3.exceptions.ReadTimeoutError(None, None, 'Read timed out'), requests.exceptions.ConnectionError),
+])
+def test_write_body_maps_urllib3_errors(clock, error, expected):
+    raw = FakeRaw(b'x' * READ_MIN, clock, error=error)
+    f = io.BytesIO()
+
+    with pytest.raises(expected):
+        write_body(downloader(), FakeResponse(raw), f, 0, 2 * READ_MIN)
+    # What arrived before the error is on disk for the resume
+    assert len(f.getvalue()) == READ_MIN
+
+
+def test_write_body_decodes_compressed_bodies_through_requests(clock):
+    chunks = [b'first ', b'second']
+    raw = FakeRaw(b'still gzipped', clock)
+    response = FakeResponse(raw, headers={'Content-Encoding': 'gzip'}, chunks=chunks)
+    f = io.BytesIO()
+    streamed = StreamingMD5()
+
+    assert write_body(downloader(), response, f, 0, None, streamed) == len(b'first second')
+    assert f.getvalue() == b'first second'
+    assert streamed.hexdigest() == hashlib.md5(b'first second').hexdigest()
+    assert response.chunk_size == READ_MAX
+    assert raw.sizes == []
+
+
+def test_write_body_cancels_compressed_bodies(clock):
+    chunks = [b'a' * 10, b'b' * 10, b'c' * 10]
+
+    # Each chunk arrives a second later, past the progress throttle
+    def slow_chunks():
+        for chunk in chunks:
+            clock.now += 1.0
+            yield chunk
+
+    response = FakeResponse(headers={'Content-Encoding': 'br'}, chunks=slow_chunks())
+    f = io.BytesIO()
+
+    assert write_body(downloader(lambda info: False), response, f, 0, 30) is None
+    assert f.getvalue() == b'a' * 10
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves BODY, honouring open-ended Range requests"""
+
+    def do_GET(self):
+        start = 0
+        if self.headers.get('Range'):
+            start = int(self.headers['Range'].partition('=')[2].partition('-')[0])
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(BODY) - 1}/{len(BODY)}")
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY) - start))
+        self.end_headers()
+        self.wfile.write(BODY[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+class DroppingHandler(RangeHandler):
+    """Like RangeHandler, but the first response breaks off halfway"""
+
+    dropped = False
+
+    def do_GET(self):
+        if DroppingHandler.dropped:
+            return super().do_GET()
+        DroppingHandler.dropped = True
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY[:len(BODY) // 2])
+        self.close_connection = True
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/book.pdf"
+
+
+@pytest.fixture
+def body_url():
+    server, url = serve(RangeHandler)
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture(params=['threads', 'asyncio'])
+def make_downloader(request):
+    """AnnaDownloader for each transfer backend"""
+    if request.param == 'asyncio' and not aio.available():
+        pytest.skip("aiohttp is not installed")
+    downloader_class = aio.AsyncAnnaDownloader if request.param == 'asyncio' else AnnaDownloader
+    return lambda output_dir: downloader_class(output_dir=output_dir, status_callback=lambda message: None)
+
+
+def test_download_direct_counts_only_received_bytes(tmp_path, body_url, make_downloader):
+    d = make_downloader(tmp_path)
+    d.incomplete_dir.mkdir(parents=True, exist_ok=True)
+    (d.incomplete_dir / f"{BODY_MD5}.part").write_bytes(BODY[:300000])
+
+    path = d.download_direct(body_url, title='book.pdf', md5=BODY_MD5)
+    assert path.read_bytes() == BODY
+    assert d.received == len(BODY) - 300000
+
+
+def test_download_direct_resumes_a_broken_transfer(tmp_path, make_downloader, monkeypatch):
+    # No backoff between attempts
+    monkeypatch.setattr(direct, 'time', SimpleNamespace(monotonic=time.monotonic, sleep=lambda seconds: None))
+    monkeypatch.setattr(DroppingHandler, 'dropped', False)
+    server, url = serve(DroppingHandler)
+    d = make_downloader(tmp_path)
+
+    path = d.download_direct(url, title='book.pdf', md5=BODY_MD5)
+    server.shutdown()
+    assert path.read_bytes() == BODY
+    # The second attempt asked only for what the first did not write
+    assert d.received == len(BODY)
+
+
+def test_complete_partial_file_records_no_speed(tmp_path, body_url):
+    d = AnnaDownloader(output_dir=tmp_path, status_callback=lambda message: None)
+    d.incomplete_dir.mkdir(parents=True, exist_ok=True)
+    temp_path = d.incomplete_dir / f"{BODY_MD5}.part"
+    temp_path.write_bytes(BODY)
+    save_meta(d, temp_path, body_url, {}, len(BODY), len(BODY))
+    mirror = {'url': 'https://mirror.example/book', 'domain': 'mirror.example', 'type': 'external_mirror'}
+
+    path = orchestrator._transfer(d, mirror, body_url, 0.5, False, BODY_MD5, 'book.pdf', 3, None)
+    assert path.read_bytes() == BODY
+    assert d.received == 0
+    stats = d.scoreboard.mirrors[mirror_key(mirror)]
+    assert stats['successes'] == 1
+    assert stats['speed'] is None
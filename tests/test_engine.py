@@ -0,0 +1,70 @@
+import logging
+import multiprocessing
+from collections import deque
+
+import pytest
+
+from conftest import StubConfig
+from stacks.server import engine as engine_module
+from stacks.server.engine import Engine
+from stacks.utils import logutils
+from stacks.utils.logutils import LOG_BUFFER, setup_logging
+
+pytestmark = pytest.mark.skipif(engine_module.fcntl is None, reason="needs Unix sockets")
+
+CONFIG = {'api': {'session_secret': 'test-secret'}, 'logging': {'level': 'INFO'}}
+
+
+class RecordingWorker:
+    def update_config(self):
+        logging.getLogger('worker').info("Applied config in engine process")
+
+
+def run_engine(ready, stop):
+    """Engine process: serves calls with a stand-in worker"""
+    engine = Engine(StubConfig(CONFIG))
+    setup_logging(engine.config)
+    engine.worker = RecordingWorker()
+    engine._serve_others()
+    ready.set()
+    stop.wait()
+
+
+@pytest.fixture
+def remote_engine():
+    engine_module.ENGINE_SOCKET.parent.mkdir(parents=True, exist_ok=True)
+    context = multiprocessing.get_context('fork')
+    ready, stop = context.Event(), context.Event()
+    process = context.Process(target=run_engine, args=(ready, stop), daemon=True)
+    process.start()
+    assert ready.wait(timeout=10)
+    yield
+    stop.set()
+    process.join(timeout=10)
+
+
+def test_engine_calls_from_a_web_process_reach_the_engine(remote_engine):
+    web = Engine(StubConfig(CONFIG))
+    assert not web.local and web.worker is None
+
+    web.apply_config()
+    lines, seq, reset, epoch = web.read_logs(logger='worker')
+
+    assert reset and seq > 0
+    assert epoch != logutils.LOG_EPOCH
+    assert any("Applied config in engine process" in line for line in lines)
+    # The line is in the engine's log buffer, not in this process's
+    assert not any("Applied config in engine process" in line for *_, line in LOG_BUFFER)
+
+
+def test_log_reads_reset_when_the_cursor_is_gone(monkeypatch):
+    monkeypatch.setattr(logutils, 'LOG_BUFFER', deque(maxlen=3))
+    for seq in range(1, 6):
+        logutils.LOG_BUFFER.append((seq, logging.INFO, 'queue', f"line {seq}"))
+    epoch = logutils.LOG_EPOCH
+
+    assert logutils.read_log_buffer(after=3, epoch=epoch) == (["line 4", "line 5"], 5, False, epoch)
+    # Lines 2 and 3 were dropped: everything, not a silent gap
+    assert logutils.read_log_buffer(after=1, epoch=epoch) == (["line 3", "line 4", "line 5"], 5, True, epoch)
+    # Same numbers from before a restart
+    assert logutils.read_log_buffer(after=3, epoch='earlier')[2] is True
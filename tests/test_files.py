@@ -0,0 +1,82 @@
+import errno
+import os
+
+import pytest
+
+from stacks.downloader import utils
+from stacks.downloader.utils import move_file, preallocate
+
+DATA = os.urandom(3 * 1024 * 1024 + 123)
+
+
+@pytest.fixture
+def cross_device(monkeypatch):
+    """Renames out of the source folder fail as if it were another filesystem"""
+    rename = os.rename
+
+    def fake_rename(src, dst):
+        if 'src' in os.fspath(src):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        rename(src, dst)
+
+    monkeypatch.setattr(utils.os, 'rename', fake_rename)
+
+
+def paths(tmp_path):
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'dst').mkdir()
+    src = tmp_path / 'src' / 'book.part'
+    src.write_bytes(DATA)
+    return src, tmp_path / 'dst' / 'book.pdf'
+
+
+def test_move_file_renames_on_the_same_filesystem(tmp_path):
+    src, dst = paths(tmp_path)
+    inode = src.stat().st_ino
+
+    move_file(src, dst)
+    assert not src.exists()
+    assert dst.stat().st_ino == inode
+
+
+@pytest.mark.parametrize('missing', [(), ('copy_file_range',), ('copy_file_range', 'sendfile')])
+def test_move_file_copies_across_filesystems(tmp_path, cross_device, monkeypatch, missing):
+    # Each fallback in turn: copy_file_range, sendfile, plain reads and writes
+    for name in missing:
+        monkeypatch.delattr(utils.os, name, raising=False)
+    src, dst = paths(tmp_path)
+    os.utime(src, (1_000_000, 1_000_000))
+
+    move_file(src, dst)
+    assert not src.exists()
+    assert dst.read_bytes() == DATA
+    assert dst.stat().st_mtime == 1_000_000
+    assert sorted(path.name for path in dst.parent.iterdir()) == ['book.pdf']
+
+
+def test_interrupted_copy_keeps_the_source(tmp_path, cross_device, monkeypatch):
+    def fail(src, dst, size):
+        dst.write(b'partial')
+        raise OSError(errno.EIO, os.strerror(errno.EIO))
+
+    monkeypatch.setattr(utils, '_copy_contents', fail)
+    src, dst = paths(tmp_path)
+
+    with pytest.raises(OSError):
+        move_file(src, dst)
+    assert src.read_bytes() == DATA
+    assert list(dst.parent.iterdir()) == []
+
+
+def test_preallocate_extends_unless_keeping_the_size(tmp_path):
+    path = tmp_path / 'book.part'
+    path.write_bytes(b'x' * 10)
+
+    with open(path, 'r+b') as f:
+        preallocate(f, 4096, keep_size=True)
+    assert path.stat().st_size == 10
+
+    with open(path, 'r+b') as f:
+        preallocate(f, 4096)
+    assert path.stat().st_size == 4096
+    assert path.read_bytes()[:10] == b'x' * 10
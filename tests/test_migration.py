@@ -0,0 +1,41 @@
+from stacks.constants import PARTIAL_META_SUFFIX, SEGMENT_MANIFEST_SUFFIX
+from stacks.utils.migrationutils import migrate_incomplete_folder
+
+
+def test_sidecars_move_with_their_part_file_and_are_not_counted(tmp_path):
+    old, new = tmp_path / 'old', tmp_path / 'new'
+    old.mkdir()
+    (old / 'a.part').write_bytes(b'a' * 100)
+    (old / f'a.part{SEGMENT_MANIFEST_SUFFIX}').write_text('{"segments": []}')
+    (old / f'a.part{PARTIAL_META_SUFFIX}').write_text('{}')
+    (old / 'b.part').write_bytes(b'b' * 50)
+
+    ok, message, stats = migrate_incomplete_folder(old, new)
+
+    assert ok, message
+    assert stats['files_found'] == 2
+    assert stats['files_migrated'] == 2
+    assert stats['files_left'] == 0
+    assert stats['bytes_total'] == stats['bytes_migrated'] == 100 + 16 + 2 + 50
+    assert sorted(path.name for path in new.iterdir()) == [
+        'a.part', f'a.part{PARTIAL_META_SUFFIX}', f'a.part{SEGMENT_MANIFEST_SUFFIX}', 'b.part'
+    ]
+
+
+def test_orphan_sidecars_follow_their_part_file_or_are_deleted(tmp_path):
+    old, new = tmp_path / 'old', tmp_path / 'new'
+    old.mkdir()
+    new.mkdir()
+    # a.part already moved by an earlier run, b.part is gone for good
+    (new / 'a.part').write_bytes(b'a')
+    (old / f'a.part{PARTIAL_META_SUFFIX}').write_text('{}')
+    (old / f'b.part{SEGMENT_MANIFEST_SUFFIX}').write_text('{"segments": []}')
+    (old / f'b.part{PARTIAL_META_SUFFIX}').write_text('{}')
+    (old / 'notes.txt').write_text('not ours')
+
+    ok, message, stats = migrate_incomplete_folder(old, new)
+
+    assert ok, message
+    assert stats['files_left'] == 0
+    assert sorted(path.name for path in new.iterdir()) == ['a.part', f'a.part{PARTIAL_META_SUFFIX}']
+    assert [path.name for path in old.iterdir()] == ['notes.txt']
@@ -0,0 +1,80 @@
+import pytest
+
+from stacks.constants import QUEUE_CHANGE_LOG_SIZE, QUEUE_DEFAULT_PRIORITY
+from stacks.server.queue import PriorityLanes
+
+
+def md5_of(n):
+    return f"{n:032x}"
+
+
+def test_changes_since_returns_small_batches(make_queue):
+    queue = make_queue()
+    since = queue.get_status()['version']
+    queue.add_many([(md5_of(n), None, QUEUE_DEFAULT_PRIORITY) for n in range(3)])
+
+    status = queue.get_status(since)
+    assert [change['item']['md5'] for change in status['changes']] == [md5_of(n) for n in range(3)]
+
+
+def test_changes_since_resyncs_when_a_batch_outgrew_the_log(make_queue):
+    queue = make_queue()
+    since = queue.get_status()['version']
+    count = QUEUE_CHANGE_LOG_SIZE + 500
+    queue.add_many([(md5_of(n), None, QUEUE_DEFAULT_PRIORITY) for n in range(count)])
+
+    # Part of the batch is no longer logged: the full queue, never a partial delta
+    status = queue.get_status(since)
+    assert 'changes' not in status
+    assert len(status['queue']) == count
+
+    # Versions from inside the retained part of the batch still get exact deltas
+    latest = status['version']
+    status = queue.get_status(latest - 10)
+    assert [change['item']['md5'] for change in status['changes']] == [md5_of(n) for n in range(count - 10, count)]
+
+
+def test_progress_does_not_signal_queue_changes(make_queue):
+    queue = make_queue()
+    queue.add(md5_of(1))
+    queue.add(md5_of(2))
+    queue.get_next(slot=0)
+    queue.queue_changed.clear()
+
+    queue.update_current(0, progress={'percent': 50})
+    assert not queue.queue_changed.is_set()
+
+    queue.remove_from_queue(md5_of(2))
+    assert queue.queue_changed.is_set()
+
+
+def test_priority_lanes_serve_the_highest_priority_first():
+    lanes = PriorityLanes([
+        {'md5': 'low', 'priority': 'low'},
+        {'md5': 'normal'},
+        {'md5': 'high-1', 'priority': 'high'},
+        {'md5': 'high-2', 'priority': 'high'},
+    ])
+    lanes.appendleft({'md5': 'low-0', 'priority': 'low'})
+
+    assert [item['md5'] for item in lanes] == ['high-1', 'high-2', 'normal', 'low-0', 'low']
+    # Items from before priorities existed join the default lane
+    assert lanes.items['normal']['priority'] == QUEUE_DEFAULT_PRIORITY
+    assert lanes.remove('high-2') and not lanes.remove('high-2')
+    assert [lanes.popleft()['md5'] for _ in range(len(lanes))] == ['high-1', 'normal', 'low-0', 'low']
+    with pytest.raises(IndexError):
+        lanes.popleft()
+
+
+@pytest.mark.parametrize('storage', ['json', 'sqlite'])
+def test_priority_order_survives_a_restart(make_queue, storage):
+    queue = make_queue(queue={'storage': storage})
+    for n, priority in enumerate(['low', 'normal', 'high', 'normal', 'high']):
+        queue.add(md5_of(n), priority=priority)
+    expected = [md5_of(n) for n in (2, 4, 1, 3, 0)]
+    assert queue.peek(5) == expected
+    queue.store.close()
+
+    reopened = make_queue(queue={'storage': storage})
+    assert [item['md5'] for item in reopened.get_status()['queue']] == expected
+    assert reopened.get_next()['md5'] == md5_of(2)
@@ -0,0 +1,122 @@
+import copy
+import logging
+import threading
+import time
+
+import pytest
+
+from stacks.constants import RACE_GRACE
+from stacks.downloader import flaresolver, race
+from stacks.downloader.breaker import CircuitBreaker, NegativeCache
+from stacks.downloader.ratelimit import DomainRateLimiter
+from stacks.downloader.scoreboard import MirrorScoreboard
+from stacks.downloader.utils import is_cancelled
+
+MD5 = '0' * 32
+
+
+def mirror(name):
+    return {'url': f'https://{name}.example/file', 'domain': f'{name}.example', 'type': 'external_mirror', 'text': name}
+
+
+class FakeDownloader:
+    """The parts of AnnaDownloader race_mirrors uses; resolve(d, url) stands in for resolve_mirror"""
+
+    def __init__(self, resolve, mirrors=()):
+        self.resolve = resolve
+        self.resolved = []
+        self.progress_callback = None
+        self.status_callback = None
+        self.logger = logging.getLogger('stacks_tests')
+        # One request at a time per mirror
+        self.rate_limiter = DomainRateLimiter({m['domain']: {'interval': 0, 'burst': 1, 'concurrency': 1} for m in mirrors})
+        self.scoreboard = MirrorScoreboard()
+        self.breaker = CircuitBreaker()
+        self.negative_cache = NegativeCache()
+
+    def for_slot(self, progress_callback=None, status_callback=None):
+        slot = copy.copy(self)
+        slot.progress_callback = progress_callback
+        slot.status_callback = status_callback
+        return slot
+
+    def resolve_mirror(self, mirror_url, mirror_type, md5, outcome=None):
+        self.resolved.append(mirror_url)
+        outcome['flaresolverr'] = False
+        return self.resolve(self, mirror_url)
+
+
+@pytest.fixture(autouse=True)
+def probe_speeds(monkeypatch):
+    """Links probe at the speed in their name"""
+    monkeypatch.setattr(race, 'probe_link', lambda d, link: float(link.rpartition('-')[2]))
+
+
+def test_losers_stop_resolving_when_the_race_ends():
+    fast, slow = mirror('fast'), mirror('slow')
+    stopped = threading.Event()
+
+    def resolve(d, url):
+        if url == fast['url']:
+            return 'link-100'
+        # A challenge solve that would take far longer than the race
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if is_cancelled(d):
+                stopped.set()
+                return None
+            time.sleep(0.01)
+        return 'link-200'
+
+    d = FakeDownloader(resolve, [fast, slow])
+    start = time.monotonic()
+    winner, unfinished = race.race_mirrors(d, [fast, slow], MD5)
+
+    assert winner[0] is fast and winner[1] == 'link-100'
+    assert unfinished == [slow]
+    assert stopped.wait(1)
+    assert time.monotonic() - start < RACE_GRACE + 1
+    # The loser gave its rate limit slot back
+    acquired, key = d.rate_limiter.acquire(slow['url'], cancelled=lambda: True)
+    assert acquired
+    d.rate_limiter.release(key)
+    d.rate_limiter.release(winner[4])
+
+
+def test_losing_links_are_kept_for_the_next_attempt():
+    fast, slower = mirror('fast'), mirror('slower')
+    links = {fast['url']: 'link-100', slower['url']: 'link-50'}
+    d = FakeDownloader(lambda d, url: links[url], [fast, slower])
+    resolved = {}
+
+    winner, unfinished = race.race_mirrors(d, [fast, slower], MD5, resolved)
+    d.rate_limiter.release(winner[4])
+    assert winner[0] is fast
+    assert unfinished == [slower]
+    assert resolved[slower['url']][0] == 'link-50'
+
+    # Raced again: probed, not resolved a second time
+    d.resolved.clear()
+    winner, unfinished = race.race_mirrors(d, [slower], MD5, resolved)
+    d.rate_limiter.release(winner[4])
+    assert winner[1] == 'link-50'
+    assert d.resolved == []
+    assert resolved == {}
+
+
+def test_flaresolverr_returns_once_cancelled(monkeypatch):
+    def solve(*args, **kwargs):
+        time.sleep(5)
+        raise AssertionError("not cancelled")
+
+    monkeypatch.setattr(flaresolver.requests, 'post', solve)
+    cancel = threading.Event()
+    d = FakeDownloader(None)
+    d.flaresolverr_url = 'http://flaresolverr.invalid'
+    d.flaresolverr_timeout = 60000
+    d.progress_callback = lambda progress: not cancel.is_set()
+
+    threading.Timer(0.2, cancel.set).start()
+    start = time.monotonic()
+    assert flaresolver.solve_with_flaresolverr(d, 'https://slow.example/file') == (False, {}, None)
+    assert time.monotonic() - start < 2
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+
+from stacks.downloader import ratelimit
+from stacks.downloader.ratelimit import DomainRateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_tokens_allow_a_burst_then_one_request_per_interval(clock):
+    limiter = DomainRateLimiter({'example.com': {'interval': 2, 'burst': 2, 'concurrency': 0}})
+    url = 'https://example.com/md5/x'
+
+    for _ in range(2):
+        acquired, key = limiter.acquire(url)
+        assert acquired and key == 'example.com'
+        limiter.release(key)
+    assert not limiter.ready(url)
+
+    clock.now += 1
+    assert not limiter.ready(url)
+    clock.now += 1
+    assert limiter.ready(url)
+
+
+def test_policies_cover_subdomains_and_the_wildcard(clock):
+    limiter = DomainRateLimiter({
+        'example.com': {'interval': 10, 'burst': 1, 'concurrency': 0},
+        '*': {'interval': 10, 'burst': 1, 'concurrency': 0},
+    })
+
+    assert limiter.acquire('https://cdn.example.com/file')[1] == 'example.com'
+    assert not limiter.ready('https://example.com/other')
+    assert limiter.acquire('https://mirror.example/file')[1] == '*'
+    assert not limiter.ready('https://another.example/file')
+
+    unlimited = DomainRateLimiter({'example.com': {'interval': 10, 'burst': 1, 'concurrency': 0}})
+    assert unlimited.acquire('https://mirror.example/file') == (True, None)
+
+
+def test_concurrency_caps_requests_holding_a_domain(clock):
+    limiter = DomainRateLimiter({'example.com': {'interval': 0, 'burst': 1, 'concurrency': 1}})
+    url = 'https://example.com/file'
+
+    acquired, key = limiter.acquire(url)
+    assert acquired
+    assert not limiter.ready(url)
+    # A waiter that gets cancelled gives up without taking the domain
+    assert limiter.acquire(url, cancelled=lambda: True) == (False, None)
+
+    limiter.release(key)
+    with limiter.limit(url) as acquired:
+        assert acquired
+        assert not limiter.ready(url)
+    assert limiter.ready(url)
+
+
+def test_reconfiguring_keeps_the_state_of_limited_domains(clock):
+    policy = {'interval': 5, 'burst': 3, 'concurrency': 0}
+    limiter = DomainRateLimiter({'example.com': policy})
+    for _ in range(3):
+        limiter.release(limiter.acquire('https://example.com/file')[1])
+
+    # Same policy from a config reload: the spent tokens stay spent
+    limiter.configure({'example.com': dict(policy), 'other.example': dict(policy)})
+    assert not limiter.ready('https://example.com/file')
+    assert limiter.ready('https://other.example/file')
+
+    limiter.configure({})
+    assert limiter.ready('https://example.com/file')
@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from stacks.constants import SEGMENT_MIN_SIZE
+from stacks.downloader.segmented import SegmentedDownload, download_segmented, manifest_path
+
+BODY = os.urandom(4 * SEGMENT_MIN_SIZE)
+
+
+def downloader(segments=2):
+    return SimpleNamespace(
+        session=requests.Session(),
+        segments=segments,
+        received=0,
+        progress_callback=None,
+        logger=logging.getLogger('stacks_tests'),
+    )
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves BODY with an ETag, honouring closed Range requests and If-Range"""
+
+    etag = '"v1"'
+
+    def do_GET(self):
+        if_range = self.headers.get('If-Range')
+        byte_range = self.headers.get('Range')
+        if byte_range and (if_range is None or if_range == self.etag):
+            start, _, end = byte_range.partition('=')[2].partition('-')
+            start, end = int(start), int(end) + 1
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end - 1}/{len(BODY)}")
+        else:
+            start, end = 0, len(BODY)
+            self.send_response(200)
+        self.send_header('ETag', self.etag)
+        self.send_header('Content-Length', str(end - start))
+        self.end_headers()
+        self.wfile.write(BODY[start:end])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def body_url(monkeypatch):
+    monkeypatch.setattr(RangeHandler, 'etag', '"v1"')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), RangeHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/book.pdf"
+    server.shutdown()
+
+
+def test_idle_connections_take_over_half_of_the_busiest_segment(tmp_path):
+    download = SegmentedDownload(downloader(), 'https://mirror.example/file', tmp_path / 'a.part', len(BODY), 2, 1)
+    first, second = download._claim(), download._claim()
+    assert (first['start'], first['end']) == (0, 2 * SEGMENT_MIN_SIZE)
+    assert (second['start'], second['end']) == (2 * SEGMENT_MIN_SIZE, 4 * SEGMENT_MIN_SIZE)
+
+    # The second connection is further behind: its back half is split off
+    first['pos'] = SEGMENT_MIN_SIZE
+    third = download._claim()
+    assert (third['start'], third['end'], third['pos']) == (3 * SEGMENT_MIN_SIZE, 4 * SEGMENT_MIN_SIZE, 3 * SEGMENT_MIN_SIZE)
+    assert second['end'] == 3 * SEGMENT_MIN_SIZE
+
+    # Segments below twice the minimum size are left alone
+    first['pos'] = first['end']
+    second['pos'] = second['end'] - SEGMENT_MIN_SIZE
+    third['pos'] = third['end'] - SEGMENT_MIN_SIZE
+    assert download._claim() is None
+
+
+def interrupted(d, url, temp_path):
+    """A .part file with the first half of each segment, as a cancelled download leaves it"""
+    download = SegmentedDownload(d, url, temp_path, len(BODY), 2, 1, {'url': url, 'etag': '"v1"'})
+    with open(temp_path, 'r+b') as f:
+        for segment in download.segments:
+            segment['pos'] = segment['start'] + SEGMENT_MIN_SIZE
+            f.seek(segment['start'])
+            f.write(BODY[segment['start']:segment['pos']])
+    download.save()
+
+
+def test_resumes_every_segment_from_the_manifest(tmp_path, body_url):
+    d = downloader()
+    temp_path = tmp_path / 'a.part'
+    interrupted(d, body_url, temp_path)
+    assert json.loads(manifest_path(temp_path).read_text())['etag'] == '"v1"'
+
+    assert download_segmented(d, body_url, temp_path) is True
+    assert temp_path.read_bytes() == BODY
+    assert d.received == len(BODY) // 2
+    assert not manifest_path(temp_path).exists()
+
+
+def test_restarts_when_the_file_changed_since_the_manifest(tmp_path, body_url):
+    d = downloader()
+    temp_path = tmp_path / 'a.part'
+    interrupted(d, body_url, temp_path)
+    RangeHandler.etag = '"v2"'
+
+    assert download_segmented(d, body_url, temp_path) is True
+    assert temp_path.read_bytes() == BODY
+    assert d.received == len(BODY)
@@ -0,0 +1,186 @@
+import json
+
+import pytest
+
+from stacks.server.history import HistoryIndex
+from stacks.server.storage import JournalStore, SQLiteHistory
+from stacks.server.queue import STATE_COMPLETED, STATE_FAILED
+
+
+def md5_of(n):
+    return f"{n:032x}"
+
+
+def download(queue, n, success=True, fast=False, subfolder=None):
+    queue.add(md5_of(n), subfolder=subfolder)
+    queue.get_next()
+    queue.mark_complete(md5_of(n), success, used_fast_download=fast, subfolder=subfolder)
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request):
+    return request.param
+
+
+def test_history_lookups_match_across_stores(make_queue, storage):
+    queue = make_queue(queue={'storage': storage, 'max_history': 0})
+    for n in range(12):
+        download(queue, n, success=n % 3 != 0, fast=n % 2 == 0, subfolder='sub' if n % 4 == 0 else None)
+
+    assert queue.get_state(md5_of(1)) == STATE_COMPLETED
+    assert queue.get_state(md5_of(3)) == STATE_FAILED
+
+    items, cursor = queue.query_history(limit=3, success=True, method='fast')
+    assert [item['md5'] for item in items] == [md5_of(10), md5_of(8), md5_of(4)]
+    items, cursor = queue.query_history(cursor=cursor, limit=3, success=True, method='fast')
+    assert [item['md5'] for item in items] == [md5_of(2)]
+    assert cursor is None
+
+    items, _ = queue.query_history(subfolder='sub')
+    assert [item['md5'] for item in items] == [md5_of(8), md5_of(4), md5_of(0)]
+    assert [item['md5'] for item in queue.get_status()['recent_history'][:2]] == [md5_of(11), md5_of(10)]
+
+
+def test_retry_keeps_other_history_consistent(make_queue, storage):
+    queue = make_queue(queue={'storage': storage})
+    download(queue, 1, success=False)
+    download(queue, 2)
+
+    assert queue.retry_failed(md5_of(1)) == (True, "Added to queue for retry")
+    assert queue.get_state(md5_of(1)) == 'queued'
+    assert [item['md5'] for item in queue.query_history()[0]] == [md5_of(2)]
+
+
+def test_sqlite_history_stays_in_the_database(make_queue):
+    queue = make_queue(queue={'storage': 'sqlite', 'max_history': 0})
+    for n in range(5):
+        download(queue, n)
+    queue.clear_history()
+    download(queue, 5)
+    last_id = queue.query_history()[0][0]['id']
+    queue.store.close()
+
+    reopened = make_queue(queue={'storage': 'sqlite', 'max_history': 0})
+    assert isinstance(reopened.history, SQLiteHistory)
+    assert reopened.store.load()[1] is None
+    assert len(reopened.history) == 1
+    assert reopened.get_state(md5_of(5)) == STATE_COMPLETED
+    assert reopened.get_state(md5_of(0)) is None
+
+    # Ids keep counting after a clear and a restart
+    download(reopened, 6)
+    assert reopened.query_history()[0][0]['id'] == last_id + 1 > 6
+
+
+def test_sqlite_trims_to_stored_row_count(make_queue):
+    queue = make_queue(queue={'storage': 'sqlite', 'max_history': 10})
+    for n in range(30):
+        download(queue, n)
+    queue.save()
+
+    rows = queue.store.fetch("SELECT COUNT(*), MIN(id) FROM history")[0]
+    assert rows[0] <= 11
+    assert rows[1] == queue.history.first_id()
+    assert queue.get_state(md5_of(0)) is None
+    assert queue.get_state(md5_of(29)) == STATE_COMPLETED
+
+
+def test_sqlite_lookups_use_indexes(make_queue):
+    queue = make_queue(queue={'storage': 'sqlite'})
+
+    def plan(sql, params):
+        return ' '.join(row[-1] for row in queue.store.fetch('EXPLAIN QUERY PLAN ' + sql, params))
+
+    indexes = {row[0] for row in queue.store.fetch("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_queue_position', 'idx_queue_status', 'idx_history_md5', 'idx_history_completed_at', 'idx_history_success'} <= indexes
+    assert 'idx_history_md5' in plan("SELECT COUNT(*), SUM(success) FROM history WHERE md5 = ?", (md5_of(1),))
+    assert 'idx_history_success' in plan("SELECT id, data FROM history WHERE success = ? ORDER BY id DESC LIMIT 10", (1,))
+    assert 'idx_history_completed_at' in plan("SELECT id, data FROM history WHERE completed_at >= ? AND completed_at <= ?",
+                                              ('2026-01-01', '2026-01-02'))
+
+
+def test_history_index_counts_follow_trims():
+    history = HistoryIndex([{'md5': 'a', 'success': False}, {'md5': 'a', 'success': True}, {'md5': 'b'}])
+    assert history.counts('a') == (2, 1)
+    history.trim(1)
+    assert history.counts('a') == (1, 1)
+    history.remove_md5('a')
+    assert history.counts('a') is None
+    assert history.first_id() == 3
+
+
+def test_requeue_behind_the_lane_survives_a_restart(make_queue, storage):
+    queue = make_queue(queue={'storage': storage})
+    for n in range(3):
+        queue.add(md5_of(n))
+    queue.get_next(slot=0)
+    queue.requeue_current(0, front=False)
+    queue.store.close()
+
+    reopened = make_queue(queue={'storage': storage})
+    assert [item['md5'] for item in reopened.get_status()['queue']] == [md5_of(1), md5_of(2), md5_of(0)]
+
+
+def journal_store(tmp_path):
+    return JournalStore(tmp_path / 'queue.json', tmp_path / 'queue.journal')
+
+
+def add_entry(seq, n):
+    return json.dumps({'seq': seq, 'op': 'add', 'item': {'md5': md5_of(n)}})
+
+
+def test_journal_replays_over_the_snapshot(tmp_path):
+    store = journal_store(tmp_path)
+    store.write_snapshot([{'md5': md5_of(1)}, {'md5': md5_of(2)}], [], 2)
+    # Entries 1 and 2 are already in the snapshot (compaction crashed before dropping them)
+    store.journal_file.write_text('\n'.join([
+        add_entry(1, 1),
+        add_entry(2, 2),
+        add_entry(3, 3),
+        json.dumps({'seq': 4, 'op': 'complete', 'item': {'md5': md5_of(1), 'success': True}}),
+    ]) + '\n')
+
+    queue, history, replayed = store.load()
+    assert [item['md5'] for item in queue] == [md5_of(2), md5_of(3)]
+    assert [item['md5'] for item in history] == [md5_of(1)]
+    assert replayed == 2
+    assert store.seq == 4
+
+
+def test_journal_skips_a_torn_last_line(tmp_path):
+    store = journal_store(tmp_path)
+    store.journal_file.write_text(add_entry(1, 1) + '\n' + add_entry(2, 2)[:20])
+
+    queue, _, replayed = store.load()
+    assert [item['md5'] for item in queue] == [md5_of(1)]
+    assert replayed == 1
+
+    # The next entry starts on its own line instead of joining the torn one
+    store.record({'op': 'add', 'item': {'md5': md5_of(3)}})
+    store.close()
+    queue, _, _ = journal_store(tmp_path).load()
+    assert [item['md5'] for item in queue] == [md5_of(1), md5_of(3)]
+
+
+def test_journal_recovers_from_an_interrupted_compaction(tmp_path):
+    store = journal_store(tmp_path)
+    store.write_snapshot([{'md5': md5_of(1)}], [], 1)
+    store.load()
+    store.record({'op': 'add', 'item': {'md5': md5_of(2)}})
+    # Compaction rotated the journal, then died before writing the snapshot
+    store.rotate()
+    store.record({'op': 'add', 'item': {'md5': md5_of(3)}})
+    store.close()
+    assert store.rotated_file.exists()
+
+    store = journal_store(tmp_path)
+    queue, _, replayed = store.load()
+    assert [item['md5'] for item in queue] == [md5_of(1), md5_of(2), md5_of(3)]
+    assert replayed == 2
+
+    # The next compaction keeps both journals until its snapshot is written
+    seq = store.rotate()
+    assert not store.journal_file.exists()
+    store.write_snapshot(queue, [], seq)
+    assert not store.rotated_file.exists()
+    assert [item['md5'] for item in journal_store(tmp_path).load()[0]] == [md5_of(1), md5_of(2), md5_of(3)]
@@ -0,0 +1,234 @@
+import copy
+import json
+import threading
+import time
+
+import pytest
+
+from stacks.constants import MIGRATION_STATE_FILE, PROJECT_ROOT
+from stacks.server.queue import STATE_COMPLETED
+from stacks.server import worker as worker_module
+from stacks.server.worker import DownloadWorker
+from stacks.utils.migrationutils import migrate_incomplete_folder
+
+A, B, C = 'a' * 32, 'b' * 32, 'c' * 32
+
+
+class FakeDownloader:
+    """The parts of AnnaDownloader a slot uses; downloads of gated md5s wait until released or cancelled"""
+
+    def __init__(self, gated=()):
+        self.session = None
+        self.progress_callback = None
+        self.gates = {md5: threading.Event() for md5 in gated}
+        self.started = []
+        self.fetched = []
+
+    def for_slot(self, progress_callback=None, status_callback=None):
+        slot = copy.copy(self)
+        slot.progress_callback = progress_callback
+        return slot
+
+    def get_download_links(self, md5):
+        self.fetched.append(md5)
+        return f"{md5}.pdf", ['https://mirror.example/file']
+
+    def download(self, md5, **kwargs):
+        self.started.append(md5)
+        # Gates hold the first download of their md5 only
+        gate = self.gates.pop(md5, None)
+        while gate and not gate.wait(0.01):
+            if not self.progress_callback({'check_only': True}):
+                return False, False, None
+        return True, False, f"/downloads/{md5}.pdf"
+
+    def cleanup(self):
+        pass
+
+
+@pytest.fixture
+def make_worker(make_queue):
+    workers = []
+
+    def make(slots=1, gated=(), prefetch=0):
+        config = {'downloads': {'concurrent_downloads': slots, 'prefetch_count': prefetch}}
+        queue = make_queue(**config)
+        worker = DownloadWorker(queue, queue.config)
+        worker.downloader = FakeDownloader(gated)
+        workers.append(worker)
+        return worker
+
+    yield make
+    for worker in workers:
+        worker.stop()
+
+
+def wait_for(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def idle(worker):
+    return worker.queue.wait_until(lambda: not worker.queue.active and not worker.queue.has_queued(), timeout=5)
+
+
+def test_cancelling_one_download_requeues_it_behind_its_lane(make_worker):
+    worker = make_worker(gated=[A])
+    for md5 in (A, B):
+        worker.queue.add(md5)
+    worker.start()
+    wait_for(lambda: worker.downloader.started == [A])
+
+    assert worker.cancel_and_requeue_current(A)
+    assert not worker.paused
+    assert idle(worker)
+    assert worker.downloader.started == [A, B, A]
+    assert worker.queue.get_state(A) == worker.queue.get_state(B) == STATE_COMPLETED
+
+
+def test_downloads_finishing_after_another_was_cancelled_complete(make_worker):
+    worker = make_worker(slots=2, gated=[A, B])
+    gates = dict(worker.downloader.gates)
+    for md5 in (A, B):
+        worker.queue.add(md5)
+    worker.start()
+    wait_for(lambda: sorted(worker.downloader.started) == [A, B])
+
+    worker.cancel_and_requeue_current(A)
+    gates[B].set()
+    wait_for(lambda: worker.downloader.started.count(A) == 2)
+    assert idle(worker)
+    # B finished while A was cancelled: completed once, never downloaded again
+    assert worker.downloader.started.count(B) == 1
+    assert [item['md5'] for item in worker.queue.query_history()[0]].count(B) == 1
+
+
+def test_removing_during_a_transfer_drops_it_and_its_partial_file(make_worker):
+    worker = make_worker(gated=[A])
+    incomplete = PROJECT_ROOT / 'download' / 'incomplete'
+    incomplete.mkdir(parents=True, exist_ok=True)
+    partial = [incomplete / f"{A}.part", incomplete / f"{A}.part.meta"]
+    for path in partial:
+        path.write_bytes(b'x')
+    worker.queue.add(A)
+    worker.start()
+    wait_for(lambda: worker.downloader.started == [A])
+
+    assert worker.cancel_and_remove_current(A)
+    assert idle(worker)
+    assert worker.queue.get_state(A) is None
+    assert worker.queue.query_history()[0] == []
+    assert not any(path.exists() for path in partial)
+
+
+def test_upcoming_items_are_prefetched_while_a_slot_is_busy(make_worker):
+    worker = make_worker(gated=[A], prefetch=2)
+    gates = dict(worker.downloader.gates)
+    worker.queue.add(A)
+    worker.start()
+    wait_for(lambda: worker.downloader.started == [A])
+
+    worker.queue.add(B)
+    worker.queue.add(C)
+    wait_for(lambda: sorted(worker.downloader.fetched) == [A, B, C])
+    gates[A].set()
+    assert idle(worker)
+    # The slot used the prefetched info instead of fetching again
+    assert sorted(worker.downloader.fetched) == [A, B, C]
+    assert worker.downloader.started == [A, B, C]
+
+    worker.queue.add('d' * 32)
+    worker.pause()
+    assert worker._prefetch_wanted() == []
+
+
+def test_idle_slots_wake_on_queue_changes(make_worker):
+    worker = make_worker(slots=2)
+    worker.start()
+    time.sleep(0.1)
+
+    start = time.monotonic()
+    worker.queue.add(A)
+    wait_for(lambda: worker.downloader.started == [A])
+    assert time.monotonic() - start < 0.5
+
+    worker.pause()
+    worker.queue.add(B)
+    time.sleep(0.2)
+    assert worker.downloader.started == [A]
+    worker.resume()
+    wait_for(lambda: worker.downloader.started == [A, B])
+
+    # Slots above a lowered limit exit once woken
+    retired = worker.slots[1]
+    worker.config.values['downloads']['concurrent_downloads'] = 1
+    worker.queue.notify()
+    retired.thread.join(1)
+    assert not retired.thread.is_alive()
+    assert list(worker.slots) == [0]
+
+
+def part_files(folder, *md5s):
+    folder = PROJECT_ROOT / folder.lstrip('/')
+    folder.mkdir(parents=True, exist_ok=True)
+    for md5 in md5s:
+        (folder / f"{md5}.part").write_bytes(b'partial')
+    return folder
+
+
+@pytest.fixture
+def migrated(make_worker, monkeypatch):
+    """A worker whose migrations wait for release.set() before moving files"""
+    release = threading.Event()
+
+    def gated(*args, **kwargs):
+        release.wait(5)
+        return migrate_incomplete_folder(*args, **kwargs)
+
+    monkeypatch.setattr(worker_module, 'migrate_incomplete_folder', gated)
+    worker = make_worker()
+    # Keep the fake downloader when the new folder is applied
+    monkeypatch.setattr(worker, 'recreate_downloader', lambda: None)
+    yield worker, release
+    release.set()
+    MIGRATION_STATE_FILE.unlink(missing_ok=True)
+
+
+def test_migration_pauses_downloads_until_every_file_has_moved(migrated):
+    worker, release = migrated
+    old = part_files('/migrate/old', A, B)
+    worker.start()
+
+    assert worker.start_migration('/migrate/old', '/migrate/new')
+    assert json.loads(MIGRATION_STATE_FILE.read_text())['to'] == '/migrate/new'
+    assert worker.paused and worker.migrating()
+    assert not worker.start_migration('/migrate/old', '/migrate/other')
+    worker.resume()
+    assert worker.paused
+
+    release.set()
+    wait_for(lambda: worker.get_migration_status()['state'] == 'done')
+    new = PROJECT_ROOT / 'migrate' / 'new'
+    assert sorted(path.name for path in new.glob('*.part')) == [f"{A}.part", f"{B}.part"]
+    assert not list(old.glob('*.part'))
+    assert worker.config.get('downloads', 'incomplete_folder_path') == '/migrate/new'
+    assert worker.config.saved == 1
+    assert not MIGRATION_STATE_FILE.exists()
+    assert not worker.paused
+
+
+def test_interrupted_migration_continues_on_start(migrated):
+    worker, release = migrated
+    part_files('/resume/old', A)
+    MIGRATION_STATE_FILE.write_text(json.dumps({'from': '/resume/old', 'to': '/resume/new', 'was_paused': True}))
+
+    release.set()
+    worker.start()
+    wait_for(lambda: worker.get_migration_status() and worker.get_migration_status()['state'] == 'done')
+    assert (PROJECT_ROOT / 'resume' / 'new' / f"{A}.part").exists()
+    assert worker.config.get('downloads', 'incomplete_folder_path') == '/resume/new'
+    assert not MIGRATION_STATE_FILE.exists()
+    # Paused before the restart: stays paused
+    assert worker.paused
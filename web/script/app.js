@@ -5,8 +5,18 @@
 // ============================================================================
 
 let lastData = "{}";
-let lastLog = "{}";
+let statusState = null;
+const QUEUE_PRIORITIES = ["high", "normal", "low"];
+const RECENT_HISTORY_SIZE = 10;
+const STATUS_POLL_MS = 2000;
+const STREAM_RETRY_MS = 10000;
+let statusSource = null;
+let statusPoller = null;
+let lastLogSeq = null;
+let lastLogEpoch = null;
+let consoleLoading = false;
 let consoleInterval = null;
+const CONSOLE_MAX_LINES = 1000;
 const md5Regex = /[a-fA-F0-9]{32}/;
 let subdirectoriesTagInput = null;
 
@@ -102,8 +112,100 @@ function getVersion() {
     .catch((err) => console.error("Failed to load version:", err));
 }
 
+// Local copy of queue and recent history, kept current from /api/status deltas
+function resetStatusState(data) {
+  statusState = { version: data.version, lanes: {}, history: data.recent_history };
+  QUEUE_PRIORITIES.forEach((priority) => (statusState.lanes[priority] = []));
+  data.queue.forEach((item) => queueLane(item).push(item));
+}
+
+function queueLane(item) {
+  return statusState.lanes[item.priority] || statusState.lanes.normal;
+}
+
+function removeQueued(md5) {
+  QUEUE_PRIORITIES.forEach((priority) => {
+    statusState.lanes[priority] = statusState.lanes[priority].filter((item) => item.md5 !== md5);
+  });
+}
+
+function queuedItems() {
+  return QUEUE_PRIORITIES.flatMap((priority) => statusState.lanes[priority]);
+}
+
+// Apply the changes from a delta response; returns false if a full refresh is needed
+function applyStatusChanges(changes) {
+  for (const change of changes) {
+    switch (change.op) {
+      case "add":
+        queueLane(change.item).push(change.item);
+        break;
+      case "requeue":
+        if (change.front === false) {
+          queueLane(change.item).push(change.item);
+        } else {
+          queueLane(change.item).unshift(change.item);
+        }
+        break;
+      case "remove":
+        removeQueued(change.md5);
+        break;
+      case "complete":
+        removeQueued(change.item.md5);
+        statusState.history.unshift(change.item);
+        break;
+      case "clear_queue":
+        QUEUE_PRIORITIES.forEach((priority) => (statusState.lanes[priority] = []));
+        break;
+      case "clear_history":
+        statusState.history = [];
+        break;
+      default:
+        // retry and trim_history can pull older entries into the recent
+        // history window, which only the server knows about
+        return false;
+    }
+  }
+  statusState.history = statusState.history.slice(0, RECENT_HISTORY_SIZE);
+  return true;
+}
+
+// Drop the local state and fetch everything again
+function resyncStatus() {
+  statusState = null;
+  if (statusSource) {
+    openStatusStream();
+  } else {
+    updateStatus();
+  }
+}
+
+// Receive status over Server-Sent Events, polling while the stream is down
+function openStatusStream() {
+  if (statusSource) {
+    statusSource.close();
+  }
+  const since = statusState ? `?since=${statusState.version}` : "";
+  statusSource = new EventSource("/api/events" + since);
+  statusSource.addEventListener("status", (e) => renderStatus(JSON.parse(e.data)));
+  statusSource.onopen = () => {
+    clearInterval(statusPoller);
+    statusPoller = null;
+  };
+  statusSource.onerror = () => {
+    statusSource.close();
+    statusSource = null;
+    if (!statusPoller) {
+      updateStatus();
+      statusPoller = setInterval(updateStatus, STATUS_POLL_MS);
+    }
+    setTimeout(openStatusStream, STREAM_RETRY_MS);
+  };
+}
+
 function updateStatus() {
-  apiFetch("/api/status")
+  const since = statusState ? `?since=${statusState.version}` : "";
+  apiFetch("/api/status" + since)
     .then((r) => {
       if (r.status === 401 || r.status === 403) {
         console.error("Session authentication failed. Status:", r.status);
@@ -112,108 +214,92 @@ function updateStatus() {
       }
       return r.json();
     })
-    .then((data) => {
-      // Only update when there is a change in data
-      const newDataString = JSON.stringify(data);
-      if (lastData == newDataString) {
-        return;
-      } else {
-        lastData = newDataString;
-      }
-
-      // Update stats
-      const successCount = data.recent_history.filter((h) => h.success).length;
-      const failCount = data.recent_history.filter((h) => !h.success).length;
-
-      document.getElementById("stat-queue").textContent = data.queue_size;
-      document.getElementById("stat-success").textContent = successCount;
-      document.getElementById("stat-failed").textContent = failCount;
-
-      // Update fast download stat
-      const fastCard = document.getElementById("stat-fast-card");
-      if (data.fast_download && data.fast_download.available) {
-        const downloadsLeft = data.fast_download.downloads_left;
-        const downloadsPerDay = data.fast_download.downloads_per_day;
-        if (downloadsLeft !== null && downloadsPerDay !== null) {
-          document.getElementById("stat-fast").textContent = `${downloadsLeft}/${downloadsPerDay}`;
-          fastCard.style.display = "block";
-        } else {
-          fastCard.style.display = "none";
-        }
-      } else {
-        fastCard.style.display = "none";
-      }
-
-      // Update current download
-      const currentDiv = document.getElementById("current-download");
-      if (data.current) {
-        const progress = data.current.progress || {};
-        const percent = progress.percent || 0;
-        const downloaded = formatBytes(progress.downloaded || 0);
-        const total = formatBytes(progress.total_size || 0);
-
-        // Show filename if available, otherwise show MD5
-        const displayName = data.current.filename || data.current.md5;
-        document.getElementById("current-title").textContent = displayName;
-        document.getElementById("current-md5").textContent = data.current.md5;
-
-        // Show subfolder tag if present
-        const currentSubfolderEl = document.getElementById("current-subfolder");
-        if (data.current.subfolder) {
-          currentSubfolderEl.textContent = data.current.subfolder.split("/").pop();
-          currentSubfolderEl.style.display = "inline-block";
-        } else {
-          currentSubfolderEl.style.display = "none";
-        }
-
-        // Show status message if available
-        const statusEl = document.getElementById("current-status");
-        if (data.current.status_message) {
-          statusEl.textContent = data.current.status_message;
-          statusEl.style.display = "block";
-        } else {
-          statusEl.style.display = "none";
-        }
-
-        document.getElementById("current-progress-bar").style.width = percent + "%";
+    .then(renderStatus)
+    .catch((err) => console.error("Failed to update status:", err));
+}
 
-        // Update progress text spans
-        const progressTextEl = document.getElementById("current-progress-text");
-        progressTextEl.querySelector(".progress-bytes").textContent = `${downloaded} / ${total}`;
-        progressTextEl.querySelector(".progress-percent").textContent = `(${percent.toFixed(1)}%)`;
+// Refresh after a user action; an open stream pushes the change by itself
+function refreshStatus() {
+  if (!statusSource) {
+    updateStatus();
+  }
+}
 
-        // Calculate and display transfer speed
-        const speed = progress.speed || 0;
-        progressTextEl.querySelector(".progress-speed").textContent = `(${formatBytes(speed)}/s)`;
+// Render a full or delta status from /api/status or /api/events
+function renderStatus(data) {
+  let listsChanged = true;
+  if (!data.changes) {
+    resetStatusState(data);
+  } else if (!statusState || data.since !== statusState.version || !applyStatusChanges(data.changes)) {
+    return resyncStatus();
+  } else {
+    listsChanged = data.changes.length > 0;
+    statusState.version = data.version;
+  }
+  const history = statusState.history;
+
+  // Only update when there is a change in data
+  const newDataString = JSON.stringify({
+    current: data.current,
+    queue_size: data.queue_size,
+    fast_download: data.fast_download,
+    paused: data.paused,
+  });
+  if (!listsChanged && lastData == newDataString) {
+    return;
+  } else {
+    lastData = newDataString;
+  }
 
-        currentDiv.style.display = "block";
-      } else {
-        currentDiv.style.display = "none";
-      }
+  // Update stats
+  const successCount = history.filter((h) => h.success).length;
+  const failCount = history.filter((h) => !h.success).length;
+
+  document.getElementById("stat-queue").textContent = data.queue_size;
+  document.getElementById("stat-success").textContent = successCount;
+  document.getElementById("stat-failed").textContent = failCount;
+
+  // Update fast download stat
+  const fastCard = document.getElementById("stat-fast-card");
+  if (data.fast_download && data.fast_download.available) {
+    const downloadsLeft = data.fast_download.downloads_left;
+    const downloadsPerDay = data.fast_download.downloads_per_day;
+    if (downloadsLeft !== null && downloadsPerDay !== null) {
+      document.getElementById("stat-fast").textContent = `${downloadsLeft}/${downloadsPerDay}`;
+      fastCard.style.display = "block";
+    } else {
+      fastCard.style.display = "none";
+    }
+  } else {
+    fastCard.style.display = "none";
+  }
 
-      // Update pause button state
-      const pauseBtn = document.getElementById("pause-btn");
-      if (data.paused) {
-        pauseBtn.title = "Resume downloads";
-        pauseBtn.classList.add("btn-success");
-        pauseBtn.classList.remove("btn-warning");
-        pauseBtn.dataset.icon = "play-circle-line";
-      } else {
-        pauseBtn.title = "Pause downloads";
-        pauseBtn.classList.add("btn-warning");
-        pauseBtn.classList.remove("btn-success");
-        pauseBtn.dataset.icon = "pause-circle-line";
-      }
+  // Update current downloads
+  updateActiveDownloads(data.active || (data.current ? [data.current] : []));
+
+  // Update pause button state
+  const pauseBtn = document.getElementById("pause-btn");
+  if (data.paused) {
+    pauseBtn.title = "Resume downloads";
+    pauseBtn.classList.add("btn-success");
+    pauseBtn.classList.remove("btn-warning");
+    pauseBtn.dataset.icon = "play-circle-line";
+  } else {
+    pauseBtn.title = "Pause downloads";
+    pauseBtn.classList.add("btn-warning");
+    pauseBtn.classList.remove("btn-success");
+    pauseBtn.dataset.icon = "pause-circle-line";
+  }
 
-      // Update queue
-      document.getElementById("queue-count").textContent = data.queue_size;
-      updateQueueList(data.queue);
+  // Update queue
+  document.getElementById("queue-count").textContent = data.queue_size;
+  if (listsChanged) {
+    updateQueueList(queuedItems());
 
-      // Update history
-      document.getElementById("history-count").textContent = data.recent_history.length;
-      updateHistoryList(data.recent_history);
-    })
-    .catch((err) => console.error("Failed to update status:", err));
+    // Update history
+    document.getElementById("history-count").textContent = history.length;
+    updateHistoryList(history);
+  }
 }
 
 // ============================================================================
@@ -221,7 +307,16 @@ function updateStatus() {
 // ============================================================================
 
 function updateConsole() {
-  apiFetch("/api/logs")
+  // Skip if the previous request has not returned yet
+  if (consoleLoading) return;
+  consoleLoading = true;
+
+  // The epoch makes the server send everything again after a restart
+  const after =
+    lastLogSeq !== null
+      ? `?after=${lastLogSeq}&epoch=${encodeURIComponent(lastLogEpoch)}`
+      : "";
+  apiFetch("/api/logs" + after)
     .then((r) => {
       if (r.status === 401 || r.status === 403) {
         window.location.href = "/login";
@@ -231,22 +326,32 @@ function updateConsole() {
     })
     .then((data) => {
       const box = document.getElementById("console");
+      lastLogSeq = data.seq;
+      lastLogEpoch = data.epoch;
 
-      // If nothing changed, skip DOM ops
-      const joined = data.lines.join("\n");
-      if (joined === lastLog) return;
-      lastLog = joined;
+      // Full buffer: clear the container
+      if (data.reset) {
+        box.innerHTML = "";
+      }
 
-      // Clear the container
-      box.innerHTML = "";
+      // If nothing changed, skip DOM ops
+      if (data.lines.length === 0) return;
 
-      // Append each log line as a DOM node
+      // Append each new log line as a DOM node
       data.lines.forEach((line) => {
         box.appendChild(colorize(line));
       });
 
+      // Keep as many lines as the server buffer holds
+      while (box.childElementCount > CONSOLE_MAX_LINES) {
+        box.removeChild(box.firstElementChild);
+      }
+
       // Auto-scroll
       box.scrollTop = box.scrollHeight;
+    })
+    .finally(() => {
+      consoleLoading = false;
     });
 }
 
@@ -276,14 +381,14 @@ function removeFromQueue(md5) {
     body: JSON.stringify({ md5: md5 }),
   })
     .then((r) => r.json())
-    .then(() => updateStatus())
+    .then(() => refreshStatus())
     .catch((err) => console.error("Failed to remove item:", err));
 }
 
 function clearQueue() {
   apiFetch("/api/queue/clear", { method: "POST" })
     .then((r) => r.json())
-    .then(() => updateStatus())
+    .then(() => refreshStatus())
     .catch((err) => console.error("Failed to clear queue:", err));
 }
 
@@ -292,7 +397,7 @@ function togglePause() {
     .then((r) => r.json())
     .then((data) => {
       if (data.success) {
-        updateStatus();
+        refreshStatus();
         toasts.show({
           title: "Queue Control",
           message: data.message,
@@ -303,12 +408,12 @@ function togglePause() {
     .catch((err) => console.error("Failed to toggle pause:", err));
 }
 
-function cancelCurrent() {
-  apiFetch("/api/queue/current/cancel", { method: "POST" })
+function cancelCurrent(md5) {
+  apiFetch("/api/queue/current/cancel", { method: "POST", body: JSON.stringify({ md5 }) })
     .then((r) => r.json())
     .then((data) => {
       if (data.success) {
-        updateStatus();
+        refreshStatus();
         toasts.show({
           title: "Current Download",
           message: data.message,
@@ -325,12 +430,12 @@ function cancelCurrent() {
     .catch((err) => console.error("Failed to cancel current:", err));
 }
 
-function removeCurrent() {
-  apiFetch("/api/queue/current/remove", { method: "POST" })
+function removeCurrent(md5) {
+  apiFetch("/api/queue/current/remove", { method: "POST", body: JSON.stringify({ md5 }) })
     .then((r) => r.json())
     .then((data) => {
       if (data.success) {
-        updateStatus();
+        refreshStatus();
         toasts.show({
           title: "Current Download",
           message: data.message,
@@ -395,7 +500,7 @@ function addDownload() {
           type: "success",
         });
         input.value = "";
-        updateStatus();
+        refreshStatus();
       } else {
         toasts.show({
           title: "Add Download",
@@ -421,7 +526,7 @@ function addDownload() {
 function clearHistory() {
   apiFetch("/api/history/clear", { method: "POST" })
     .then((r) => r.json())
-    .then(() => updateStatus())
+    .then(() => refreshStatus())
     .catch((err) => console.error("Failed to clear history:", err));
 }
 
@@ -433,7 +538,7 @@ function retryFailed(md5) {
     .then((r) => r.json())
     .then((data) => {
       if (data.success) {
-        updateStatus();
+        refreshStatus();
       } else {
         toasts.show({
           title: "Retry",
@@ -486,6 +591,7 @@ function loadSettings() {
 
       // Downloads
       document.getElementById("setting-delay").value = config.downloads?.delay || 2;
+      document.getElementById("setting-concurrent-downloads").value = config.downloads?.concurrent_downloads || 1;
       document.getElementById("setting-retry-count").value = config.downloads?.retry_count || 3;
       document.getElementById("setting-resume-attempts").value = config.downloads?.resume_attempts || 3;
       document.getElementById("setting-incomplete-folder-path").value = config.downloads?.incomplete_folder_path || "/download/incomplete";
@@ -525,6 +631,7 @@ function saveSettings() {
   const config = {
     downloads: {
       delay: parseInt(document.getElementById("setting-delay").value),
+      concurrent_downloads: parseInt(document.getElementById("setting-concurrent-downloads").value),
       retry_count: parseInt(document.getElementById("setting-retry-count").value),
       resume_attempts: parseInt(document.getElementById("setting-resume-attempts").value),
       incomplete_folder_path: document.getElementById("setting-incomplete-folder-path").value,
@@ -579,6 +686,12 @@ function saveSettings() {
             message: "Settings saved successfully! Your password has been updated. Changes are now active.",
             type: "success",
           });
+        } else if (data.migration) {
+          toasts.show({
+            title: "Settings",
+            message: "Settings saved! Unfinished downloads are being moved to the new incomplete folder, downloads continue when that is done.",
+            type: "success",
+          });
         } else {
           toasts.show({
             title: "Settings",
@@ -768,6 +881,70 @@ function testFlaresolverr() {
 // UI UPDATE FUNCTIONS
 // ============================================================================
 
+// One card per download slot, updated in place so progress bars animate
+function updateActiveDownloads(active) {
+  const container = document.getElementById("current-download");
+  const template = document.getElementById("current-download-template");
+
+  // Drop cards of slots that are idle now
+  const slots = new Set(active.map((item) => String(item.slot ?? 0)));
+  Array.from(container.children).forEach((card) => {
+    if (!slots.has(card.dataset.slot)) card.remove();
+  });
+
+  active.forEach((item) => {
+    const slot = String(item.slot ?? 0);
+    let card = container.querySelector(`[data-slot="${slot}"]`);
+    if (!card) {
+      card = template.content.firstElementChild.cloneNode(true);
+      card.dataset.slot = slot;
+      // Keep cards in slot order
+      const next = Array.from(container.children).find((c) => Number(c.dataset.slot) > Number(slot));
+      container.insertBefore(card, next || null);
+    }
+
+    const progress = item.progress || {};
+    const percent = progress.percent || 0;
+    const downloaded = formatBytes(progress.downloaded || 0);
+    const total = formatBytes(progress.total_size || 0);
+
+    // Show filename if available, otherwise show MD5
+    card.querySelector(".title").textContent = item.filename || item.md5;
+    card.querySelector(".md5").textContent = item.md5;
+
+    // Show subfolder tag if present
+    const subfolderEl = card.querySelector(".item-subfolder");
+    if (item.subfolder) {
+      subfolderEl.textContent = item.subfolder.split("/").pop();
+      subfolderEl.style.display = "inline-block";
+    } else {
+      subfolderEl.style.display = "none";
+    }
+
+    // Show status message if available
+    const statusEl = card.querySelector(".status-message");
+    if (item.status_message) {
+      statusEl.textContent = item.status_message;
+      statusEl.style.display = "block";
+    } else {
+      statusEl.style.display = "none";
+    }
+
+    card.querySelector(".progress-bar").style.width = percent + "%";
+
+    // Update progress text spans
+    const progressTextEl = card.querySelector(".progress-text");
+    progressTextEl.querySelector(".progress-bytes").textContent = `${downloaded} / ${total}`;
+    progressTextEl.querySelector(".progress-percent").textContent = `(${percent.toFixed(1)}%)`;
+    progressTextEl.querySelector(".progress-speed").textContent = `(${formatBytes(progress.speed || 0)}/s)`;
+
+    card.querySelector(".current-cancel-btn").onclick = () => cancelCurrent(item.md5);
+    card.querySelector(".current-remove-btn").onclick = () => removeCurrent(item.md5);
+  });
+
+  container.style.display = active.length ? "block" : "none";
+}
+
 function updateQueueList(queue) {
   const queueList = document.getElementById("queue-list");
 
@@ -959,7 +1136,11 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 });
 
-// Initialize and start polling
-updateStatus();
+// Initialize and start status updates
 getVersion();
-setInterval(updateStatus, 2000);
+if (window.EventSource) {
+  openStatusStream();
+} else {
+  updateStatus();
+  statusPoller = setInterval(updateStatus, STATUS_POLL_MS);
+}